@@ -1,18 +1,24 @@
+import csv
 import os
 import subprocess
 import time
 from datetime import datetime
 
 import click
-from flask import Flask, request, jsonify, send_from_directory, json, current_app
+from flask import Flask, request, jsonify, send_from_directory, json, current_app, stream_with_context
 
 from auth_connect import oauth
-from models import db, ClientCredential
+from models import db, ClientCredential, MigrateDbError, migrate_db as _migrate_db
 from services.client import ClientService, ClientServiceError
+from services.client_config import ClientConfigService, ClientConfigServiceError
 from services.credential import CredentialService, CredentialServiceError
+from services.crl_writer import CrlWriter
 from services.server_config import ServerConfigService, ServerConfigServiceError
+from services.server_config_writer import ServerConfigWriter
+from tools.archive import ArchiveTool
+from tools.args import ArgsTool, ArgsToolError
 from tools.cert import CertTool
-from tools.config import ConfigTool
+from tools.config import ConfigTool, ConfigToolError
 from tools.manage import ManagementTool, ManagementToolError
 
 app = Flask(__name__)
@@ -21,8 +27,12 @@ with open('config.json') as _f_config:
 app.config.from_mapping(_config)
 
 db.init_app(app)
+ClientService.init(_config.get('CLIENT_SERVICE', {}))
 CredentialService.init(_config.get('CREDENTIAL_SERVICE', {}))
+CrlWriter.init(app, _config.get('CREDENTIAL_SERVICE', {}))
 ServerConfigService.init(_config.get('SERVER_CONFIG_SERVICE', {}))
+ClientConfigService.init(_config.get('CLIENT_CONFIG_SERVICE', {}))
+ServerConfigWriter.init(app, _config.get('SERVER_CONFIG_SERVICE', {}))
 ManagementTool.init(_config.get('MANAGEMENT_TOOL', {}))
 
 
@@ -33,8 +43,9 @@ ManagementTool.init(_config.get('MANAGEMENT_TOOL', {}))
 
 def _login_callback(user: oauth.User):
     try:
-        ClientService.sync_oauth_user(user)
-        db.session.commit()
+        if ClientService.sync_oauth_user(user):
+            db.session.commit()
+            ClientService.mark_oauth_user_synced(user)
     except ClientServiceError as e:
         return jsonify(msg=e.msg, detail=e.detail), 500
 
@@ -42,6 +53,12 @@ def _login_callback(user: oauth.User):
 oauth.init_app(app, login_callback=_login_callback)
 
 
+@app.before_request
+def _start_crl_check():
+    # started by the serving processes only (not by the CLI commands), and once again in each forked worker
+    CrlWriter.start_periodic_check()
+
+
 _SERVER_STATUS_CACHE_TTL = app.config.get('SERVER_STATUS_CACHE_TTL', 5)
 _server_status_cache_online = None
 _server_status_cache_expires_at = 0.0
@@ -135,16 +152,27 @@ def api_me():
 def api_my_client():
     try:
         user = oauth.get_user()
-        client = ClientService.get_by_user_id(user.id)
+        if request.args.get('details') == 'true':
+            client = ClientService.get_by_user_id(user.id, with_credential_details=True)
+            if client is None:
+                return jsonify(msg='client not found'), 500
+            return jsonify(client.to_dict(with_credential_details=True))
+
+        # the cert and pkey details are not cached, the metadata of the credentials is
+        client = ClientService.lookup_dict_by_user_id(user.id)
         if client is None:
             return jsonify(msg='client not found'), 500
-
-        with_details = request.args.get('details') == 'true'
-        return jsonify(client.to_dict(with_credential_details=with_details))
+        return jsonify(client)
     except (oauth.OAuthError, ClientServiceError) as e:
         return jsonify(msg=e.msg, detail=e.detail), 500
 
 
+def _update_client_config_files(client_ids=None):
+    # the client config files are named after the common names of the active credentials
+    ClientConfigService.update_files(client_ids)
+    db.session.commit()
+
+
 def _export_config(cred: ClientCredential):
     client = cred.client
     # generate client config
@@ -174,11 +202,11 @@ def _export_config(cred: ClientCredential):
 def api_my_credential_export_config(cid):
     try:
         user = oauth.get_user()
-        client = ClientService.get_by_user_id(user.id)
+        client = ClientService.lookup_by_user_id(user.id)
         if client is None:
             return jsonify(msg='client not found'), 500
 
-        cred = CredentialService.get(cid)
+        cred = CredentialService.get(cid, with_material=True)
         if cred is None:
             return jsonify(msg='credential not found'), 404
 
@@ -193,18 +221,38 @@ def api_my_credential_export_config(cid):
 @app.route('/api/admin/clients')
 @oauth.requires_admin
 def api_admin_all_clients():
+    """
+    Get a page of the clients (50 by default), filtered by the q, has_active_credential and expiring_within_days args
+    and sorted by the sort and desc args. The next page is requested with the returned next_after_id as after_id.
+    """
+    def get_bool_arg(name):
+        value = request.args.get(name)
+        return None if value is None else value == 'true'
+
     try:
-        clients = ClientService.get_all()
-        return jsonify([client.to_dict() for client in clients])
-    except ClientServiceError as e:
-        return jsonify(msg=e.msg, detail=e.detail), 500
+        clients, total, next_after_id = ClientService.search(
+            keyword=request.args.get('q'),
+            has_active_credential=get_bool_arg('has_active_credential'),
+            expiring_within_days=ArgsTool.get_int(request.args, 'expiring_within_days'),
+            sort=request.args.get('sort', 'id'),
+            descending=get_bool_arg('desc') or False,
+            after_id=ArgsTool.get_int(request.args, 'after_id'),
+            limit=ArgsTool.get_int(request.args, 'limit', 50),
+            with_total=get_bool_arg('total') is not False
+        )
+        d = dict(items=[client.to_dict() for client in clients], next_after_id=next_after_id)
+        if total is not None:
+            d['total'] = total
+        return jsonify(d)
+    except (ArgsToolError, ClientServiceError) as e:
+        return jsonify(msg=e.msg, detail=e.detail), 400
 
 
 @app.route('/api/admin/clients/<int:cid>')
 @oauth.requires_admin
 def api_admin_client(cid: int):
     try:
-        client = ClientService.get(cid)
+        client = ClientService.get(cid, with_credential_details=True)
         if client is None:
             return jsonify(msg='client not found'), 400
 
@@ -213,6 +261,38 @@ def api_admin_client(cid: int):
         return jsonify(msg=e.msg, detail=e.detail), 500
 
 
+@app.route('/api/admin/clients/<int:cid>/config', methods=['GET', 'PUT', 'DELETE'])
+@oauth.requires_admin
+def api_admin_client_config(cid: int):
+    try:
+        client = ClientService.get(cid)
+        if client is None:
+            return jsonify(msg='client not found'), 404
+
+        if request.method == 'GET':
+            cc = ClientConfigService.get_for_client(client)
+            if cc is None:
+                return jsonify(msg='client config not found'), 404
+            return jsonify(cc.to_dict())
+        elif request.method == 'PUT':
+            params = request.json
+            routes = [(route.get('ip'), route.get('mask')) for route in params.get('routes') or []]
+            cc = ClientConfigService.set_for_client(client, params.get('fixed_ip'), params.get('fixed_mask'), routes,
+                                                    params.get('is_disabled', False))
+            db.session.commit()
+            # only the file of this client is rewritten, and only if its content has changed
+            ClientConfigService.update_files([client.id])
+            db.session.commit()
+            return jsonify(cc.to_dict())
+        else:  # DELETE
+            ClientConfigService.delete_for_client(client)
+            db.session.commit()
+            ClientConfigService.remove_file_for_client(client)
+            return "", 204
+    except (ClientServiceError, ClientConfigServiceError) as e:
+        return jsonify(msg=e.msg, detail=e.detail), 400
+
+
 @app.route('/api/admin/import-client/<int:user_id>')
 @oauth.requires_admin
 def api_admin_import_client(user_id: int):
@@ -240,9 +320,10 @@ def api_admin_client_generate_credential(cid: int):
         cred = CredentialService.generate_for_client(client)
 
         db.session.commit()
-        CredentialService.update_crl()
+        CrlWriter.request_update()
+        _update_client_config_files([client.id])
         return jsonify(cred.to_dict())
-    except (ClientServiceError, CredentialServiceError) as e:
+    except (ClientServiceError, CredentialServiceError, ClientConfigServiceError) as e:
         return jsonify(msg=e.msg, detail=e.detail), 500
 
 
@@ -259,17 +340,101 @@ def api_admin_credential_revoke(cid: int):
         else:  # DELETE
             CredentialService.unrevoke(cred)
         db.session.commit()
-        CredentialService.update_crl()
+        CrlWriter.request_update()
+        if request.method == 'DELETE':
+            _update_client_config_files([cred.client_id])
         return jsonify(cred.to_dict(with_cert=False, with_pkey=False))
-    except CredentialServiceError as e:
+    except (CredentialServiceError, ClientConfigServiceError) as e:
         return jsonify(msg=e.msg, detail=e.detail), 500
 
 
+def _bulk_update_credentials(credential_ids, client_ids, client_names, expires_before: datetime, unrevoke: bool,
+                             kill_sessions: bool):
+    creds = CredentialService.find(credential_ids, client_ids, client_names, expires_before)
+    if unrevoke:
+        changed = CredentialService.unrevoke_many(creds)
+    else:
+        changed = CredentialService.revoke_many(creds)
+    db.session.commit()  # a single transaction for all the credentials
+
+    killed = []
+    kill_error = None
+    if changed:
+        if kill_sessions and not unrevoke:
+            # the CRL must be in effect before the clients reconnect
+            CredentialService.update_crl()
+            common_names = {cred.common_name or cred.client.name for cred in changed}
+            try:
+                with ManagementTool.connect() as sess:
+                    killed = sess.client_kill_by_common_names(common_names)
+            except ManagementToolError as e:
+                # the changes are committed and in the CRL already, the sessions are rejected on reconnecting anyway
+                kill_error = dict(msg=e.msg, detail=e.detail)
+        else:
+            CrlWriter.request_update()
+        if unrevoke:
+            _update_client_config_files({cred.client_id for cred in changed})
+    return changed, killed, kill_error
+
+
+@app.route('/api/admin/credentials/revoke', methods=['POST', 'DELETE'])
+@oauth.requires_admin
+def api_admin_credentials_revoke():
+    try:
+        params = request.json or {}
+        if not isinstance(params, dict) or not isinstance(params.get('filter') or {}, dict):
+            return jsonify(msg='params and filter must be objects'), 400
+        _filter = params.get('filter') or {}
+        expires_before = _filter.get('expires_before')
+        if expires_before is not None:
+            try:
+                expires_before = datetime.fromisoformat(expires_before)
+            except (TypeError, ValueError):
+                return jsonify(msg='invalid expires_before'), 400
+        unrevoke = request.method == 'DELETE'
+        changed, killed, kill_error = _bulk_update_credentials(
+            params.get('credential_ids'), params.get('client_ids'), _filter.get('client_names'), expires_before,
+            unrevoke, bool(params.get('kill_sessions'))
+        )
+        return jsonify(credentials=[cred.to_dict(with_cert=False, with_pkey=False) for cred in changed],
+                       killed_sessions=killed, kill_error=kill_error)
+    except CredentialServiceError as e:  # malformed or conflicting criteria, nothing is changed
+        return jsonify(msg=e.msg, detail=e.detail), 400
+    except ClientConfigServiceError as e:  # the credentials are changed, but the client config files are not
+        return jsonify(msg=e.msg, detail=e.detail), 500
+
+
+@app.route('/api/admin/credentials/expiring')
+@oauth.requires_admin
+def api_admin_credentials_expiring():
+    try:
+        days = ArgsTool.get_int(request.args, 'days', 30)
+        offset = ArgsTool.get_int(request.args, 'offset', 0)
+        limit = ArgsTool.get_int(request.args, 'limit', 50)
+        creds, total = CredentialService.get_expiring(days, offset, limit, with_client=True)
+        return jsonify(items=[cred.to_dict(with_client=True, with_cert=False, with_pkey=False) for cred in creds],
+                       total=total, offset=offset, limit=limit)
+    except (ArgsToolError, CredentialServiceError) as e:
+        return jsonify(msg=e.msg, detail=e.detail), 400
+
+
+@app.route('/api/admin/credentials/by-serial/<serial_number>')
+@oauth.requires_admin
+def api_admin_credential_by_serial(serial_number: str):
+    try:
+        cred = CredentialService.get_by_serial_number(serial_number)
+        if cred is None:
+            return jsonify(msg='credential not found'), 404
+        return jsonify(cred.to_dict(with_client=True, with_cert=False, with_pkey=False))
+    except CredentialServiceError as e:
+        return jsonify(msg=e.msg, detail=e.detail), 400
+
+
 @app.route('/api/admin/credentials/<int:cid>/export-config')
 @oauth.requires_admin
 def api_admin_credential_export_config(cid: int):
     try:
-        cred = CredentialService.get(cid)
+        cred = CredentialService.get(cid, with_material=True)
         if cred is None:
             return jsonify(msg='credential not found'), 404
 
@@ -278,6 +443,43 @@ def api_admin_credential_export_config(cid: int):
         return jsonify(msg=e.msg, detail=e.detail), 500
 
 
+@app.route('/api/admin/credentials/export-configs', methods=['GET', 'POST'])
+@oauth.requires_admin
+def api_admin_credentials_export_configs():
+    try:
+        if request.method == 'GET':
+            # all clients only if no client_id is given at all, a malformed one must not widen the selection
+            client_ids = ArgsTool.get_int_list(request.args, 'client_id')
+            platforms = request.args.getlist('platform') or ['default']
+        else:  # POST, for large selections
+            params = request.json or {}
+            client_ids = params.get('client_ids')
+            platforms = params.get('platforms') or ['default']
+
+        # validate the params before the streaming starts, as errors can not be reported in the middle of a stream
+        configs = CredentialService.iter_client_configs(client_ids, platforms)
+        first = next(configs, None)
+
+        def generate_entries():
+            if first is not None:
+                yield first
+                yield from configs
+
+        rv = current_app.response_class(
+            stream_with_context(ArchiveTool.iter_zip(generate_entries())),
+            mimetype='application/zip',
+            headers={
+                'Content-Disposition': 'attachment; filename="client-configs.zip"'
+            }
+        )
+        # disable cache
+        rv.cache_control.max_age = 0
+        rv.expires = int(time.time())
+        return rv
+    except (ArgsToolError, CredentialServiceError) as e:
+        return jsonify(msg=e.msg, detail=e.detail), 400
+
+
 @app.route('/api/admin/manage/info')
 @oauth.requires_admin
 def api_admin_manage_info():
@@ -290,13 +492,11 @@ def api_admin_manage_info():
             status = sess.status()
             client_list = status.get('client_list')
             if client_list:
-                # map client to db objects via common name (may fail for clients using imported credentials whose common
-                # names are different from the name of the client/user)
-                common_names = {client['common_name'] for client in client_list}
-                client_db_mapping = ClientService.get_many_by_names(common_names)
+                # map client to db objects via the common names of the credentials (also for the imported ones whose
+                # common names differ from the client names), served by the identity cache or one query
+                client_ids = ClientService.lookup_ids_by_common_names(client['common_name'] for client in client_list)
                 for client in client_list:
-                    db_client = client_db_mapping.get(client['common_name'])
-                    client['_db_client_id'] = db_client.id if db_client else None
+                    client['_db_client_id'] = client_ids.get(client['common_name'])
 
             return jsonify(
                 version=sess.version(),
@@ -362,6 +562,13 @@ def api_admin_manage_shutdown():
         return jsonify(msg=e.msg, detail=e.detail), 500
 
 
+@app.route('/api/admin/stats/caches')
+@oauth.requires_admin
+def api_admin_stats_caches():
+    return jsonify(parsed_cert=CertTool.get_parsed_cache_stats(),
+                   client_identity=ClientService.get_identity_cache_stats())
+
+
 @app.route('/api/admin/server/routes', methods=['GET', 'POST'])
 @oauth.requires_admin
 def api_admin_server_routes():
@@ -372,12 +579,50 @@ def api_admin_server_routes():
             params = request.json
             route = ServerConfigService.add_route(params.get('ip'), params.get('mask'), params.get('description'))
             db.session.commit()
-            ServerConfigService.update_config()
-            return jsonify(route.to_dict())
+            ServerConfigWriter.request_update()
+            # overlaps are allowed (they are collapsed in the config), but reported to the admin
+            overlaps = ServerConfigService.get_route_overlaps(route)
+            return jsonify(dict(route.to_dict(), overlaps=[dict(route=r.to_dict(), relation=relation)
+                                                           for r, relation in overlaps]))
     except ServerConfigServiceError as e:
         return jsonify(msg=e.msg, detail=e.detail), 400
 
 
+@app.route('/api/admin/server/routes/optimized')
+@oauth.requires_admin
+def api_admin_server_routes_optimized():
+    try:
+        routes = ServerConfigService.get_routes()
+        optimized = ServerConfigService.get_optimized_routes()
+        return jsonify(routes=[dict(ip=ip, mask=mask) for ip, mask in optimized],
+                       original_count=len(routes), optimized_count=len(optimized))
+    except ServerConfigServiceError as e:
+        return jsonify(msg=e.msg, detail=e.detail), 400
+
+
+@app.route('/api/admin/server/routes/import', methods=['POST'])
+@oauth.requires_admin
+def api_admin_server_routes_import():
+    """Import the pushed routes of an uploaded server config. Only returns the diff with dry_run=true."""
+    file = request.files.get('file')
+    if file is None:
+        return jsonify(msg='config file is required'), 400
+    clear = request.form.get('clear') == 'true'
+    dry_run = request.form.get('dry_run') == 'true'
+
+    try:
+        directives = ConfigTool.parse_server_config(line.decode(errors='replace') for line in file.stream)
+        routes = ConfigTool.extract_server_routes(directives)
+        description = ServerConfigService.get_import_description(file.filename or 'upload')
+        diff = ServerConfigService.import_routes(routes, description, clear, dry_run)
+        if not dry_run:
+            db.session.commit()
+            ServerConfigWriter.request_update()
+        return jsonify(dict(diff.to_dict(), dry_run=dry_run))
+    except (ServerConfigServiceError, ConfigToolError) as e:
+        return jsonify(msg=e.msg, detail=e.detail), 400
+
+
 @app.route('/api/admin/server/routes/<int:rid>', methods=['GET', 'PUT', 'DELETE'])
 @oauth.requires_admin
 def api_admin_server_route(rid):
@@ -392,12 +637,12 @@ def api_admin_server_route(rid):
             params = request.json
             ServerConfigService.update_route(route, params.get('ip'), params.get('mask'), params.get('description'))
             db.session.commit()
-            ServerConfigService.update_config()
+            ServerConfigWriter.request_update()
             return jsonify(route.to_dict())
         else:  # DELETE
             db.session.delete(route)
             db.session.commit()
-            ServerConfigService.update_config()
+            ServerConfigWriter.request_update()
             return "", 204
     except ServerConfigServiceError as e:
         return jsonify(msg=e.msg, detail=e.detail), 400
@@ -413,6 +658,23 @@ def drop_db():
     db.drop_all()
 
 
+@app.cli.command()
+@click.option('-b', '--batch-size', type=int, default=500)
+def migrate_db(batch_size: int):
+    try:
+        _migrate_db()
+    except MigrateDbError as e:
+        print('%s: %s on %s' % (e.msg, e.detail['index'], ', '.join(e.detail['columns'])))
+        print('Resolve the duplicate values first (e.g. revoke all but one active credential of the clients):')
+        for value in e.detail['values']:
+            print('  %s' % (value,))
+        exit(1)
+    count = CredentialService.backfill_metadata(batch_size)
+    print('Backfilled metadata of %d credential(s)' % count)
+    count = ServerConfigService.backfill_route_networks()
+    print('Backfilled networks of %d route(s)' % count)
+
+
 @app.cli.command()
 @click.argument('client_name')
 @click.argument('cert_file')
@@ -434,9 +696,164 @@ def import_credential(client_name: str, cert_file: str, pkey_file: str, revoked_
     db.session.commit()
     if is_revoked:
         CredentialService.update_crl()
+    else:
+        _update_client_config_files([client.id])
     print(json.dumps(cred.to_dict(), indent=2))
 
 
+@app.cli.command()
+@click.argument('pki_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('-p', '--passphrase', help='Passphrase of the private keys')
+@click.option('-w', '--workers', type=int)
+@click.option('-c', '--chunk-size', type=int, default=64)
+@click.option('-b', '--batch-size', type=int, default=500)
+def import_pki(pki_dir: str, passphrase: str, workers: int, chunk_size: int, batch_size: int):
+    """Import the credentials of an EasyRSA PKI dir into the clients with the same names as the cert common names.
+    Each batch is committed in one transaction and the CRL is updated once at the end."""
+    try:
+        result = CredentialService.import_pki(pki_dir, passphrase.encode() if passphrase else None, workers,
+                                              chunk_size, batch_size)
+    except CredentialServiceError as e:
+        print(e.msg, e.detail or '')
+        exit(1)
+    finally:  # the committed batches must be reflected in the CRL even if a later batch failed
+        CredentialService.update_crl()
+    _update_client_config_files()
+
+    for skipped in result['skipped']:
+        print('%s: %s %s' % (skipped['path'], skipped['msg'], skipped['detail'] or ''))
+    print('%d credential(s) imported (%d revoked), %d skipped' % (result['imported'], result['revoked'],
+                                                                  len(result['skipped'])))
+
+
+@app.cli.command()
+@click.option('-i', '--credential-id', 'credential_ids', type=int, multiple=True)
+@click.option('-c', '--client-id', 'client_ids', type=int, multiple=True)
+@click.option('-n', '--client-name', 'client_names', multiple=True)
+@click.option('-e', '--expires-before', type=click.DateTime())
+@click.option('-u/-U', '--unrevoke/--no-unrevoke', default=False)
+@click.option('-k/-K', '--kill-sessions/--no-kill-sessions', default=False)
+def revoke_credentials(credential_ids, client_ids, client_names, expires_before: datetime, unrevoke: bool,
+                       kill_sessions: bool):
+    # empty tuples mean the option is not given
+    changed, killed, kill_error = _bulk_update_credentials(credential_ids or None, client_ids or None,
+                                                           client_names or None, expires_before, unrevoke,
+                                                           kill_sessions)
+    CrlWriter.flush()
+    print('%s %d credential(s)' % ('Unrevoked' if unrevoke else 'Revoked', len(changed)))
+    if kill_error is not None:
+        print('Failed to kill sessions:', kill_error['msg'], kill_error['detail'] or '')
+        exit(1)
+    if kill_sessions:
+        print('Killed %d session(s)' % len(killed))
+
+
+@app.cli.command()
+@click.option('-f/-F', '--force/--no-force', default=False)
+def update_crl(force: bool):
+    if CredentialService.update_crl(force=force):
+        print('CRL updated')
+    else:
+        print('CRL is up to date')
+
+
+@app.cli.command()
+@click.option('-d', '--days', type=int, default=30)
+@click.option('-b', '--batch-size', type=int, default=100)
+@click.option('-n/-N', '--dry-run/--no-dry-run', default=False)
+def renew_expiring(days: int, batch_size: int, dry_run: bool):
+    """Renew the active credentials expiring within the given days. Each batch is committed in one transaction and
+    the CRL is updated once at the end."""
+    creds, total = CredentialService.get_expiring(days, with_client=dry_run)
+    if dry_run:
+        for cred in creds:
+            print('%d\t%s\t%s' % (cred.id, cred.client.name, cred.validity_end))
+        print('%d credential(s) to renew' % total)
+        return
+
+    credential_ids = [cred.id for cred in creds]
+    renewed = 0
+    try:
+        for i in range(0, len(credential_ids), batch_size):
+            # each commit expires the loaded objects, so every batch is reloaded in one query (and its clients in
+            # another) instead of being lazily reloaded one by one, skipping the ones revoked in the meantime
+            batch = CredentialService.find(credential_ids[i:i + batch_size], is_revoked=False, with_client=True)
+            results = [(old.common_name, old.client_id) for old, _ in CredentialService.renew(batch)]
+            db.session.commit()
+            # after the commit, as a concurrent lookup may have cached the old state again before it
+            ClientService.invalidate_common_names(common_name for common_name, _ in results)
+            ClientService.invalidate_clients(client_id for _, client_id in results)
+            renewed += len(results)
+    finally:
+        if renewed:  # the committed batches must be reflected in the CRL even if a later batch failed
+            CredentialService.update_crl()
+    if renewed:
+        _update_client_config_files()
+    print('Renewed %d credential(s)' % renewed)
+
+
+@app.cli.command()
+@click.argument('output', type=click.File('wb'))
+@click.option('-c', '--client-id', 'client_ids', type=int, multiple=True)
+@click.option('-p', '--platform', 'platforms', type=click.Choice(CredentialService.client_config_platforms),
+              multiple=True)
+def export_configs(output, client_ids, platforms):
+    """Export the configs of the active credentials (of all clients by default) into a zip file."""
+    configs = CredentialService.iter_client_configs(client_ids or None, platforms or ['default'])
+    for data in ArchiveTool.iter_zip(configs):
+        output.write(data)
+
+
+@app.cli.command()
+@click.option('-w', '--workers', type=int)
+@click.option('-c', '--chunk-size', type=int, default=500)
+@click.option('-d', '--expiry-warning-days', type=int, default=30)
+@click.option('-a/-A', '--all/--issues-only', 'show_all', default=False)
+@click.option('-o', '--output', type=click.File('w'), default='-')
+def audit_credentials(workers: int, chunk_size: int, expiry_warning_days: int, show_all: bool, output):
+    """Audit all the stored credentials and output a JSON Lines report with a summary line at the end."""
+    total = 0
+    failed = 0
+    issue_counts = {}
+    for result in CredentialService.audit(expiry_warning_days, workers, chunk_size):
+        total += 1
+        if result['issues']:
+            if any(issue.get('level') != 'warning' for issue in result['issues']):
+                failed += 1
+            for issue in result['issues']:
+                issue_counts[issue['check']] = issue_counts.get(issue['check'], 0) + 1
+        if result['issues'] or show_all:
+            output.write(json.dumps(result) + '\n')
+    output.write(json.dumps(dict(summary=dict(total=total, failed=failed, issues=issue_counts))) + '\n')
+    if failed:
+        exit(1)
+
+
+@app.cli.command()
+@click.option('-f/-F', '--force/--no-force', default=False)
+def update_client_configs(force: bool):
+    """Write the client config files whose content has changed since they were last written."""
+    count = ClientConfigService.update_files(force=force)
+    db.session.commit()
+    print('Wrote %d client config file(s)' % count)
+
+
+@app.cli.command()
+@click.option('-n/-N', '--dry-run/--no-dry-run', default=False)
+def reconcile_client_configs(dry_run: bool):
+    """Rewrite the client config files modified or removed on the disk, and remove the stale ones."""
+    result = ClientConfigService.reconcile(dry_run)
+    db.session.commit()
+    for name in result['written']:
+        print('~ %s' % name)
+    for name in result['removed']:
+        print('- %s' % name)
+    if dry_run:
+        print('%d file(s) to rewrite, %d file(s) to remove' % (len(result['written']), len(result['removed'])))
+    else:
+        print('%d file(s) rewritten, %d file(s) removed' % (len(result['written']), len(result['removed'])))
+
+
 @app.cli.command()
 @click.argument('user_id', type=int)
 @click.argument('name')
@@ -447,6 +864,52 @@ def import_client(user_id: int, name: str, email: str):
     print(json.dumps(client.to_dict(), indent=2))
 
 
+def _iter_client_rows(f, file_format: str):
+    if file_format == 'csv':
+        for row in csv.DictReader(f):
+            user_id = (row.get('user_id') or '').strip()
+            yield dict(user_id=int(user_id) if user_id.isdigit() else user_id or None,
+                       name=(row.get('name') or '').strip(), email=(row.get('email') or '').strip() or None)
+    else:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+@app.cli.command()
+@click.argument('file', type=click.File('r'))
+@click.option('-f', '--format', 'file_format', type=click.Choice(['csv', 'jsonl']))
+@click.option('-b', '--batch-size', type=int, default=1000)
+@click.option('-g/-G', '--generate-credentials/--no-generate-credentials', default=False)
+@click.option('-w', '--workers', type=int)
+def import_clients(file, file_format: str, batch_size: int, generate_credentials: bool, workers: int):
+    """Import the clients of a CSV (with a header line) or JSON Lines file with the user_id, name and email fields.
+    The invalid and duplicate rows are skipped and reported, the others are committed in one transaction."""
+    if file_format is None:  # auto detect
+        _, ext = os.path.splitext(file.name)
+        file_format = 'csv' if ext.lower() == '.csv' else 'jsonl'
+
+    try:
+        result = ClientService.import_many(_iter_client_rows(file, file_format), batch_size)
+        generated = 0
+        if generate_credentials and result.added:
+            generated = CredentialService.generate_for_clients(result.added, workers, batch_size=batch_size)
+        db.session.commit()
+    except (ClientServiceError, CredentialServiceError) as e:
+        print(e.msg, e.detail or '')
+        exit(1)
+
+    for skipped in result.skipped:
+        print('row %d: %s' % (skipped['row'], skipped['msg']))
+    print('%d client(s) added, %d row(s) skipped' % (len(result.added), len(result.skipped)))
+    if generate_credentials:
+        print('%d credential(s) generated' % generated)
+
+
 @app.cli.command()
 @click.argument('file_path')
 @click.option('-t', '--file-type')
@@ -477,22 +940,30 @@ def dump(file_path: str, file_type: str):
 @app.cli.command()
 @click.argument('config_path')
 @click.option('-c/-C', '--clear/--no-clear', default=False)
-def import_routes(config_path: str, clear: bool):
-    configs = ConfigTool.load_server_config(config_path)
-    routes = ConfigTool.extract_server_routes_from_configs(configs)
-
-    if clear:
-        for route in ServerConfigService.get_routes():
-            db.session.delete(route)
-
-    if len(config_path) > 100:
-        description = 'Imported from ...%s' % config_path[-100:]
-    else:
-        description = 'Imported from %s' % config_path
+@click.option('-n/-N', '--dry-run/--no-dry-run', default=False)
+def import_routes(config_path: str, clear: bool, dry_run: bool):
+    """Import the pushed routes of a server config in one transaction. Existing routes missing in the config are
+    only removed with --clear."""
+    try:
+        routes = ConfigTool.extract_server_routes(ConfigTool.load_server_config(config_path))
+        diff = ServerConfigService.import_routes(routes, ServerConfigService.get_import_description(config_path),
+                                                 clear, dry_run)
+    except ConfigToolError as e:
+        print(e.msg, e.detail or '')
+        exit(1)
+    except ServerConfigServiceError as e:
+        print(e.msg)
+        for error in e.detail or []:
+            print('  %s %s: %s' % (error['ip'], error['mask'], error['msg']))
+        exit(1)
 
-    for ip, mask in routes:
-        if clear or not ServerConfigService.get_route_by_ip_mask(ip, mask):
-            ServerConfigService.add_route(ip, mask, description)
+    for ip, mask in diff.added:
+        print('+ %s %s' % (ip, mask))
+    for route in diff.removed:
+        print('- %s %s' % (route.ip, route.mask))
+    print('%d added, %d removed, %d unchanged' % (len(diff.added), len(diff.removed), len(diff.unchanged)))
+    if dry_run:
+        return
     db.session.commit()
     ServerConfigService.update_config()
 
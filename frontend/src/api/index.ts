@@ -1,6 +1,7 @@
 import { apiClient } from '@/api/client'
 import {
   clientCredentialSchema,
+  clientPageSchema,
   clientSchema,
   openVPNInfoSchema,
   openVPNLogLineSchema,
@@ -40,9 +41,11 @@ export async function fetchServerStatus() {
   return openVPNServerStatusSchema.parse(response.data)
 }
 
-export async function fetchAdminClients() {
-  const response = await apiClient.get('/api/admin/clients')
-  return clientSchema.array().parse(response.data)
+export async function fetchAdminClients(keyword: string, afterId: number | null) {
+  const response = await apiClient.get('/api/admin/clients', {
+    params: { q: keyword || undefined, after_id: afterId ?? undefined },
+  })
+  return clientPageSchema.parse(response.data)
 }
 
 export async function fetchAdminClient(clientId: number) {
@@ -1,6 +1,6 @@
 import { describe, expect, it } from 'vitest'
 
-import { clientSchema, userSchema } from '@/api/schemas'
+import { clientPageSchema, clientSchema, userSchema } from '@/api/schemas'
 
 describe('api schemas', () => {
   it('parses user payload', () => {
@@ -28,4 +28,18 @@ describe('api schemas', () => {
     const parsed = clientSchema.parse(payload)
     expect(parsed.credentials).toEqual([])
   })
+
+  it('parses client page payload', () => {
+    const client = {
+      id: 1,
+      user_id: 2,
+      name: 'client1',
+      created_at: '2020-01-01T00:00:00Z',
+      modified_at: '2020-01-01T00:00:00Z',
+    }
+    const parsed = clientPageSchema.parse({ items: [client], total: 51, next_after_id: 1 })
+    expect(parsed.items[0].name).toBe('client1')
+    expect(parsed.next_after_id).toBe(1)
+    expect(clientPageSchema.parse({ items: [], next_after_id: null }).total).toBeUndefined()
+  })
 })
@@ -69,6 +69,12 @@ export const clientSchema = z.object({
   credentials: z.array(clientCredentialSchema).default([]),
 })
 
+export const clientPageSchema = z.object({
+  items: z.array(clientSchema),
+  total: z.number().optional(),
+  next_after_id: z.union([z.number(), z.null()]),
+})
+
 export const openVPNVersionSchema = z.object({
   management: z.string(),
   openvpn: z.string(),
@@ -142,6 +148,7 @@ export const versionSchema = z.object({
 export type BasicError = z.infer<typeof basicErrorSchema>
 export type User = z.infer<typeof userSchema>
 export type Client = z.infer<typeof clientSchema>
+export type ClientPage = z.infer<typeof clientPageSchema>
 export type ClientCredential = z.infer<typeof clientCredentialSchema>
 export type OpenVPNInfo = z.infer<typeof openVPNInfoSchema>
 export type OpenVPNServerStatus = z.infer<typeof openVPNServerStatusSchema>
@@ -171,6 +171,9 @@ export const translations = {
     adminConfigMaskBadFormat: 'Subnet mask has bad format',
     adminClientsImportClient: 'Import Client',
     adminClientsUserIdRequired: 'User ID is required',
+    adminClientsSearch: 'Search by name, email or user ID',
+    adminClientsLoadMore: 'Load More',
+    adminClientsShown: '{shown} of {total} clients',
     adminClientNoCredentials: 'No credentials. Please generate a new one.',
     adminClientGenerateCredential: 'Generate New Credential',
   },
@@ -324,6 +327,9 @@ export const translations = {
     adminConfigMaskBadFormat: '子网掩码格式错误',
     adminClientsImportClient: '导入客户端',
     adminClientsUserIdRequired: '用户 ID 为必填项',
+    adminClientsSearch: '按名称、邮箱或用户 ID 搜索',
+    adminClientsLoadMore: '加载更多',
+    adminClientsShown: '已显示 {shown} / {total} 个客户端',
     adminClientNoCredentials: '暂无凭证，请生成新的凭证。',
     adminClientGenerateCredential: '生成新凭证',
   },
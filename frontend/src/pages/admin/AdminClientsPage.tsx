@@ -1,6 +1,7 @@
-import { Button, Modal, NumberInput, Stack } from '@mantine/core'
+import { Button, Group, Modal, NumberInput, Stack, Text, TextInput } from '@mantine/core'
 import { useForm } from '@mantine/form'
-import { useMutation, useQuery, useQueryClient } from '@tanstack/react-query'
+import { useDebouncedValue } from '@mantine/hooks'
+import { useInfiniteQuery, useMutation, useQueryClient } from '@tanstack/react-query'
 import { useState } from 'react'
 
 import { fetchAdminClients, importAdminClient } from '@/api'
@@ -13,10 +14,17 @@ export function AdminClientsPage(): React.ReactElement {
   const queryClient = useQueryClient()
   const [localError, setLocalError] = useState<unknown>(null)
   const [opened, setOpened] = useState(false)
-  const { data: clients, error } = useQuery({
-    queryKey: ['admin', 'clients'],
-    queryFn: fetchAdminClients,
+  const [keyword, setKeyword] = useState('')
+  const [debouncedKeyword] = useDebouncedValue(keyword.trim(), 300)
+  // the clients are loaded page by page instead of all at once
+  const { data, error, fetchNextPage, hasNextPage, isFetchingNextPage } = useInfiniteQuery({
+    queryKey: ['admin', 'clients', debouncedKeyword],
+    queryFn: ({ pageParam }) => fetchAdminClients(debouncedKeyword, pageParam),
+    initialPageParam: null as number | null,
+    getNextPageParam: (lastPage) => lastPage.next_after_id ?? undefined,
   })
+  const clients = data?.pages.flatMap((page) => page.items)
+  const total = data?.pages[0]?.total
 
   const form = useForm<{ user_id: number | '' }>({
     initialValues: {
@@ -40,7 +48,24 @@ export function AdminClientsPage(): React.ReactElement {
   return (
     <Stack>
       <ErrorMessage error={error ?? localError} />
+      <TextInput
+        placeholder={t('adminClientsSearch')}
+        value={keyword}
+        onChange={(event) => setKeyword(event.currentTarget.value)}
+      />
       {clients ? <ClientsTable clients={clients} /> : null}
+      <Group>
+        {hasNextPage ? (
+          <Button variant="default" onClick={() => fetchNextPage()} loading={isFetchingNextPage}>
+            {t('adminClientsLoadMore')}
+          </Button>
+        ) : null}
+        {clients && total !== undefined ? (
+          <Text size="sm" c="dimmed">
+            {t('adminClientsShown', { shown: clients.length, total })}
+          </Text>
+        ) : null}
+      </Group>
       <Button onClick={() => setOpened(true)}>{t('adminClientsImportClient')}</Button>
 
       <Modal opened={opened} onClose={() => setOpened(false)} title={t('adminClientsImportClient')}>
@@ -1,8 +1,14 @@
 from datetime import datetime
+from decimal import Decimal
+from typing import List, Tuple
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text, select, func
 
-from tools.cert import CertTool
+from error import BasicError
+
+from tools.cert import CertTool, Cert
+from tools.route import Network
 
 db = SQLAlchemy()
 
@@ -14,7 +20,7 @@ class Client(db.Model):
 
     email = db.Column(db.String(64))
 
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
     modified_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
@@ -30,13 +36,25 @@ class Client(db.Model):
 
 
 class ClientCredential(db.Model):
+    cert_tool = CertTool  # the cert backend for parsing, configured by CredentialService.init()
+
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
 
-    cert = db.Column(db.LargeBinary)
-    pkey = db.Column(db.LargeBinary)
+    # the PEM blobs are only loaded when accessed (both at once) or when undeferred by the export, detail and CRL
+    # queries, the other paths only need the metadata columns
+    cert = db.deferred(db.Column(db.LargeBinary), group='material')
+    pkey = db.deferred(db.Column(db.LargeBinary), group='material')
+
+    # metadata denormalized from the cert data, so that listing credentials does not need to parse any cert or pkey
+    serial_number = db.Column(db.String(40), index=True)  # lower-case hex string without '0x', max 20 octets
+    common_name = db.Column(db.String(64), index=True)  # may differ from the client name for imported certs
+    validity_start = db.Column(db.DateTime)
+    validity_end = db.Column(db.DateTime, index=True)
+    key_type = db.Column(db.String(8))
+    key_bits = db.Column(db.Integer)
 
-    is_revoked = db.Column(db.Boolean, nullable=False, default=False)
+    is_revoked = db.Column(db.Boolean, nullable=False, default=False, index=True)
     revoked_at = db.Column(db.DateTime)
 
     is_imported = db.Column(db.Boolean, nullable=False, default=False)
@@ -46,31 +64,92 @@ class ClientCredential(db.Model):
 
     client = db.relationship('Client', backref=db.backref('credentials'))
 
+    __table_args__ = (
+        # for the expiry scan of the active credentials
+        db.Index('ix_client_credential_is_revoked_validity_end', 'is_revoked', 'validity_end'),
+        # for the credential filters of the client listing, also serves the lookups by client id
+        db.Index('ix_client_credential_client_id_is_revoked_validity_end', 'client_id', 'is_revoked', 'validity_end'),
+        # each client has at most one active credential, enforced by the database against concurrent requests
+        db.Index('uq_client_credential_active_client_id', 'client_id', unique=True,
+                 postgresql_where=text('NOT is_revoked'), sqlite_where=text('NOT is_revoked')),
+    )
+
     def __repr__(self):
         return '<ClientCredentials %r>' % self.id
 
+    @staticmethod
+    def get_cert_metadata(cert: Cert) -> dict:
+        """Get the values of the metadata columns, for the bulk inserts without creating the objects."""
+        return dict(serial_number=hex(cert.serial_number)[2:], common_name=cert.common_name,
+                    validity_start=cert.validity_start, validity_end=cert.validity_end,
+                    # the public key in the cert shares the same type and size with the paired pkey
+                    key_type=cert.public_key_type, key_bits=cert.public_key_bits)
+
+    def set_cert_metadata(self, cert: Cert):
+        for key, value in self.get_cert_metadata(cert).items():
+            setattr(self, key, value)
+
     def to_dict(self, with_client: bool = False, with_cert: bool = True, with_pkey: bool = True) -> dict:
         d = dict(id=self.id, client_id=self.client_id, is_revoked=self.is_revoked, revoked_at=self.revoked_at,
-                 is_imported=self.is_imported, created_at=self.created_at, modified_at=self.modified_at)
+                 is_imported=self.is_imported, created_at=self.created_at, modified_at=self.modified_at,
+                 serial_number=self.serial_number, common_name=self.common_name,
+                 validity_start=self.validity_start, validity_end=self.validity_end,
+                 key_type=self.key_type, key_bits=self.key_bits)
         if with_client:
             d['client'] = self.client.to_dict()
         if with_cert:
             if self.cert is None:
                 cert_dict = None
             else:
-                cert = CertTool.load_cert(self.cert)
-                cert_dict = cert.to_dict()
+                cert_dict = self.cert_tool.cert_to_dict_cached(self.cert)
             d['cert'] = cert_dict
         if with_pkey:
             if self.pkey is None:
                 pkey_dict = None
+            elif self.key_type is not None:  # use the denormalized metadata if available
+                pkey_dict = dict(type=self.key_type, bits=self.key_bits)
             else:
-                pkey = CertTool.load_pkey(self.pkey)
-                pkey_dict = pkey.to_dict()
+                pkey_dict = self.cert_tool.pkey_to_dict_cached(self.pkey)
             d['pkey'] = pkey_dict
         return d
 
 
+class ClientConfig(db.Model):
+    """Per-client settings, rendered to the file of the client in the client-config-dir of the server."""
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), unique=True, nullable=False)
+
+    fixed_ip = db.Column(db.String(46))  # ifconfig-push
+    fixed_mask = db.Column(db.String(46))
+    routes = db.Column(db.Text)  # routes pushed to this client only, one "ip mask" per line
+    is_disabled = db.Column(db.Boolean, nullable=False, default=False)
+
+    # sha256 hex digest and name of the last written file, to skip rendering unchanged clients
+    rendered_hash = db.Column(db.String(64))
+    file_name = db.Column(db.String(64))  # the cert common name, up to 64 characters
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    modified_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    client = db.relationship('Client', backref=db.backref('config', uselist=False))
+
+    def __repr__(self):
+        return '<ClientConfig %r>' % self.client_id
+
+    def get_routes(self) -> List[Tuple[str, str]]:
+        if not self.routes:
+            return []
+        return [tuple(line.split()) for line in self.routes.splitlines()]
+
+    def set_routes(self, routes: List[Tuple[str, str]]):
+        self.routes = '\n'.join('%s %s' % (ip, mask) for ip, mask in routes) or None
+
+    def to_dict(self) -> dict:
+        return dict(client_id=self.client_id, fixed_ip=self.fixed_ip, fixed_mask=self.fixed_mask,
+                    routes=[dict(ip=ip, mask=mask) for ip, mask in self.get_routes()], is_disabled=self.is_disabled,
+                    created_at=self.created_at, modified_at=self.modified_at)
+
+
 class Route(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     ip = db.Column(db.String(46), nullable=False)  # max length of textual IPv6 address is 45
@@ -79,12 +158,82 @@ class Route(db.Model):
 
     description = db.Column(db.String(128))
 
+    # normalized network, derived from ip and mask (see set_network()); 39 digits hold any IPv6 address as an integer
+    version = db.Column(db.Integer)
+    network_start = db.Column(db.Numeric(39, 0))
+    network_end = db.Column(db.Numeric(39, 0))
+    prefix_length = db.Column(db.Integer)
+
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     modified_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_route_version_network_start_prefix_length', 'version', 'network_start', 'prefix_length'),
+    )
+
     def __repr__(self):
         return '<Route [%r] %r %r>' % (self.id, self.ip, self.mask)
 
+    @staticmethod
+    def get_network_columns(network: Network) -> dict:
+        # bound as decimals, as IPv6 addresses overflow the 64-bit integers of the DB drivers
+        return dict(version=network.version, network_start=Decimal(int(network.network_address)),
+                    network_end=Decimal(int(network.broadcast_address)), prefix_length=network.prefixlen)
+
+    def set_network(self, network: Network):
+        for key, value in self.get_network_columns(network).items():
+            setattr(self, key, value)
+
     def to_dict(self):
         return dict(id=self.id, ip=self.ip, mask=self.mask, description=self.description,
                     created_at=self.created_at, modified_at=self.modified_at)
+
+
+class MigrateDbError(BasicError):
+    pass
+
+
+def _find_unique_index_duplicates(conn, index: db.Index) -> list:
+    """Find the values violating a unique index before creating it, also honoring the WHERE of a partial index."""
+    columns = list(index.columns)
+    query = select(*columns).group_by(*columns).having(func.count() > 1)
+    dialect_name = conn.dialect.name
+    if dialect_name in index.dialect_options and index.dialect_options[dialect_name].get('where') is not None:
+        query = query.where(index.dialect_options[dialect_name]['where'])
+    return [row[0] if len(row) == 1 else tuple(row) for row in conn.execute(query)]
+
+
+def migrate_db():
+    """
+    Bring an existing database up to date with the models: create the missing tables, add the missing columns and
+    create the missing indexes. New columns are always added as nullable and have to be backfilled separately.
+    If existing rows violate a missing unique index (e.g. clients with more than one active credential), MigrateDbError
+    lists the duplicate values to resolve first, before any column or index is added.
+    """
+    db.create_all()  # only creates the missing tables
+
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        missing_indexes = []
+        missing_columns = []
+        for table in db.metadata.sorted_tables:
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            missing_indexes.extend(index for index in table.indexes if index.name not in existing_indexes)
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            missing_columns.extend(column for column in table.columns if column.name not in existing_columns)
+        missing_column_keys = {(column.table.name, column.name) for column in missing_columns}
+        # checked before changing anything, the new columns are all NULL so they cannot have duplicates yet
+        for index in missing_indexes:
+            if index.unique and not any((column.table.name, column.name) in missing_column_keys
+                                        for column in index.columns):
+                duplicates = _find_unique_index_duplicates(conn, index)
+                if duplicates:
+                    raise MigrateDbError('existing rows violate unique index',
+                                         dict(index=index.name, columns=[column.name for column in index.columns],
+                                              values=duplicates))
+
+        for column in missing_columns:
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            conn.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (column.table.name, column.name, column_type)))
+        for index in missing_indexes:
+            index.create(conn, checkfirst=True)
@@ -1,38 +1,161 @@
-from typing import Optional, List, Dict, Iterable
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Iterable, Tuple, NamedTuple
 
-from sqlalchemy import or_
+from sqlalchemy import or_, and_, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
 from auth_connect import oauth
 from error import BasicError
-from models import db, Client
+from models import db, Client, ClientCredential
+from tools.cache import LRUCache
 
 
 class ClientServiceError(BasicError):
     pass
 
 
+class ClientIdentity(NamedTuple):
+    """The basic fields of a client, cached for the lookups on each request."""
+    id: int
+    user_id: int
+    name: str
+    email: Optional[str]
+
+
+class ClientImportResult(NamedTuple):
+    added: List[ClientIdentity]
+    skipped: List[dict]  # dict(row=row number, msg=reason)
+
+
 class ClientService:
+    _sort_columns = {
+        'id': Client.id,
+        'name': Client.name,
+        'user_id': Client.user_id,
+        'created_at': Client.created_at
+    }
+    _max_page_size = 500
+    _name_max_length = Client.__table__.c.name.type.length
+    _email_max_length = Client.__table__.c.email.type.length
+
+    # ('user_id', user id) or ('name', client name) => ClientIdentity, ('common_name', cert common name) => client id,
+    # or ('client', client id) => dict of the client with its credentials. Only the found entries are cached. The TTL
+    # bounds the staleness of the changes made by other processes, the changes made by this process invalidate the
+    # entries.
+    _identity_cache = LRUCache(4096, ttl=60)
+
+    # user id => (name, email) of the users synced recently, to skip the DB on repeated logins
+    _synced_users = LRUCache(4096, ttl=300)
+
+    # dialects supporting INSERT ... ON CONFLICT DO UPDATE
+    _upsert_dialects = {
+        'postgresql': postgresql.insert,
+        'sqlite': sqlite.insert
+    }
+
+    @classmethod
+    def init(cls, config: dict):
+        if 'synced_user_cache_ttl' in config:
+            cls._synced_users.set_ttl(config['synced_user_cache_ttl'])
+        if 'identity_cache_size' in config:
+            cls._identity_cache.resize(config['identity_cache_size'])
+        if 'identity_cache_ttl' in config:
+            cls._identity_cache.set_ttl(config['identity_cache_ttl'])
+
     @staticmethod
-    def get(_id: int) -> Optional[Client]:
+    def _get_query(with_credential_details: bool = False):
+        if with_credential_details:  # load the credentials with their cert and pkey in one more query
+            return Client.query.options(selectinload(Client.credentials).undefer_group('material'))
+        return Client.query
+
+    @classmethod
+    def get(cls, _id: int, with_credential_details: bool = False) -> Optional[Client]:
         if _id is None:
             raise ClientServiceError('id is required')
         if type(_id) is not int:
             raise ClientServiceError('id must be an integer')
 
-        return Client.query.get(_id)
+        return cls._get_query(with_credential_details).filter_by(id=_id).first()
 
     @staticmethod
-    def get_all() -> List[Client]:
-        return Client.query.all()
+    def _get_listing_options():
+        # the credentials of all the clients are loaded by one more query instead of one per client, without the cert
+        # and pkey blobs (deferred by the mapping) as the listing only shows the denormalized metadata
+        return selectinload(Client.credentials)
 
-    @staticmethod
-    def get_by_user_id(user_id: int) -> Optional[Client]:
+    @classmethod
+    def get_all(cls) -> List[Client]:
+        return Client.query.options(cls._get_listing_options()).order_by(Client.id).all()
+
+    @classmethod
+    def search(cls, keyword: str = None, has_active_credential: bool = None, expiring_within_days: int = None,
+               sort: str = 'id', descending: bool = False, after_id: int = None, limit: int = 50,
+               with_total: bool = True) -> Tuple[List[Client], Optional[int], Optional[int]]:
+        """
+        Get a page of the clients with keyset pagination: the page starts after the client with the given id in the
+        sort order, so that deep pages cost the same as the first one. The keyword matches a part of the name or the
+        email, or the user id. Returns the clients, the total count (None if not requested) and the id to get the next
+        page after (None on the last page).
+        """
+        if sort not in cls._sort_columns:
+            raise ClientServiceError('invalid sort', dict(allowed=list(cls._sort_columns)))
+        if after_id is not None and type(after_id) is not int:
+            raise ClientServiceError('after id must be an integer')
+        if type(limit) is not int or not 0 < limit <= cls._max_page_size:
+            raise ClientServiceError('limit must be an integer between 1 and %d' % cls._max_page_size)
+        if expiring_within_days is not None and (type(expiring_within_days) is not int or expiring_within_days < 0):
+            raise ClientServiceError('expiring within days must be a non-negative integer')
+
+        query = Client.query
+        if keyword:
+            pattern = '%%%s%%' % keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions = [Client.name.ilike(pattern, escape='\\'), Client.email.ilike(pattern, escape='\\')]
+            if keyword.isdigit():
+                conditions.append(Client.user_id == int(keyword))
+            query = query.filter(or_(*conditions))
+        # served by the (client_id, is_revoked, validity_end) index of the credentials
+        if has_active_credential is not None:
+            has_active = Client.credentials.any(ClientCredential.is_revoked.is_(False))
+            query = query.filter(has_active if has_active_credential else ~has_active)
+        if expiring_within_days is not None:
+            query = query.filter(Client.credentials.any(and_(
+                ClientCredential.is_revoked.is_(False),
+                ClientCredential.validity_end <= datetime.utcnow() + timedelta(days=expiring_within_days)
+            )))
+        total = query.count() if with_total else None
+
+        sort_column = cls._sort_columns[sort]
+        if after_id is not None:
+            after_value = db.session.query(sort_column).filter(Client.id == after_id).first()
+            if after_value is None:
+                raise ClientServiceError('client of after id not found')
+            after_value = after_value[0]
+            if descending:
+                query = query.filter(or_(sort_column < after_value, and_(sort_column == after_value,
+                                                                         Client.id < after_id)))
+            else:
+                query = query.filter(or_(sort_column > after_value, and_(sort_column == after_value,
+                                                                         Client.id > after_id)))
+        if descending:
+            query = query.order_by(sort_column.desc(), Client.id.desc())
+        else:
+            query = query.order_by(sort_column, Client.id)
+
+        # one more row tells whether there is a next page
+        clients = query.options(cls._get_listing_options()).limit(limit + 1).all()
+        next_after_id = clients[limit - 1].id if len(clients) > limit else None
+        return clients[:limit], total, next_after_id
+
+    @classmethod
+    def get_by_user_id(cls, user_id: int, with_credential_details: bool = False) -> Optional[Client]:
         if user_id is None:
             raise ClientServiceError('user id is required')
         if type(user_id) is not int:
             raise ClientServiceError('user id must be an integer')
 
-        return Client.query.filter_by(user_id=user_id).first()
+        return cls._get_query(with_credential_details).filter_by(user_id=user_id).first()
 
     @staticmethod
     def get_by_name(name: str) -> Optional[Client]:
@@ -41,19 +164,123 @@ class ClientService:
 
         return Client.query.filter_by(name=name).first()
 
-    @staticmethod
-    def get_many_by_names(names: Iterable[str]) -> Dict[str, Client]:
-        if names is None:
-            raise ClientServiceError('names are required')
+    @classmethod
+    def _invalidate_identity(cls, user_id: int, names: Iterable[str], client_id: int = None):
+        """Called on the client writes. A rename or a removal must give both the old and the new names."""
+        cls._identity_cache.invalidate(('user_id', user_id))
+        for name in names:
+            cls._identity_cache.invalidate(('name', name))
+        if client_id is not None:
+            cls._identity_cache.invalidate(('client', client_id))
+
+    @classmethod
+    def _lookup_identity(cls, key: tuple, condition) -> Optional[ClientIdentity]:
+        identity = cls._identity_cache.get(key)
+        if identity is None:
+            row = db.session.query(Client.id, Client.user_id, Client.name, Client.email).filter(condition).first()
+            if row is None:
+                return None
+            identity = ClientIdentity(*row)
+            # either key is then served from the cache
+            cls._identity_cache.put(('user_id', identity.user_id), identity)
+            cls._identity_cache.put(('name', identity.name), identity)
+        return identity
+
+    @classmethod
+    def lookup_by_user_id(cls, user_id: int) -> Optional[ClientIdentity]:
+        """Same as get_by_user_id(), but only the basic fields, served from the identity cache when possible."""
+        if user_id is None:
+            raise ClientServiceError('user id is required')
+        if type(user_id) is not int:
+            raise ClientServiceError('user id must be an integer')
+
+        return cls._lookup_identity(('user_id', user_id), Client.user_id == user_id)
+
+    @classmethod
+    def lookup_by_name(cls, name: str) -> Optional[ClientIdentity]:
+        """Same as get_by_name(), but only the basic fields, served from the identity cache when possible."""
+        if not name:
+            raise ClientServiceError('name is required')
+        if type(name) is not str:
+            raise ClientServiceError('name must be a string')
+
+        return cls._lookup_identity(('name', name), Client.name == name)
+
+    @classmethod
+    def lookup_dict_by_user_id(cls, user_id: int) -> Optional[dict]:
+        """
+        Get the dict of the client of the user with the metadata of its credentials, as returned by Client.to_dict(),
+        served from the identity cache when possible. The returned dict is shared and must not be modified.
+        """
+        identity = cls.lookup_by_user_id(user_id)
+        if identity is None:
+            return None
+
+        d = cls._identity_cache.get(('client', identity.id))
+        if d is None:
+            client = cls.get(identity.id)
+            if client is None:  # removed since the identity was cached
+                return None
+            d = client.to_dict()
+            cls._identity_cache.put(('client', identity.id), d)
+        return d
+
+    @classmethod
+    def lookup_ids_by_common_names(cls, common_names: Iterable[str]) -> Dict[str, int]:
+        """
+        Map the cert common names (e.g. of the live sessions) to the ids of the clients owning the credentials. This
+        also works for the imported credentials whose common names differ from the client names. The common names
+        missing in the identity cache are looked up in one query served by the common name index. If several clients
+        have a cert with the same common name, the owner of the active (then the latest) credential wins.
+        """
+        if common_names is None:
+            raise ClientServiceError('common names are required')
 
         results = {}
-        for client in db.session.query(Client) \
-                .filter(Client.name.in_(list(set(names)))):
-            results[client.name] = client
+        missing = []
+        for common_name in set(common_names):
+            client_id = cls._identity_cache.get(('common_name', common_name))
+            if client_id is None:
+                missing.append(common_name)
+            else:
+                results[common_name] = client_id
+        if missing:
+            found = {}
+            for common_name, client_id in db.session.query(ClientCredential.common_name, ClientCredential.client_id) \
+                    .filter(ClientCredential.common_name.in_(missing)) \
+                    .order_by(ClientCredential.is_revoked, ClientCredential.id.desc()):
+                found.setdefault(common_name, client_id)
+            for common_name, client_id in found.items():
+                cls._identity_cache.put(('common_name', common_name), client_id)
+            results.update(found)
         return results
 
-    @staticmethod
-    def add(user_id: int, name: str, email: str = None) -> Client:
+    @classmethod
+    def invalidate_common_names(cls, common_names: Iterable[Optional[str]]):
+        """Called on the credential writes, as they may change the owner of a common name."""
+        for common_name in set(common_names):
+            if common_name is not None:
+                cls._identity_cache.invalidate(('common_name', common_name))
+
+    @classmethod
+    def invalidate_clients(cls, client_ids: Iterable[Optional[int]]):
+        """Called on the credential writes, as they change the cached dicts of the clients."""
+        for client_id in set(client_ids):
+            if client_id is not None:
+                cls._identity_cache.invalidate(('client', client_id))
+
+    @classmethod
+    def invalidate_credentials(cls, creds: Iterable[ClientCredential]):
+        creds = list(creds)
+        cls.invalidate_common_names(cred.common_name for cred in creds)
+        cls.invalidate_clients(cred.client_id for cred in creds)
+
+    @classmethod
+    def get_identity_cache_stats(cls) -> dict:
+        return cls._identity_cache.stats()
+
+    @classmethod
+    def add(cls, user_id: int, name: str, email: str = None) -> Client:
         if user_id is None:
             raise ClientServiceError('user id is required')
         if type(user_id) is not int:
@@ -66,11 +293,152 @@ class ClientService:
 
         client = Client(user_id=user_id, name=name, email=email)
         db.session.add(client)
+        cls._invalidate_identity(user_id, [name])
 
         return client
 
     @classmethod
-    def sync_oauth_user(cls, user: oauth.User):
+    def _check_import_row(cls, row: Optional[dict], user_ids: set, names: set) -> Optional[str]:
+        if not isinstance(row, dict):
+            return 'invalid row'
+        user_id = row.get('user_id')
+        name = row.get('name')
+        email = row.get('email')
+        if user_id is None:
+            return 'user id is required'
+        if type(user_id) is not int:
+            return 'user id must be an integer'
+        if not name:
+            return 'name is required'
+        if not isinstance(name, str):
+            return 'name must be a string'
+        if len(name) > cls._name_max_length:
+            return 'name too long'
+        if email is not None and not isinstance(email, str):
+            return 'email must be a string'
+        if email and len(email) > cls._email_max_length:
+            return 'email too long'
+        if user_id in user_ids:
+            return 'duplicate user id'
+        if name in names:
+            return 'duplicate name'
+        return None
+
+    @classmethod
+    def import_many(cls, rows: Iterable[dict], batch_size: int = 1000) -> ClientImportResult:
+        """
+        Add the clients of the rows (dicts of user_id, name and optional email, or None for the rows which cannot be
+        parsed), consuming them lazily. The duplicates are checked against the user ids and names of all the existing
+        clients loaded in one query, instead of one query per row, and the clients are inserted in bulk statements of
+        the given batch size. The invalid rows and the duplicates (also within the rows) are skipped and reported with
+        their row numbers, starting from 1.
+        """
+        if rows is None:
+            raise ClientServiceError('rows are required')
+        if type(batch_size) is not int or batch_size <= 0:
+            raise ClientServiceError('batch size must be a positive integer')
+
+        user_ids = set()
+        names = set()
+        for user_id, name in db.session.query(Client.user_id, Client.name):
+            user_ids.add(user_id)
+            names.add(name)
+
+        result = ClientImportResult([], [])
+        batch = []
+        for row_number, row in enumerate(rows, 1):
+            msg = cls._check_import_row(row, user_ids, names)
+            if msg is not None:
+                result.skipped.append(dict(row=row_number, msg=msg))
+                continue
+            user_ids.add(row['user_id'])
+            names.add(row['name'])
+            batch.append(dict(user_id=row['user_id'], name=row['name'], email=row.get('email') or None))
+            if len(batch) >= batch_size:
+                result.added.extend(cls._insert_many(batch))
+                batch = []
+        if batch:
+            result.added.extend(cls._insert_many(batch))
+        return result
+
+    @staticmethod
+    def _insert_many(batch: List[dict]) -> List[ClientIdentity]:
+        savepoint = db.session.begin_nested()
+        try:
+            # one executemany statement, the column defaults are still applied
+            db.session.execute(insert(Client), batch)
+        except IntegrityError:  # added by another process in the meantime
+            savepoint.rollback()
+            raise ClientServiceError('duplicate user id or name')
+        savepoint.commit()
+
+        # the ids are selected back by the unique user ids, as RETURNING with executemany is not portable
+        return [ClientIdentity(*row) for row in
+                db.session.query(Client.id, Client.user_id, Client.name, Client.email)
+                .filter(Client.user_id.in_([d['user_id'] for d in batch]))
+                .order_by(Client.id)]
+
+    @classmethod
+    def sync_oauth_user(cls, user: oauth.User) -> bool:
+        """
+        Create the client of the user, or update its email. Returns whether anything has been written, in which case
+        the caller should commit and then call mark_oauth_user_synced().
+
+        Repeated logins of a user with the same fields are skipped without touching the DB for a while. Otherwise, on
+        PostgreSQL and SQLite, the sync is a single upsert which only updates the row when the email differs.
+        """
+        synced = cls._synced_users.get(user.id)
+        if synced is not None and synced == (user.name, user.email):
+            return False
+
+        dialect = db.session.get_bind().dialect.name
+        if dialect in cls._upsert_dialects:
+            changed = cls._upsert_oauth_user(user, cls._upsert_dialects[dialect])
+        else:
+            changed = cls._sync_oauth_user_orm(user)
+        if changed:  # only cached after the commit, so that a failed commit is retried on the next login
+            cls._synced_users.invalidate(user.id)
+        else:
+            cls.mark_oauth_user_synced(user)
+        return changed
+
+    @classmethod
+    def mark_oauth_user_synced(cls, user: oauth.User):
+        cls._synced_users.put(user.id, (user.name, user.email))
+
+    @classmethod
+    def _upsert_oauth_user(cls, user: oauth.User, insert) -> bool:
+        now = datetime.utcnow()
+        stmt = insert(Client).values(user_id=user.id, name=user.name, email=user.email, created_at=now,
+                                     modified_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Client.user_id],
+            set_=dict(email=stmt.excluded.email, modified_at=now),
+            # the name is never changed, and the row is only written when the email differs
+            where=and_(Client.name == stmt.excluded.name,
+                       Client.email.is_distinct_from(stmt.excluded.email))
+        ).returning(Client.id)
+
+        savepoint = db.session.begin_nested()
+        try:
+            row = db.session.execute(stmt).first()
+        except IntegrityError:  # the name is taken by another user
+            savepoint.rollback()
+            raise ClientServiceError('duplicate user id or name')
+        savepoint.commit()
+
+        if row is not None:  # inserted or updated
+            cls._invalidate_identity(user.id, [user.name], row.id)
+            return True
+
+        # unchanged, or skipped because of a different name
+        identity = cls.lookup_by_user_id(user.id)
+        if identity is not None and identity.name != user.name:
+            raise ClientServiceError('user name mismatch with client name')
+        return False
+
+    @classmethod
+    def _sync_oauth_user_orm(cls, user: oauth.User) -> bool:
         client = cls.get_by_user_id(user.id)
         if client is not None:  # client already exists, check if basic fields match
             if client.name != user.name:
@@ -78,5 +446,8 @@ class ClientService:
             # for mismatches in other fields, just update them
             if client.email != user.email:
                 client.email = user.email
-        else:
-            cls.add(user.id, user.name, user.email)
+                cls._invalidate_identity(client.user_id, [client.name], client.id)
+                return True
+            return False
+        cls.add(user.id, user.name, user.email)
+        return True
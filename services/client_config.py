@@ -0,0 +1,233 @@
+import hashlib
+import ipaddress
+import os
+import re
+from typing import Optional, List, Tuple, Iterable, Iterator
+
+from error import BasicError
+from sqlalchemy import and_
+
+from models import Client, ClientConfig, ClientCredential, db
+from tools.config import ConfigTool
+from tools.fs import FileTool, FileToolError
+from tools.route import RouteTool, RouteToolError
+
+
+class ClientConfigServiceError(BasicError):
+    pass
+
+
+class ClientConfigService:
+    """
+    Per-client configs in the client-config-dir (CCD) of the server. OpenVPN reads the file of a client on each
+    connection, so changes take effect on the next connection without rewriting server.conf or restarting the server.
+    """
+    # the first line of the managed files, so that hand-written files in the same dir are never touched
+    _managed_header = '# managed by vpnman, changes will be overwritten\n'
+    _file_name_regex = re.compile(r'^[a-zA-Z0-9_-][a-zA-Z0-9._-]*$')
+    _ip_max_length = 46
+    _max_routes = 256
+
+    _ccd_path = '/etc/openvpn/ccd'
+
+    @classmethod
+    def init(cls, config: dict):
+        cls._ccd_path = config.get('ccd_path', cls._ccd_path)
+
+    @staticmethod
+    def get_for_client(client: Client) -> Optional[ClientConfig]:
+        if client is None:
+            raise ClientConfigServiceError('client is required')
+
+        return ClientConfig.query.filter_by(client_id=client.id).first()
+
+    @classmethod
+    def set_for_client(cls, client: Client, fixed_ip: str = None, fixed_mask: str = None,
+                       routes: List[Tuple[str, str]] = None, is_disabled: bool = False) -> ClientConfig:
+        if client is None:
+            raise ClientConfigServiceError('client is required')
+        cls._get_file_name(client)
+        fixed_mask, routes = cls._check_fields(fixed_ip, fixed_mask, routes or [])
+
+        cc = cls.get_for_client(client)
+        if cc is None:
+            cc = ClientConfig(client_id=client.id)
+            db.session.add(cc)
+        cc.fixed_ip = fixed_ip or None
+        cc.fixed_mask = fixed_mask or None
+        cc.set_routes(routes)
+        cc.is_disabled = bool(is_disabled)
+        return cc
+
+    @classmethod
+    def _check_fields(cls, fixed_ip: Optional[str], fixed_mask: Optional[str],
+                      routes: List[Tuple[str, str]]) -> Tuple[Optional[str], List[Tuple[str, str]]]:
+        """
+        Check the fields and return the fixed mask and the routes in the forms accepted by OpenVPN: prefix lengths are
+        converted to netmasks and the routes to their network addresses, as done for the server routes.
+        """
+        if bool(fixed_ip) != bool(fixed_mask):
+            raise ClientConfigServiceError('fixed ip and mask must be given together')
+        if fixed_ip:
+            if len(fixed_ip) > cls._ip_max_length or len(fixed_mask) > cls._ip_max_length:
+                raise ClientConfigServiceError('fixed ip or mask too long')
+            try:
+                ipaddress.IPv4Address(fixed_ip)
+                # other than a netmask, the second address of ifconfig-push is the remote endpoint with topology net30
+                if fixed_mask.isdigit():
+                    fixed_mask = str(ipaddress.IPv4Network('0.0.0.0/%s' % fixed_mask).netmask)
+                else:
+                    ipaddress.IPv4Address(fixed_mask)
+            except ValueError:
+                raise ClientConfigServiceError('invalid fixed ip or mask format')
+
+        if len(routes) > cls._max_routes:
+            raise ClientConfigServiceError('too many routes')
+        normalized_routes = []
+        for ip, mask in routes:
+            try:
+                normalized_routes.append(RouteTool.from_network(RouteTool.to_network(ip, mask)))
+            except RouteToolError as e:
+                raise ClientConfigServiceError('invalid route', dict(ip=ip, mask=mask, detail=e.detail))
+        return fixed_mask, normalized_routes
+
+    @classmethod
+    def delete_for_client(cls, client: Client):
+        """Delete the config of the client. The file is left until remove_file_for_client() is called after the
+        commit (otherwise reconcile() removes it), so that a failed commit does not leave the CCD behind the DB."""
+        cc = cls.get_for_client(client)
+        if cc is None:
+            return
+        db.session.delete(cc)
+
+    @classmethod
+    def remove_file_for_client(cls, client: Client):
+        if client is None:
+            raise ClientConfigServiceError('client is required')
+        if cls.get_for_client(client) is not None:
+            raise ClientConfigServiceError('client config still exists')
+        cls._remove_file(cls._get_file_name(client))
+
+    @classmethod
+    def _check_file_name(cls, name: str) -> str:
+        if not cls._file_name_regex.match(name):
+            raise ClientConfigServiceError('common name cannot be used as a file name', name)
+        return name
+
+    @classmethod
+    def _get_file_name(cls, client: Client) -> str:
+        """
+        OpenVPN looks up the file by the common name of the connecting cert, which is the client name for the generated
+        certs but may differ for the imported ones. The common name of the active credential is used, or the client
+        name if the client has none yet.
+        """
+        common_name = db.session.query(ClientCredential.common_name) \
+            .filter(ClientCredential.client_id == client.id, ClientCredential.is_revoked.is_(False)) \
+            .scalar()
+        return cls._check_file_name(common_name or client.name)
+
+    @classmethod
+    def _iter_with_file_names(cls, client_ids: Iterable[int] = None) -> Iterator[Tuple[ClientConfig, str]]:
+        # same as _get_file_name(), with the common names of the active credentials in the same query as the configs
+        query = db.session.query(ClientConfig, Client.name, ClientCredential.common_name) \
+            .join(Client, ClientConfig.client_id == Client.id) \
+            .outerjoin(ClientCredential, and_(ClientCredential.client_id == Client.id,
+                                              ClientCredential.is_revoked.is_(False)))
+        if client_ids is not None:
+            query = query.filter(ClientConfig.client_id.in_(list(client_ids)))
+        for cc, client_name, common_name in query:
+            yield cc, cls._check_file_name(common_name or client_name)
+
+    @classmethod
+    def render(cls, cc: ClientConfig) -> str:
+        lines = [cls._managed_header]
+        if cc.fixed_ip:
+            lines.append('ifconfig-push %s %s\n' % (cc.fixed_ip, cc.fixed_mask))
+        for ip, mask in cc.get_routes():
+            lines.append(ConfigTool.server_route_to_config(ip, mask) + '\n')
+        if cc.is_disabled:
+            lines.append('disable\n')
+        return ''.join(lines)
+
+    @classmethod
+    def update_files(cls, client_ids: Iterable[int] = None, force: bool = False) -> int:
+        """
+        Write the files of the clients whose rendered config or file name differs from the last written one, comparing
+        the content hashes stored in the DB instead of reading the files. The file name changes with the common name of
+        the active credential, so this should also be called after the credential changes. Returns the number of files
+        written.
+        """
+        count = 0
+        for cc, name in cls._iter_with_file_names(client_ids):
+            data = cls.render(cc).encode()
+            digest = hashlib.sha256(data).hexdigest()
+            if not force and digest == cc.rendered_hash and name == cc.file_name:
+                continue
+            cls._write_file(name, data)
+            if cc.file_name and cc.file_name != name:  # written for the common name of a previous credential
+                cls._remove_managed_file(cc.file_name)
+            cc.rendered_hash = digest
+            cc.file_name = name
+            count += 1
+        return count
+
+    @classmethod
+    def reconcile(cls, dry_run: bool = False) -> dict:
+        """
+        Repair drift between the DB and the CCD: rewrite the managed files which are missing or modified on the disk,
+        and remove the managed files of the clients without config. Files without the managed header are left alone.
+        """
+        expected = {}  # file name => (client config, data)
+        for cc, name in cls._iter_with_file_names():
+            expected[name] = (cc, cls.render(cc).encode())
+
+        written = []
+        for name, (cc, data) in expected.items():
+            if cls._read_file(name) != data:
+                written.append(name)
+                if not dry_run:
+                    cls._write_file(name, data)
+                    cc.rendered_hash = hashlib.sha256(data).hexdigest()
+                    cc.file_name = name
+
+        removed = []
+        if os.path.isdir(cls._ccd_path):
+            for name in os.listdir(cls._ccd_path):
+                if name in expected or not cls._file_name_regex.match(name):
+                    continue
+                if cls._is_managed_file(name):
+                    removed.append(name)
+                    if not dry_run:
+                        cls._remove_file(name)
+        return dict(written=written, removed=removed)
+
+    @classmethod
+    def _read_file(cls, name: str) -> Optional[bytes]:
+        path = os.path.join(cls._ccd_path, name)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @classmethod
+    def _is_managed_file(cls, name: str) -> bool:
+        data = cls._read_file(name)
+        return data is not None and data.startswith(cls._managed_header.encode())
+
+    @classmethod
+    def _remove_managed_file(cls, name: str):
+        if cls._is_managed_file(name):
+            cls._remove_file(name)
+
+    @classmethod
+    def _write_file(cls, name: str, data: bytes):
+        try:
+            FileTool.atomic_write(os.path.join(cls._ccd_path, name), data)
+        except FileToolError as e:
+            raise ClientConfigServiceError('failed to write client config file', dict(name=name, detail=e.detail))
+
+    @classmethod
+    def _remove_file(cls, name: str):
+        path = os.path.join(cls._ccd_path, name)
+        if os.path.exists(path):
+            os.remove(path)
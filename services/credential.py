@@ -1,12 +1,24 @@
+import hashlib
 import os
+import re
 import uuid
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import Optional, List, Tuple, Iterable, Iterator
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, undefer, undefer_group
 
 from error import BasicError
 from models import ClientCredential, Client, db
-from tools.cert import CertTool, BuildPKeyParams, BuildCertParams
+from services.client import ClientService
+from tools.cert import CertTool, BuildPKeyParams, BuildCertParams, Cert, PKey
+from tools.cert_audit import CertAuditTool, AuditItem
+from tools.cert_issue import CertIssueTool, IssueRequest
 from tools.config import ConfigTool
+from tools.easyrsa import EasyRsaTool, EasyRsaError
+from tools.fs import FileTool
 
 
 class CredentialServiceError(BasicError):
@@ -24,6 +36,14 @@ class CredentialService:
     _client_base_config_path = '/etc/openvpn/client_base.conf'
     _linux_client_base_config_path = '/etc/openvpn/client_base_linux.conf'
 
+    _cert_tool = CertTool
+
+    # hex serial numbers, allowing some leading zeros on top of the 20 octets
+    _serial_number_regex = re.compile(r'^[0-9a-f]{1,64}$')
+
+    # state of the last CRL written by this process: (fingerprint of the revoked set, time of last update)
+    _crl_state = None
+
     @classmethod
     def init(cls, config: dict):
         cls._ca_cert_path = config.get('ca_cert_path', cls._ca_cert_path)
@@ -36,15 +56,79 @@ class CredentialService:
         cls._client_base_config_path = config.get('client_base_config_path', cls._client_base_config_path)
         cls._linux_client_base_config_path = config.get('linux_client_base_config_path',
                                                         cls._linux_client_base_config_path)
+        cls._cert_tool = CertTool.get_backend(config.get('cert_backend', 'pyopenssl'))
+        ClientCredential.cert_tool = cls._cert_tool
+        if 'parsed_cert_cache_size' in config:
+            CertTool.set_parsed_cache_size(config['parsed_cert_cache_size'])
 
     @staticmethod
-    def get(_id: int) -> Optional[ClientCredential]:
+    def get(_id: int, with_material: bool = False) -> Optional[ClientCredential]:
+        """Get a credential. The cert and pkey are loaded in the same query with with_material, e.g. for exporting."""
         if _id is None:
             raise CredentialServiceError('id is required')
         if type(_id) is not int:
             raise CredentialServiceError('id must be an integer')
 
-        return ClientCredential.query.get(_id)
+        query = ClientCredential.query
+        if with_material:
+            query = query.options(undefer_group('material'))
+        return query.filter_by(id=_id).first()
+
+    @classmethod
+    def get_by_serial_number(cls, serial_number: str) -> Optional[ClientCredential]:
+        """
+        Get a credential by the hex serial number of its cert, served by the serial number index. Leading zeros, the
+        '0x' prefix and the colons of the OpenSSL notation (e.g. '0a:1b:...') are accepted.
+        """
+        if not serial_number:
+            raise CredentialServiceError('serial number is required')
+        serial_number = serial_number.replace(':', '').lower()
+        if serial_number.startswith('0x'):
+            serial_number = serial_number[2:]
+        if not cls._serial_number_regex.match(serial_number):
+            raise CredentialServiceError('invalid serial number format')
+
+        # stored in the same form as hex() without the prefix
+        return ClientCredential.query.filter_by(serial_number=hex(int(serial_number, 16))[2:]).first()
+
+    @staticmethod
+    def has_active_credential(client_id: int) -> bool:
+        """Check with one query served by the (client_id, is_revoked, ...) index, without loading any credential."""
+        return db.session.query(
+            ClientCredential.query.filter(ClientCredential.client_id == client_id,
+                                          ClientCredential.is_revoked.is_(False)).exists()
+        ).scalar()
+
+    @staticmethod
+    @contextmanager
+    def _check_single_active():
+        """
+        Flush the changes made in the block in a savepoint. The checks before the changes are only a fast path:
+        concurrent requests may both pass them, in which case the unique index on the active credential of a client
+        rejects the later one, and only the changes of the block are rolled back.
+        """
+        savepoint = db.session.begin_nested()
+        try:
+            yield
+            db.session.flush()
+        except IntegrityError as e:
+            savepoint.rollback()
+            raise CredentialServiceError('client already has active credentials', str(e.orig))
+        except BaseException:
+            savepoint.rollback()
+            raise
+        savepoint.commit()
+
+    @staticmethod
+    def _to_unique_list(values, item_type: type, name: str) -> list:
+        """
+        Deduplicate the values of a request param, which must be a list (or tuple) of the given type. Other iterables
+        are rejected, as e.g. a string would be taken as a list of its characters.
+        """
+        if not isinstance(values, (list, tuple)) or not all(type(value) is item_type for value in values):
+            type_name = 'integers' if item_type is int else 'strings'
+            raise CredentialServiceError('%s must be a list of %s' % (name, type_name))
+        return list(set(values))
 
     @staticmethod
     def get_all_revoked() -> List[ClientCredential]:
@@ -60,6 +144,81 @@ class CredentialService:
 
         cred.is_revoked = True
         cred.revoked_at = datetime.utcnow()
+        ClientService.invalidate_credentials([cred])
+
+    @staticmethod
+    def find(credential_ids: Iterable[int] = None, client_ids: Iterable[int] = None,
+             client_names: Iterable[str] = None, expires_before: datetime = None,
+             is_revoked: bool = None, with_client: bool = False) -> List[ClientCredential]:
+        """Find the credentials matching all the given criteria. At least one criterion other than is_revoked is
+        required to avoid selecting all the credentials by accident. The clients are loaded in one more query with
+        with_client, instead of one query per credential."""
+        if credential_ids is None and client_ids is None and client_names is None and expires_before is None:
+            raise CredentialServiceError('at least one criterion is required')
+
+        # the criteria select the credentials of bulk changes, so malformed ones are rejected instead of converted
+        query = ClientCredential.query
+        if credential_ids is not None:
+            query = query.filter(ClientCredential.id.in_(
+                CredentialService._to_unique_list(credential_ids, int, 'credential ids')))
+        if client_ids is not None:
+            query = query.filter(ClientCredential.client_id.in_(
+                CredentialService._to_unique_list(client_ids, int, 'client ids')))
+        if client_names is not None:
+            query = query.join(Client).filter(Client.name.in_(
+                CredentialService._to_unique_list(client_names, str, 'client names')))
+        if expires_before is not None:
+            query = query.filter(ClientCredential.validity_end < expires_before)
+        if is_revoked is not None:
+            query = query.filter(ClientCredential.is_revoked.is_(is_revoked))
+        if with_client:
+            query = query.options(selectinload(ClientCredential.client))
+        return query.order_by(ClientCredential.id).all()
+
+    @staticmethod
+    def revoke_many(creds: Iterable[ClientCredential]) -> List[ClientCredential]:
+        """Revoke the given credentials with the same revocation time. Credentials that are already revoked are
+        skipped. Returns the newly revoked credentials."""
+        if creds is None:
+            raise CredentialServiceError('credentials are required')
+
+        now = datetime.utcnow()
+        revoked = []
+        for cred in creds:
+            if cred.is_revoked:
+                continue
+            cred.is_revoked = True
+            cred.revoked_at = now
+            revoked.append(cred)
+        ClientService.invalidate_credentials(revoked)
+        return revoked
+
+    @staticmethod
+    def unrevoke_many(creds: Iterable[ClientCredential]) -> List[ClientCredential]:
+        """Un-revoke the given credentials. Credentials that are not revoked are skipped. Nothing is changed if any
+        client would end up with more than one active credential. Returns the un-revoked credentials."""
+        if creds is None:
+            raise CredentialServiceError('credentials are required')
+
+        creds = [cred for cred in creds if cred.is_revoked]
+        client_ids = set()
+        for cred in creds:
+            if cred.client_id in client_ids:
+                raise CredentialServiceError('multiple credentials of the same client to unrevoke', cred.client.name)
+            client_ids.add(cred.client_id)
+        if client_ids:
+            active = db.session.query(ClientCredential.client_id) \
+                .filter(ClientCredential.client_id.in_(list(client_ids)), ClientCredential.is_revoked.is_(False)) \
+                .first()
+            if active is not None:
+                raise CredentialServiceError('client already has active credentials', 'client id: %d' % active[0])
+
+        with CredentialService._check_single_active():
+            for cred in creds:
+                cred.is_revoked = False
+                cred.revoked_at = None
+        ClientService.invalidate_credentials(creds)
+        return creds
 
     @staticmethod
     def unrevoke(cred: ClientCredential):
@@ -69,43 +228,43 @@ class CredentialService:
         if not cred.is_revoked:
             raise CredentialServiceError('credential is not revoked')
 
-        if any(not cred.is_revoked for cred in cred.client.credentials):
+        if CredentialService.has_active_credential(cred.client_id):
             raise CredentialServiceError('client already has active credentials')
 
-        cred.is_revoked = False
-        cred.revoked_at = None
+        with CredentialService._check_single_active():
+            cred.is_revoked = False
+            cred.revoked_at = None
+        ClientService.invalidate_credentials([cred])
 
     @staticmethod
-    def _add(client: Client, cert_data: bytes, pkey_data: bytes, is_revoked: bool = False, revoked_at: datetime = None,
+    def _add(client: Client, cert: Cert, pkey: PKey, is_revoked: bool = False, revoked_at: datetime = None,
              is_imported: bool = False) -> ClientCredential:
         if client is None:
             raise CredentialServiceError('client is required')
-        if not cert_data:
-            raise CredentialServiceError('cert data is required')
-        if not pkey_data:
-            raise CredentialServiceError('pkey data is required')
+        if cert is None:
+            raise CredentialServiceError('cert is required')
+        if pkey is None:
+            raise CredentialServiceError('pkey is required')
 
         if is_revoked and revoked_at is None:
             raise CredentialServiceError('revoked_at is required when cert is revoked')
 
         # ensure each client has at most one active (non-revoked) credential
-        if not is_revoked and any(not cred.is_revoked for cred in client.credentials):
+        if not is_revoked and CredentialService.has_active_credential(client.id):
             raise CredentialServiceError('client already has active credentials')
 
-        cred = ClientCredential(client=client, cert=cert_data, pkey=pkey_data,
+        cred = ClientCredential(cert=cert.dump(), pkey=pkey.dump(),
                                 is_revoked=is_revoked, revoked_at=revoked_at, is_imported=is_imported)
-        db.session.add(cred)
+        cred.set_cert_metadata(cert)
+        with CredentialService._check_single_active():
+            # linked to the client in the savepoint, so that a rollback also reverts the credentials of the client
+            cred.client = client
+            db.session.add(cred)
+        ClientService.invalidate_credentials([cred])
         return cred
 
     @classmethod
-    def generate_for_client(cls, client: Client) -> ClientCredential:
-        if client is None:
-            raise CredentialServiceError('client is required')
-
-        if any(not cred.is_revoked for cred in client.credentials):
-            raise CredentialServiceError('client already has active credentials')
-
-        # prepare params
+    def _build_params_for_client(cls, client: Client) -> Tuple[BuildPKeyParams, BuildCertParams]:
         now = datetime.utcnow()
         subject = dict(cls._cert_subject_default_fields)  # make a copy first
         subject['commonName'] = client.name
@@ -113,15 +272,123 @@ class CredentialService:
             subject['emailAddress'] = client.email
         pkey_params = BuildPKeyParams(2048)
         cert_params = BuildCertParams(uuid.uuid4().int, now, now + timedelta(days=cls._cert_valid_days), subject)
+        return pkey_params, cert_params
 
-        # load ca cert and ca pkey
-        ca_cert = CertTool.load_cert_file(cls._ca_cert_path)
-        ca_pkey = CertTool.load_pkey_file(cls._ca_pkey_path)
+    @classmethod
+    def generate_for_client(cls, client: Client, ca_cert: Cert = None, ca_pkey: PKey = None) -> ClientCredential:
+        if client is None:
+            raise CredentialServiceError('client is required')
+
+        if cls.has_active_credential(client.id):
+            raise CredentialServiceError('client already has active credentials')
+
+        # prepare params
+        pkey_params, cert_params = cls._build_params_for_client(client)
+
+        # load ca cert and ca pkey (callers generating in batches may pass them in to avoid reloading)
+        if ca_cert is None:
+            ca_cert = cls._cert_tool.load_cert_file(cls._ca_cert_path)
+        if ca_pkey is None:
+            ca_pkey = cls._cert_tool.load_pkey_file(cls._ca_pkey_path)
 
         # start build
-        pkey, cert = CertTool.build_client(pkey_params, cert_params, ca_cert, ca_pkey)
+        pkey, cert = cls._cert_tool.build_client(pkey_params, cert_params, ca_cert, ca_pkey)
 
-        return cls._add(client, cert.dump(), pkey.dump())
+        return cls._add(client, cert, pkey)
+
+    @classmethod
+    def generate_for_clients(cls, clients: Iterable[Client], workers: int = None, chunk_size: int = 16,
+                             batch_size: int = 500) -> int:
+        """
+        Generate the credentials of many clients, e.g. after a bulk import. The clients only need the id, name and
+        email fields (e.g. ClientIdentity), and the ones already having active credentials are skipped. The keys are
+        generated in a process pool and the credentials are inserted in bulk statements of the given batch size.
+        Returns the number of generated credentials.
+        """
+        if clients is None:
+            raise CredentialServiceError('clients are required')
+        if type(batch_size) is not int or batch_size <= 0:
+            raise CredentialServiceError('batch size must be a positive integer')
+
+        with open(cls._ca_cert_path, 'rb') as f:
+            ca_cert_data = f.read()
+        with open(cls._ca_pkey_path, 'rb') as f:
+            ca_pkey_data = f.read()
+
+        # one query instead of one check per client
+        active_client_ids = {client_id for client_id, in db.session.query(ClientCredential.client_id)
+                             .filter(ClientCredential.is_revoked.is_(False))}
+        requests = (IssueRequest(client.id, *cls._build_params_for_client(client))
+                    for client in clients if client.id not in active_client_ids)
+
+        count = 0
+        batch = []
+        for result in CertIssueTool.issue(requests, ca_cert_data, ca_pkey_data, workers, chunk_size, cls._cert_tool):
+            d = ClientCredential.get_cert_metadata(cls._cert_tool.load_cert(result.cert))
+            d.update(client_id=result.key, cert=result.cert, pkey=result.pkey)
+            batch.append(d)
+            if len(batch) >= batch_size:
+                count += cls._insert_many(batch)
+                batch = []
+        if batch:
+            count += cls._insert_many(batch)
+        return count
+
+    @classmethod
+    def _insert_many(cls, batch: List[dict]) -> int:
+        with cls._check_single_active():
+            db.session.execute(insert(ClientCredential), batch)
+        ClientService.invalidate_common_names(d['common_name'] for d in batch)
+        ClientService.invalidate_clients(d['client_id'] for d in batch)
+        return len(batch)
+
+    @staticmethod
+    def get_expiring(within_days: int, offset: int = 0, limit: int = None,
+                     with_client: bool = False) -> Tuple[List[ClientCredential], int]:
+        """Get the active credentials expiring within the given days (including the expired ones), ordered by expiry
+        time. Returns the requested page and the total count. The clients are loaded in one more query with
+        with_client."""
+        if type(within_days) is not int or within_days < 0:
+            raise CredentialServiceError('days must be a non-negative integer')
+        if type(offset) is not int or offset < 0:
+            raise CredentialServiceError('offset must be a non-negative integer')
+        if limit is not None and (type(limit) is not int or limit <= 0):
+            raise CredentialServiceError('limit must be a positive integer')
+
+        # served by the (is_revoked, validity_end) index
+        query = ClientCredential.query \
+            .filter(ClientCredential.is_revoked.is_(False),
+                    ClientCredential.validity_end <= datetime.utcnow() + timedelta(days=within_days))
+        total = query.count()
+        query = query.order_by(ClientCredential.validity_end, ClientCredential.id).offset(offset)
+        if with_client:
+            query = query.options(selectinload(ClientCredential.client))
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all(), total
+
+    @classmethod
+    def renew(cls, creds: Iterable[ClientCredential]) -> List[Tuple[ClientCredential, ClientCredential]]:
+        """Revoke the given active credentials and generate the replacements for their clients. The caller should
+        commit once and update the CRL once for the whole batch, and invalidate the common names and the clients of the
+        old credentials after the commit. Returns pairs of (old, new) credentials."""
+        if creds is None:
+            raise CredentialServiceError('credentials are required')
+
+        # load ca cert and ca pkey only once for the whole batch
+        ca_cert = cls._cert_tool.load_cert_file(cls._ca_cert_path)
+        ca_pkey = cls._cert_tool.load_pkey_file(cls._ca_pkey_path)
+
+        now = datetime.utcnow()
+        results = []
+        for cred in creds:
+            if cred.is_revoked:
+                raise CredentialServiceError('credential is already revoked', 'credential id: %d' % cred.id)
+            cred.is_revoked = True
+            cred.revoked_at = now
+            new_cred = cls.generate_for_client(cred.client, ca_cert, ca_pkey)
+            results.append((cred, new_cred))
+        return results
 
     @classmethod
     def import_for_client(cls, client: Client, cert_path: str, pkey_path: str,
@@ -138,60 +405,259 @@ class CredentialService:
         if not os.path.exists(pkey_path):
             raise CredentialServiceError('pkey file does not exist')
 
-        if not is_revoked and any(not cred.is_revoked for cred in client.credentials):
+        if not is_revoked and cls.has_active_credential(client.id):
             raise CredentialServiceError('client already has active credentials')
 
         # load cert
-        cert = CertTool.load_cert_file(cert_path)
+        cert = cls._cert_tool.load_cert_file(cert_path)
         if check_common_name and cert.common_name != client.name:
             raise CredentialServiceError('cert common name does not match client name')
 
         # load pkey
-        pkey = CertTool.load_pkey_file(pkey_path)
+        pkey = cls._cert_tool.load_pkey_file(pkey_path)
 
         # verify cert and pkey
-        CertTool.verify_cert_pkey(cert, pkey)
+        cls._cert_tool.verify_cert_pkey(cert, pkey)
 
         # load ca cert
-        ca_cert = CertTool.load_cert_file(cls._ca_cert_path)
+        ca_cert = cls._cert_tool.load_cert_file(cls._ca_cert_path)
 
         # verify cert against ca
-        CertTool.verify_cert_ca(cert, ca_cert)
+        cls._cert_tool.verify_cert_ca(cert, ca_cert)
 
         # Dumped data is stored. For certificates, the dumped data is not necessarily the same as the content in the
         # original files. Check the unit test for more details.
-        return cls._add(client, cert.dump(), pkey.dump(), is_revoked, revoked_at, is_imported=True)
+        return cls._add(client, cert, pkey, is_revoked, revoked_at, is_imported=True)
+
+    @classmethod
+    def import_pki(cls, pki_dir: str, passphrase: bytes = None, workers: int = None, chunk_size: int = 64,
+                   batch_size: int = 500) -> dict:
+        """
+        Import the credentials of an EasyRSA PKI dir. The certs are matched to the clients by common name, the pairs
+        and the chains are verified in a process pool, and the revocation state is taken from index.txt. The revoked
+        certs are imported even if they have expired, as the CRL keeps listing them. The expired certs which are not
+        revoked (status 'E' in index.txt, or 'V' with the index not updated yet) are skipped, as an active credential
+        would block the client from getting a new one.
+
+        Certs already imported (by serial number) are skipped, so that the import can be run again after fixing the
+        skipped ones. Changes are committed in batches, the caller should update the CRL once at the end. Returns
+        dict(imported, revoked, skipped), the skipped as dict(path, msg, detail).
+        """
+        if not pki_dir or not os.path.isdir(pki_dir):
+            raise CredentialServiceError('PKI dir does not exist')
+        if type(batch_size) is not int or batch_size <= 0:
+            raise CredentialServiceError('batch size must be a positive integer')
+
+        try:
+            index = EasyRsaTool.load_index(pki_dir)
+        except EasyRsaError as e:
+            raise CredentialServiceError('failed to load PKI index', dict(msg=e.msg, detail=e.detail))
+        with open(cls._ca_cert_path, 'rb') as f:
+            ca_cert_data = f.read()
+
+        # one query each instead of one per cert
+        client_ids = dict(db.session.query(Client.name, Client.id))
+        active_client_ids = {client_id for client_id, in db.session.query(ClientCredential.client_id)
+                             .filter(ClientCredential.is_revoked.is_(False))}
+        serial_numbers = {serial_number for serial_number, in db.session.query(ClientCredential.serial_number)
+                          .filter(ClientCredential.serial_number.isnot(None))}
+
+        result = dict(imported=0, revoked=0, skipped=[])
+        batch = []
+        now = datetime.utcnow()
+        for item in EasyRsaTool.verify(EasyRsaTool.iter_items(pki_dir), ca_cert_data, passphrase, workers,
+                                       chunk_size, cls._cert_tool):
+            if item.error is not None:
+                result['skipped'].append(dict(path=item.cert_path, **item.error))
+                continue
+            d = ClientCredential.get_cert_metadata(cls._cert_tool.load_cert(item.cert))
+            entry = index.get(item.serial_number)
+            client_id = client_ids.get(item.common_name)
+            msg = None
+            if entry is None:
+                msg = 'cert not found in index'
+            elif d['serial_number'] in serial_numbers:
+                msg = 'cert already imported'
+            elif client_id is None:
+                msg = 'client not found'
+            elif entry.status != 'R' and (entry.status == 'E' or d['validity_end'] <= now):
+                msg = 'cert has expired'
+            elif entry.status != 'R' and client_id in active_client_ids:
+                msg = 'client already has active credentials'
+            if msg is not None:
+                result['skipped'].append(dict(path=item.cert_path, msg=msg, detail=item.common_name))
+                continue
+
+            d.update(client_id=client_id, cert=item.cert, pkey=item.pkey, is_revoked=entry.status == 'R',
+                     revoked_at=entry.revoked_at, is_imported=True)
+            batch.append(d)
+            serial_numbers.add(d['serial_number'])
+            if entry.status == 'R':
+                result['revoked'] += 1
+            else:
+                active_client_ids.add(client_id)
+            if len(batch) >= batch_size:
+                result['imported'] += cls._insert_many(batch)
+                db.session.commit()
+                batch = []
+        if batch:
+            result['imported'] += cls._insert_many(batch)
+            db.session.commit()
+        return result
+
+    @classmethod
+    def backfill_metadata(cls, batch_size: int = 500) -> int:
+        """
+        Fill the denormalized cert metadata of the credentials created before the metadata columns were added.
+        Changes are committed in batches. Returns the number of updated credentials.
+        """
+        if type(batch_size) is not int or batch_size <= 0:
+            raise CredentialServiceError('batch size must be a positive integer')
+
+        count = 0
+        while True:
+            creds = ClientCredential.query \
+                .options(undefer(ClientCredential.cert)) \
+                .filter(ClientCredential.serial_number.is_(None), ClientCredential.cert.isnot(None)) \
+                .order_by(ClientCredential.id) \
+                .limit(batch_size) \
+                .all()
+            if not creds:
+                break
+            for cred in creds:
+                cred.set_cert_metadata(cls._cert_tool.load_cert(cred.cert))  # one-off, do not pollute the cache
+            db.session.commit()
+            count += len(creds)
+        return count
+
+    @classmethod
+    def get_revoked_serials(cls) -> List[Tuple[int, datetime]]:
+        """Get (serial number, revoked at) of all revoked credentials, ordered by credential id."""
+        results = []
+        missing_ids = []
+        query = db.session.query(ClientCredential.id, ClientCredential.serial_number, ClientCredential.revoked_at) \
+            .filter(ClientCredential.is_revoked.is_(True)) \
+            .order_by(ClientCredential.id)
+        for _id, serial_number, revoked_at in query:
+            if serial_number is None:  # metadata not backfilled yet
+                missing_ids.append(_id)
+            else:
+                results.append((int(serial_number, 16), revoked_at))
+
+        # fall back to parsing the certs only for those without the denormalized serial number
+        if missing_ids:
+            for cred in ClientCredential.query.options(undefer(ClientCredential.cert)) \
+                    .filter(ClientCredential.id.in_(missing_ids)):
+                results.append((cls._cert_tool.load_cert_cached(cred.cert).serial_number, cred.revoked_at))
+        return results
+
+    @staticmethod
+    def _get_crl_fingerprint(revoke_list: List[Tuple[int, datetime]]) -> str:
+        h = hashlib.sha256()
+        for serial_number, revoked_at in sorted(revoke_list, key=lambda x: x[0]):
+            h.update(('%x:%s\n' % (serial_number, revoked_at.isoformat())).encode())
+        return h.hexdigest()
 
     @classmethod
-    def update_crl(cls):
-        # load revoked certs
-        revoke_list = [(CertTool.load_cert(cred.cert), cred.revoked_at) for cred in cls.get_all_revoked()]
+    def update_crl(cls, force: bool = False) -> bool:
+        """
+        Rebuild the CRL file only if the revoked set has changed since the last update or the CRL has reached half of
+        its validity period. Returns whether the CRL file was rewritten.
+        """
+        # load revoked serial numbers without parsing the certs
+        revoke_list = cls.get_revoked_serials()
+
+        now = datetime.utcnow()
+        fingerprint = cls._get_crl_fingerprint(revoke_list)
+        if not force and cls._crl_state is not None and os.path.exists(cls._crl_path):
+            last_fingerprint, last_update = cls._crl_state
+            refresh_at = last_update + timedelta(days=cls._crl_valid_days) / 2
+            if fingerprint == last_fingerprint and now < refresh_at:
+                return False
 
         # load ca cert and ca pkey
-        ca_cert = CertTool.load_cert_file(cls._ca_cert_path)
-        ca_pkey = CertTool.load_pkey_file(cls._ca_pkey_path)
+        ca_cert = cls._cert_tool.load_cert_file(cls._ca_cert_path)
+        ca_pkey = cls._cert_tool.load_pkey_file(cls._ca_pkey_path)
 
         # start build
-        crl = CertTool.build_crl(revoke_list, ca_cert, ca_pkey, cls._crl_valid_days)
+        crl = cls._cert_tool.build_crl_from_serials(revoke_list, ca_cert, ca_pkey, cls._crl_valid_days)
 
-        # update crl file
-        with open(cls._crl_path, 'wb') as f:
-            f.write(crl.dump())
+        # update crl file atomically, as OpenVPN may read it at any time
+        FileTool.atomic_write(cls._crl_path, crl.dump())
+
+        cls._crl_state = (fingerprint, now)
+        return True
+
+    @staticmethod
+    def iter_audit_items(chunk_size: int = 500) -> Iterator[AuditItem]:
+        """Stream the credentials from the database in chunks instead of loading all of them at once."""
+        query = db.session.query(ClientCredential.id, ClientCredential.cert, ClientCredential.pkey,
+                                 ClientCredential.is_revoked, ClientCredential.serial_number) \
+            .order_by(ClientCredential.id) \
+            .yield_per(chunk_size)
+        for row in query:
+            yield AuditItem(*row)
+
+    @classmethod
+    def audit(cls, expiry_warning_days: int = 30, workers: int = None, chunk_size: int = 500) -> Iterator[dict]:
+        with open(cls._ca_cert_path, 'rb') as f:
+            ca_cert_data = f.read()
+        crl_data = None
+        if os.path.exists(cls._crl_path):
+            with open(cls._crl_path, 'rb') as f:
+                crl_data = f.read()
+        return CertAuditTool.audit(cls.iter_audit_items(chunk_size), ca_cert_data, crl_data,
+                                   expiry_warning_days=expiry_warning_days, workers=workers,
+                                   cert_tool=cls._cert_tool)
 
     @classmethod
     def export_client_config(cls, cred: ClientCredential, is_linux: bool = False) -> str:
         if cred is None:
             raise CredentialServiceError('credential is required')
-
-        # load ca cert
-        ca_cert = CertTool.load_cert_file(cls._ca_cert_path)
-
-        # load client credentials
-        cert = CertTool.load_cert(cred.cert)
-        pkey = CertTool.load_pkey(cred.pkey)
+        if not cred.cert or not cred.pkey:
+            raise CredentialServiceError('credential has no cert or pkey data')
 
         if is_linux:
             base_config_path = cls._linux_client_base_config_path
         else:
             base_config_path = cls._client_base_config_path
-        return ConfigTool.build_client_config(base_config_path, ca_cert, cert, pkey, cls._tls_auth_key_path)
+
+        # The static parts are cached and the stored PEM data of the client is used as is, so nothing is parsed here.
+        # Stored PEM data is always produced by dump(), which is what build_client_config() would output.
+        template = ConfigTool.get_client_config_template(base_config_path, cls._ca_cert_path, cls._tls_auth_key_path,
+                                                         cls._cert_tool)
+        return template.render(cred.cert, cred.pkey)
+
+    client_config_platforms = ('default', 'linux')
+
+    @classmethod
+    def iter_client_configs(cls, client_ids: Iterable[int] = None, platforms: Iterable[str] = ('default',),
+                            chunk_size: int = 200) -> Iterator[Tuple[str, str]]:
+        """
+        Generate (file name, config) of the active credentials of the given clients (all clients if not given). The
+        credentials are streamed from the database in chunks.
+        """
+        platforms = list(platforms)
+        if not platforms:
+            raise CredentialServiceError('at least one platform is required')
+        if any(platform not in cls.client_config_platforms for platform in platforms):
+            raise CredentialServiceError('invalid platform')
+
+        query = db.session.query(Client.name, ClientCredential.cert, ClientCredential.pkey) \
+            .join(ClientCredential.client) \
+            .filter(ClientCredential.is_revoked.is_(False))
+        if client_ids is not None:
+            query = query.filter(ClientCredential.client_id.in_(cls._to_unique_list(client_ids, int, 'client ids')))
+        query = query.order_by(Client.name).yield_per(chunk_size)
+
+        templates = {}
+        for platform in platforms:
+            base_config_path = cls._linux_client_base_config_path if platform == 'linux' \
+                else cls._client_base_config_path
+            templates[platform] = ConfigTool.get_client_config_template(
+                base_config_path, cls._ca_cert_path, cls._tls_auth_key_path, cls._cert_tool)
+
+        for name, cert_data, pkey_data in query:
+            for platform in platforms:
+                file_name = '%s_linux.ovpn' % name if platform == 'linux' else '%s.ovpn' % name
+                yield file_name, templates[platform].render(cert_data, pkey_data)
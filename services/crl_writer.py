@@ -0,0 +1,67 @@
+import logging
+import os
+from threading import Timer
+
+from flask import Flask
+
+from services.credential import CredentialService
+from tools.debounce import Debouncer
+
+logger = logging.getLogger(__name__)
+
+
+class CrlWriter:
+    """
+    Update the CRL file in the background. Bursts of update requests (e.g. a series of revocations) are coalesced into
+    a single rebuild, and the CRL is checked periodically so that it is refreshed before it expires.
+    """
+    _update_delay = 1.0  # seconds
+    _check_interval = 3600  # seconds
+
+    _app = None
+    _debouncer = None
+    _check_timer = None
+    _check_pid = None  # the timer thread is not inherited by forked processes
+
+    @classmethod
+    def init(cls, app: Flask, config: dict):
+        cls._update_delay = config.get('crl_update_delay', cls._update_delay)
+        cls._check_interval = config.get('crl_check_interval', cls._check_interval)
+        cls._app = app
+        cls._debouncer = Debouncer(cls._update, cls._update_delay)
+
+    @classmethod
+    def request_update(cls):
+        cls._debouncer.trigger()
+
+    @classmethod
+    def flush(cls):
+        cls._debouncer.flush()
+
+    @classmethod
+    def start_periodic_check(cls):
+        """Start the periodic check in the current process if not started yet. Cheap enough to call on each
+        request."""
+        if not cls._check_interval or (cls._check_timer is not None and cls._check_pid == os.getpid()):
+            return
+        cls._check_pid = os.getpid()
+        cls._schedule_check()
+
+    @classmethod
+    def _schedule_check(cls):
+        cls._check_timer = Timer(cls._check_interval, cls._periodic_check)
+        cls._check_timer.daemon = True
+        cls._check_timer.start()
+
+    @classmethod
+    def _periodic_check(cls):
+        # update_crl() is a no-op unless the revoked set has changed (e.g. by another process) or the CRL needs a
+        # refresh before its nextUpdate
+        cls.request_update()
+        cls._schedule_check()
+
+    @classmethod
+    def _update(cls):
+        with cls._app.app_context():
+            if CredentialService.update_crl():
+                logger.info('CRL updated')
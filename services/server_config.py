@@ -1,27 +1,54 @@
-import re
-from typing import Optional, List
+import hashlib
+import ipaddress
+import logging
+import os
+from decimal import Decimal
+from typing import Iterable, NamedTuple, Optional, List, Tuple
+
+from sqlalchemy import and_, or_
 
 from error import BasicError
 from models import Route, db
 from tools.config import ConfigTool
+from tools.fs import FileTool
+from tools.manage import ManagementTool, ManagementToolError
+from tools.route import RouteTool, RouteToolError, Network
+
+logger = logging.getLogger(__name__)
 
 
 class ServerConfigServiceError(BasicError):
     pass
 
 
+class RouteDiff(NamedTuple):
+    added: List[Tuple[str, str]]  # (ip, mask) of the new routes
+    removed: List[Route]
+    unchanged: List[Route]
+
+    def to_dict(self):
+        return dict(added=[dict(ip=ip, mask=mask) for ip, mask in self.added],
+                    removed=[route.to_dict() for route in self.removed],
+                    unchanged=[route.to_dict() for route in self.unchanged])
+
+
 class ServerConfigService:
     _ip_max_length = 46
-    _ip_regex = re.compile(r'^(\d{1,3}\.){3}\d{1,3}$')
     _route_description_max_length = 128
 
     _server_config_path = '/etc/openvpn/server.conf'
     _server_base_config_path = '/etc/openvpn/server_base.conf'
+    _reload_signal = None  # signal sent to OpenVPN via the management interface when the config has changed
+    _optimize_routes = True  # collapse duplicate, contained and adjacent routes when building the config
 
     @classmethod
     def init(cls, config: dict):
         cls._server_config_path = config.get('server_config_path', cls._server_config_path)
         cls._server_base_config_path = config.get('server_base_config_path', cls._server_base_config_path)
+        cls._reload_signal = config.get('reload_signal', cls._reload_signal)
+        cls._optimize_routes = config.get('optimize_routes', cls._optimize_routes)
+        if cls._reload_signal is not None and cls._reload_signal not in ManagementTool.signals:
+            raise ServerConfigServiceError('invalid reload signal')
 
     @staticmethod
     def get_route(_id: int) -> Optional[Route]:
@@ -32,14 +59,19 @@ class ServerConfigService:
 
         return Route.query.get(_id)
 
-    @staticmethod
-    def get_route_by_ip_mask(ip: str, mask: str) -> Optional[Route]:
+    @classmethod
+    def get_route_by_ip_mask(cls, ip: str, mask: str) -> Optional[Route]:
         if not ip:
             raise ServerConfigServiceError('ip is required')
         if not mask:
             raise ServerConfigServiceError('mask is required')
 
-        return Route.query.filter_by(ip=ip, mask=mask).first()
+        return cls.get_route_by_network(cls._parse_network(ip, mask))
+
+    @staticmethod
+    def get_route_by_network(network: Network) -> Optional[Route]:
+        return Route.query.filter_by(version=network.version, network_start=Decimal(int(network.network_address)),
+                                     prefix_length=network.prefixlen).first()
 
     @staticmethod
     def get_routes() -> List[Route]:
@@ -47,11 +79,12 @@ class ServerConfigService:
 
     @classmethod
     def add_route(cls, ip: str, mask: str, description: str = None) -> Route:
-        cls._check_route_fields(ip, mask, description)
-        if cls.get_route_by_ip_mask(ip, mask):
+        network = cls._check_route_fields(ip, mask, description)
+        if cls.get_route_by_network(network):
             raise ServerConfigServiceError('duplicate route')
 
-        route = Route(ip=ip, mask=mask, description=description)
+        route = Route(ip=ip, mask=cls._normalize_mask(network), description=description)
+        route.set_network(network)
         db.session.add(route)
         return route
 
@@ -59,18 +92,18 @@ class ServerConfigService:
     def update_route(cls, route: Route, ip: str, mask: str, description: str = None):
         if route is None:
             raise ServerConfigServiceError('route is required')
-        existing_route = cls.get_route_by_ip_mask(ip, mask)
+        network = cls._check_route_fields(ip, mask, description)
+        existing_route = cls.get_route_by_network(network)
         if existing_route and existing_route.id != route.id:
             raise ServerConfigServiceError('duplicate route')
 
-        cls._check_route_fields(ip, mask, description)
-
         route.ip = ip
-        route.mask = mask
+        route.mask = cls._normalize_mask(network)
         route.description = description
+        route.set_network(network)
 
     @classmethod
-    def _check_route_fields(cls, ip, mask, description):
+    def _check_route_fields(cls, ip, mask, description) -> Network:
         if not ip:
             raise ServerConfigServiceError('ip is required')
         if len(ip) > cls._ip_max_length:
@@ -82,17 +115,186 @@ class ServerConfigService:
         if description and len(description) > cls._route_description_max_length:
             raise ServerConfigServiceError('description too long')
 
-        # only ipv4 is supported now
-        if not cls._ip_regex.match(ip) or not all(0 <= int(num) <= 255 for num in ip.split('.')):
+        return cls._parse_network(ip, mask)
+
+    @staticmethod
+    def _parse_network(ip: str, mask: str) -> Network:
+        try:
+            ipaddress.ip_address(ip)
+        except ValueError:
             raise ServerConfigServiceError('invalid ip format')
-        if not cls._ip_regex.match(mask) or not all(0 <= int(num) <= 255 for num in mask.split('.')):
+        try:
+            return RouteTool.to_network(ip, mask)
+        except RouteToolError:
             raise ServerConfigServiceError('invalid mask format')
 
+    @staticmethod
+    def _normalize_mask(network: Network) -> str:
+        """IPv4 masks may also be given as prefix lengths, but OpenVPN only accepts netmasks in "route"."""
+        return RouteTool.from_network(network)[1]
+
+    @staticmethod
+    def backfill_route_networks() -> int:
+        """Set the network columns of the routes created before they existed. Returns the number of routes updated."""
+        count = 0
+        for route in Route.query.filter(Route.version.is_(None)):
+            route.set_network(RouteTool.to_network(route.ip, route.mask))
+            count += 1
+        db.session.commit()
+        return count
+
+    @classmethod
+    def get_route_overlaps(cls, route: Route) -> List[Tuple[Route, str]]:
+        """
+        Get the other routes overlapping with the given route, sorted by network, and how they relate to it: one of
+        'duplicate', 'contains' (the given route contains the other one) and 'contained' (the given route is contained
+        in the other one).
+
+        CIDR networks are either disjoint or nested. The routes containing the given one start at its address masked to
+        one of the shorter prefixes, and the routes contained in it start within its range, so the query only does
+        lookups and one range scan on the (version, network_start, prefix_length) index instead of a full scan.
+        """
+        if route is None:
+            raise ServerConfigServiceError('route is required')
+
+        network = cls._parse_network(route.ip, route.mask)
+        start, prefix, max_prefix = int(network.network_address), network.prefixlen, network.max_prefixlen
+        conditions = [and_(Route.network_start == Decimal(start & ~((1 << (max_prefix - p)) - 1)),
+                           Route.prefix_length == p) for p in range(prefix + 1)]
+        conditions.append(and_(Route.network_start >= Decimal(start),
+                               Route.network_start <= Decimal(int(network.broadcast_address)),
+                               Route.prefix_length > prefix))
+        query = Route.query.filter(Route.version == network.version, or_(*conditions))
+        if route.id is not None:
+            query = query.filter(Route.id != route.id)
+        results = []
+        for other in query.order_by(Route.network_start, Route.prefix_length, Route.id):
+            if other.prefix_length == prefix:
+                relation = 'duplicate'
+            elif other.prefix_length > prefix:
+                relation = 'contains'
+            else:
+                relation = 'contained'
+            results.append((other, relation))
+        return results
+
+    @staticmethod
+    def _get_network_id(network: Network) -> Tuple[int, int, int]:
+        return network.version, int(network.network_address), network.prefixlen
+
+    @classmethod
+    def _get_route_network_id(cls, route: Route) -> Tuple[int, int, int]:
+        if route.version is None:  # network columns not backfilled yet
+            return cls._get_network_id(RouteTool.to_network(route.ip, route.mask))
+        return route.version, int(route.network_start), route.prefix_length
+
+    @classmethod
+    def diff_routes(cls, routes: Iterable[Tuple[str, str]], clear: bool = False) -> RouteDiff:
+        """
+        Compare the given routes with the stored ones in memory, with one query. The stored routes are compared by their
+        network columns, without parsing them again. All the given routes are validated first, and duplicates among them
+        are ignored. The stored routes missing in the given ones are only removed when clearing.
+        """
+        networks = {}  # network id => (ip, mask), in the given order
+        errors = []
+        for ip, mask in routes:
+            try:
+                network = cls._check_route_fields(ip, mask, None)
+            except ServerConfigServiceError as e:
+                errors.append(dict(ip=ip, mask=mask, msg=e.msg))
+                continue
+            networks.setdefault(cls._get_network_id(network), (ip, cls._normalize_mask(network)))
+        if errors:
+            raise ServerConfigServiceError('invalid routes', errors)
+
+        added = []
+        removed = []
+        unchanged = []
+        existing = set()
+        for route in cls.get_routes():
+            network_id = cls._get_route_network_id(route)
+            if network_id in networks:
+                unchanged.append(route)
+                existing.add(network_id)
+            elif clear:
+                removed.append(route)
+        for network_id, route in networks.items():
+            if network_id not in existing:
+                existing.add(network_id)  # the stored routes might have duplicates
+                added.append(route)
+        return RouteDiff(added, removed, unchanged)
+
     @classmethod
-    def update_config(cls):
-        with open(cls._server_config_path, 'w') as f:
-            additional_config = []
-            additional_config.extend([ConfigTool.server_route_to_config(route.ip, route.mask)
-                                      for route in cls.get_routes()])
-            full_config = ConfigTool.build_server_config(cls._server_base_config_path, additional_config)
-            f.write(full_config)
+    def apply_route_diff(cls, diff: RouteDiff, description: str = None):
+        """Apply the diff with one bulk delete and one bulk insert. The caller commits the transaction."""
+        if description and len(description) > cls._route_description_max_length:
+            raise ServerConfigServiceError('description too long')
+
+        if diff.removed:
+            Route.query.filter(Route.id.in_([route.id for route in diff.removed])).delete(synchronize_session=False)
+        if diff.added:
+            db.session.bulk_insert_mappings(Route, [
+                dict(ip=ip, mask=mask, description=description,
+                     **Route.get_network_columns(RouteTool.to_network(ip, mask)))
+                for ip, mask in diff.added
+            ])
+
+    @classmethod
+    def get_import_description(cls, source: str) -> str:
+        prefix = 'Imported from '
+        max_length = cls._route_description_max_length - len(prefix)
+        if len(source) > max_length:
+            source = '...' + source[-(max_length - 3):]
+        return prefix + source
+
+    @classmethod
+    def import_routes(cls, routes: Iterable[Tuple[str, str]], description: str = None, clear: bool = False,
+                      dry_run: bool = False) -> RouteDiff:
+        diff = cls.diff_routes(routes, clear)
+        if not dry_run:
+            cls.apply_route_diff(diff, description)
+        return diff
+
+    @classmethod
+    def get_optimized_routes(cls) -> List[Tuple[str, str]]:
+        try:
+            return RouteTool.optimize((route.ip, route.mask) for route in cls.get_routes())
+        except RouteToolError as e:
+            raise ServerConfigServiceError(e.msg, e.detail)
+
+    @classmethod
+    def render_config(cls) -> str:
+        if cls._optimize_routes:
+            routes = cls.get_optimized_routes()
+        else:
+            routes = [(route.ip, route.mask) for route in cls.get_routes()]
+        additional_config = [ConfigTool.server_route_to_config(ip, mask) for ip, mask in routes]
+        return ConfigTool.build_server_config(cls._server_base_config_path, additional_config)
+
+    @staticmethod
+    def _get_file_digest(path: str) -> Optional[bytes]:
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).digest()
+
+    @classmethod
+    def update_config(cls, force: bool = False) -> bool:
+        """
+        Render the config in memory and write it only if the content differs from the current file. Returns whether the
+        file was rewritten.
+        """
+        data = cls.render_config().encode()
+        if not force and hashlib.sha256(data).digest() == cls._get_file_digest(cls._server_config_path):
+            return False
+
+        # OpenVPN may read the config at any time (e.g. restarted by systemd), so never expose a partial file
+        FileTool.atomic_write(cls._server_config_path, data)
+
+        if cls._reload_signal is not None:
+            try:
+                with ManagementTool.connect() as sess:
+                    sess.signal(cls._reload_signal)
+            except ManagementToolError as e:  # the config is saved anyway and will be loaded on the next restart
+                logger.warning('failed to signal OpenVPN to reload config', exc_info=e)
+        return True
@@ -0,0 +1,38 @@
+import logging
+
+from flask import Flask
+
+from services.server_config import ServerConfigService
+from tools.debounce import Debouncer
+
+logger = logging.getLogger(__name__)
+
+
+class ServerConfigWriter:
+    """
+    Update the server config file in the background, so that a burst of route edits results in a single render.
+    """
+    _update_delay = 1.0  # seconds
+
+    _app = None
+    _debouncer = None
+
+    @classmethod
+    def init(cls, app: Flask, config: dict):
+        cls._update_delay = config.get('update_delay', cls._update_delay)
+        cls._app = app
+        cls._debouncer = Debouncer(cls._update, cls._update_delay)
+
+    @classmethod
+    def request_update(cls):
+        cls._debouncer.trigger()
+
+    @classmethod
+    def flush(cls):
+        cls._debouncer.flush()
+
+    @classmethod
+    def _update(cls):
+        with cls._app.app_context():
+            if ServerConfigService.update_config():
+                logger.info('server config updated')
@@ -0,0 +1,22 @@
+import unittest
+
+from flask import Flask
+
+from models import db
+
+
+class DbTestCase(unittest.TestCase):
+    """Base of the service tests, running each test in an app context with a fresh in-memory SQLite database."""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        db.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
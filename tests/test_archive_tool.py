@@ -0,0 +1,22 @@
+import io
+import unittest
+import zipfile
+
+from tools.archive import ArchiveTool
+
+
+class TestArchiveTool(unittest.TestCase):
+    def test_iter_zip(self):
+        entries = [('client%d.ovpn' % i, 'config %d\n' % i) for i in range(10)]
+        chunks = list(ArchiveTool.iter_zip(iter(entries)))
+        self.assertGreater(len(chunks), len(entries))  # one chunk per entry plus the central directory
+
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual([name for name, _ in entries], zf.namelist())
+            for name, content in entries:
+                self.assertEqual(content.encode(), zf.read(name))
+
+    def test_empty(self):
+        with zipfile.ZipFile(io.BytesIO(b''.join(ArchiveTool.iter_zip([])))) as zf:
+            self.assertEqual([], zf.namelist())
@@ -0,0 +1,24 @@
+import unittest
+
+from werkzeug.datastructures import MultiDict
+
+from tools.args import ArgsTool, ArgsToolError
+
+
+class TestArgsTool(unittest.TestCase):
+    def test_get_int(self):
+        args = MultiDict([('limit', '10'), ('after_id', 'abc'), ('days', '')])
+        self.assertEqual(10, ArgsTool.get_int(args, 'limit'))
+        self.assertEqual(5, ArgsTool.get_int(args, 'offset', 5))
+        self.assertIsNone(ArgsTool.get_int(args, 'offset'))
+        self.assertRaises(ArgsToolError, ArgsTool.get_int, args, 'after_id')
+        self.assertRaises(ArgsToolError, ArgsTool.get_int, args, 'days')
+
+    def test_get_int_list(self):
+        self.assertIsNone(ArgsTool.get_int_list(MultiDict(), 'client_id'))
+        self.assertEqual([1, 2], ArgsTool.get_int_list(MultiDict([('client_id', '1'), ('client_id', '2')]),
+                                                       'client_id'))
+        # a single malformed value fails the whole list instead of being dropped, which could leave no filter at all
+        self.assertRaises(ArgsToolError, ArgsTool.get_int_list, MultiDict([('client_id', 'abc')]), 'client_id')
+        self.assertRaises(ArgsToolError, ArgsTool.get_int_list,
+                          MultiDict([('client_id', '1'), ('client_id', 'x')]), 'client_id')
@@ -0,0 +1,50 @@
+import time
+import unittest
+
+from tools.cache import LRUCache, CacheError
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))  # 'a' becomes the most recently used
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+
+        cache.resize(1)
+        self.assertEqual(1, len(cache))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_get_or_create(self):
+        cache = LRUCache(4)
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return 'value'
+
+        self.assertEqual('value', cache.get_or_create('key', factory))
+        self.assertEqual('value', cache.get_or_create('key', factory))
+        self.assertEqual(1, len(calls))
+
+        stats = cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(0.5, stats['hit_rate'])
+
+    def test_invalid_size(self):
+        self.assertRaises(CacheError, LRUCache, 0)
+
+    def test_ttl(self):
+        cache = LRUCache(4, ttl=0.05)
+        cache.put('a', 1)
+        self.assertEqual(1, cache.get('a'))
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, len(cache))  # expired entries are dropped when found
+
+        self.assertRaises(CacheError, LRUCache, 4, 0)
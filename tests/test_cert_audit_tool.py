@@ -0,0 +1,84 @@
+import unittest
+from datetime import datetime, timedelta
+
+from tools.cert import CertTool, BuildPKeyParams, BuildCertParams
+from tools.cert_audit import CertAuditTool, CertAuditError, AuditItem
+
+
+class TestCertAuditTool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        now = datetime.utcnow()
+        cls.ca_pkey, cls.ca_cert = CertTool.build_ca(BuildPKeyParams(2048), BuildCertParams(
+            1, now - timedelta(days=30), now + timedelta(days=365), dict(commonName='test-ca')))
+        cls.other_ca_pkey, cls.other_ca_cert = CertTool.build_ca(BuildPKeyParams(2048), BuildCertParams(
+            1, now - timedelta(days=30), now + timedelta(days=365), dict(commonName='test-ca')))
+
+    def _build_client(self, serial_number, days, signer=None):
+        now = datetime.utcnow()
+        return CertTool.build_client(BuildPKeyParams(2048), BuildCertParams(
+            serial_number, now - timedelta(days=10), now + timedelta(days=days),
+            dict(commonName='client%d' % serial_number)), *(signer or (self.ca_cert, self.ca_pkey)))
+
+    @staticmethod
+    def _checks(result):
+        return sorted((issue['check'], issue['msg']) for issue in result['issues'])
+
+    def test_audit(self):
+        valid_pkey, valid_cert = self._build_client(2, 100)
+        expiring_pkey, expiring_cert = self._build_client(3, 10)
+        expired_pkey, expired_cert = self._build_client(4, -1)
+        other_pkey, other_cert = self._build_client(5, 100, (self.other_ca_cert, self.other_ca_pkey))
+        items = [
+            AuditItem(1, valid_cert.dump(), valid_pkey.dump(), False, '2'),
+            AuditItem(2, expiring_cert.dump(), expiring_pkey.dump(), False, None),
+            AuditItem(3, expired_cert.dump(), expired_pkey.dump(), False, None),
+            # an expired revoked credential is not reported as expired
+            AuditItem(4, expired_cert.dump(), expired_pkey.dump(), True, None),
+            AuditItem(5, other_cert.dump(), other_pkey.dump(), False, None),
+            AuditItem(6, valid_cert.dump(), expiring_pkey.dump(), False, '2'),
+            AuditItem(7, valid_cert.dump(), None, False, 'ff'),
+            AuditItem(8, None, None, False, None),
+            AuditItem(9, b'garbage', None, False, None),
+        ]
+        results = list(CertAuditTool.audit(items, self.ca_cert.dump(), expiry_warning_days=30, workers=1,
+                                           chunk_size=4))
+        self.assertEqual(list(range(1, 10)), [result['id'] for result in results])
+
+        self.assertEqual([], results[0]['issues'])
+        self.assertEqual('2', results[0]['serial_number'])
+        self.assertEqual(valid_cert.validity_end.isoformat(), results[0]['validity_end'])
+
+        self.assertEqual([dict(check='expiry', msg='cert is expiring soon', level='warning')], results[1]['issues'])
+        self.assertIn(('expiry', 'cert has expired'), self._checks(results[2]))
+        self.assertNotIn('expiry', [issue['check'] for issue in results[3]['issues']])
+        self.assertEqual([('chain', 'CA does not match')], self._checks(results[4]))
+        self.assertEqual([('pkey', 'pkey does not match')], self._checks(results[5]))
+        self.assertEqual([('metadata', 'stored serial number does not match cert'), ('pkey', 'pkey is missing')],
+                         self._checks(results[6]))
+        self.assertEqual([('cert', 'cert is missing')], self._checks(results[7]))
+        self.assertEqual(['cert'], [issue['check'] for issue in results[8]['issues']])
+
+    def test_audit_revocation(self):
+        revoked_pkey, revoked_cert = self._build_client(2, 100)
+        active_pkey, active_cert = self._build_client(3, 100)
+        crl = CertTool.build_crl([(revoked_cert, datetime.utcnow())], self.ca_cert, self.ca_pkey, 30)
+        items = [
+            AuditItem(1, revoked_cert.dump(), revoked_pkey.dump(), True, None),
+            AuditItem(2, active_cert.dump(), active_pkey.dump(), False, None),
+            # the db and the CRL file disagree
+            AuditItem(3, revoked_cert.dump(), revoked_pkey.dump(), False, None),
+            AuditItem(4, active_cert.dump(), active_pkey.dump(), True, None),
+        ]
+        results = list(CertAuditTool.audit(items, self.ca_cert.dump(), crl.dump(), workers=1))
+        self.assertEqual([[], [], [('revocation', 'active credential is listed in CRL')],
+                          [('revocation', 'revoked credential is missing in CRL')]],
+                         [self._checks(result) for result in results])
+
+        # without a CRL file the revocation is not checked
+        results = list(CertAuditTool.audit(items, self.ca_cert.dump(), workers=1))
+        self.assertEqual([[], [], [], []], [self._checks(result) for result in results])
+
+    def test_audit_params(self):
+        self.assertRaises(CertAuditError, CertAuditTool.audit, [], None)
+        self.assertRaises(CertAuditError, CertAuditTool.audit, [], self.ca_cert.dump(), chunk_size=0)
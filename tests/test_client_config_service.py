@@ -0,0 +1,157 @@
+import os
+import tempfile
+from datetime import datetime
+
+from models import db, Client, ClientCredential
+from services.client_config import ClientConfigService, ClientConfigServiceError
+from tests.db_base import DbTestCase
+
+
+class TestClientConfigService(DbTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = tempfile.TemporaryDirectory()
+        ClientConfigService.init(dict(ccd_path=self.folder.name))
+
+        self.clients = [Client(user_id=i, name='client%d' % i) for i in range(3)]
+        db.session.add_all(self.clients)
+        db.session.commit()
+
+    def tearDown(self):
+        super().tearDown()
+        self.folder.cleanup()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.folder.name, name)
+
+    def _read(self, name: str) -> str:
+        with open(self._path(name)) as f:
+            return f.read()
+
+    def _write(self, name: str, data: str):
+        with open(self._path(name), 'w') as f:
+            f.write(data)
+
+    def test_check_fields(self):
+        client = self.clients[0]
+        self.assertRaises(ClientConfigServiceError, ClientConfigService.set_for_client, client, '10.8.0.5')
+        self.assertRaises(ClientConfigServiceError, ClientConfigService.set_for_client, client, None, '255.255.255.0')
+        self.assertRaises(ClientConfigServiceError, ClientConfigService.set_for_client, client, '10.8.0.300',
+                          '255.255.255.0')
+        self.assertRaises(ClientConfigServiceError, ClientConfigService.set_for_client, client,
+                          routes=[('10.0.0.0', '255.0.0.300')])
+        self.assertRaises(ClientConfigServiceError, ClientConfigService.set_for_client, client,
+                          routes=[('not an ip', '255.0.0.0')])
+        self.assertRaises(ClientConfigServiceError, ClientConfigService.set_for_client, client,
+                          routes=[('10.0.0.0', '255.0.0.0')] * 257)
+        self.assertIsNone(ClientConfigService.get_for_client(client))
+
+        self.assertRaises(ClientConfigServiceError, ClientConfigService.set_for_client, client, '10.8.0.5', '33')
+        self.assertIsNone(ClientConfigService.get_for_client(client))
+
+        cc = ClientConfigService.set_for_client(client, '10.8.0.5', '255.255.255.0', [('10.1.0.0', '255.255.0.0')])
+        db.session.commit()
+        self.assertEqual([('10.1.0.0', '255.255.0.0')], cc.get_routes())
+
+        # prefix lengths and host bits are normalized, as OpenVPN only accepts netmasks in "route"
+        cc = ClientConfigService.set_for_client(client, '10.8.0.5', '24', [('10.1.2.3', '24'), ('2001:db8::1', '32')])
+        db.session.commit()
+        self.assertEqual('255.255.255.0', cc.fixed_mask)
+        self.assertEqual([('10.1.2.0', '255.255.255.0'), ('2001:db8::', '32')], cc.get_routes())
+        self.assertIn('push "route 10.1.2.0 255.255.255.0"\n', ClientConfigService.render(cc))
+        self.assertIn('ifconfig-push 10.8.0.5 255.255.255.0\n', ClientConfigService.render(cc))
+
+    def test_update_files(self):
+        for client in self.clients[:2]:
+            ClientConfigService.set_for_client(client, routes=[('10.1.0.0', '255.255.0.0')])
+        db.session.commit()
+        self.assertEqual(2, ClientConfigService.update_files())
+        db.session.commit()
+        self.assertIn('push "route 10.1.0.0 255.255.0.0"\n', self._read('client0'))
+
+        # unchanged configs are skipped by the stored hash, without reading the files
+        self._write('client0', 'modified\n')
+        self.assertEqual(0, ClientConfigService.update_files())
+        self.assertEqual('modified\n', self._read('client0'))
+
+        ClientConfigService.set_for_client(self.clients[1], is_disabled=True)
+        db.session.commit()
+        self.assertEqual(1, ClientConfigService.update_files())
+        self.assertTrue(self._read('client1').endswith('disable\n'))
+
+        self.assertEqual(2, ClientConfigService.update_files(force=True))
+        self.assertTrue(self._read('client0').startswith(ClientConfigService._managed_header))
+
+        # only the given clients
+        ClientConfigService.set_for_client(self.clients[0])
+        ClientConfigService.set_for_client(self.clients[1])
+        db.session.commit()
+        self.assertEqual(1, ClientConfigService.update_files([self.clients[1].id]))
+
+    def test_reconcile(self):
+        for client in self.clients[:2]:
+            ClientConfigService.set_for_client(client, routes=[('10.1.0.0', '255.255.0.0')])
+        db.session.commit()
+        ClientConfigService.update_files()
+        db.session.commit()
+        expected = self._read('client0')
+
+        self._write('client0', ClientConfigService._managed_header + 'modified\n')  # modified
+        os.remove(self._path('client1'))  # missing
+        self._write('stale', ClientConfigService._managed_header)  # managed, without config
+        self._write('manual', 'push "route 10.2.0.0 255.255.0.0"\n')  # not managed
+
+        result = ClientConfigService.reconcile(dry_run=True)
+        self.assertEqual((['client0', 'client1'], ['stale']), (sorted(result['written']), result['removed']))
+        self.assertFalse(os.path.exists(self._path('client1')))
+
+        result = ClientConfigService.reconcile()
+        db.session.commit()
+        self.assertEqual((['client0', 'client1'], ['stale']), (sorted(result['written']), result['removed']))
+        self.assertEqual(expected, self._read('client0'))
+        self.assertEqual(expected, self._read('client1'))
+        self.assertFalse(os.path.exists(self._path('stale')))
+        self.assertEqual('push "route 10.2.0.0 255.255.0.0"\n', self._read('manual'))
+        self.assertEqual(dict(written=[], removed=[]), ClientConfigService.reconcile())
+
+    def test_delete_for_client(self):
+        client = self.clients[0]
+        ClientConfigService.set_for_client(client, routes=[('10.1.0.0', '255.255.0.0')])
+        db.session.commit()
+        ClientConfigService.update_files()
+        db.session.commit()
+
+        # the file is kept if the deletion is not committed
+        ClientConfigService.delete_for_client(client)
+        self.assertTrue(os.path.exists(self._path('client0')))
+        db.session.rollback()
+        self.assertRaises(ClientConfigServiceError, ClientConfigService.remove_file_for_client, client)
+
+        ClientConfigService.delete_for_client(client)
+        db.session.commit()
+        ClientConfigService.remove_file_for_client(client)
+        self.assertFalse(os.path.exists(self._path('client0')))
+
+    def test_file_name(self):
+        client = self.clients[0]
+        ClientConfigService.set_for_client(client, routes=[('10.1.0.0', '255.255.0.0')])
+        db.session.commit()
+        self.assertEqual(1, ClientConfigService.update_files())
+        db.session.commit()
+        self.assertTrue(os.path.exists(self._path('client0')))
+
+        # OpenVPN looks up the file by the common name of the cert, e.g. of an imported one
+        now = datetime.utcnow()
+        db.session.add(ClientCredential(client=client, is_revoked=False, serial_number='a0', common_name='legacy',
+                                        validity_start=now, validity_end=now))
+        db.session.commit()
+        self.assertEqual(1, ClientConfigService.update_files())
+        db.session.commit()
+        self.assertEqual(['legacy'], os.listdir(self.folder.name))
+        self.assertEqual(0, ClientConfigService.update_files())
+        self.assertEqual(dict(written=[], removed=[]), ClientConfigService.reconcile())
+
+        db.session.add(ClientCredential(client=self.clients[1], is_revoked=False, serial_number='a1',
+                                        common_name='bad/name', validity_start=now, validity_end=now))
+        db.session.commit()
+        self.assertRaises(ClientConfigServiceError, ClientConfigService.set_for_client, self.clients[1])
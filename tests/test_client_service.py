@@ -0,0 +1,238 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import event
+
+from models import db, Client, ClientCredential
+from services.client import ClientService, ClientServiceError
+from services.credential import CredentialService
+from tests.db_base import DbTestCase
+
+
+class TestClientService(DbTestCase):
+    def _add_clients(self, start: int, count: int):
+        now = datetime.utcnow()
+        for i in range(start, start + count):
+            client = Client(user_id=i, name='client%d' % i)
+            db.session.add(client)
+            for j in range(2):
+                db.session.add(ClientCredential(client=client, cert=b'cert', pkey=b'pkey', is_revoked=j == 0,
+                                                serial_number='%x' % (i * 2 + j), common_name=client.name,
+                                                validity_start=now, validity_end=now + timedelta(days=1),
+                                                key_type='RSA', key_bits=2048))
+        db.session.commit()
+        db.session.expunge_all()
+
+    def _count_list_statements(self) -> int:
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            results = [client.to_dict() for client in ClientService.get_all()]
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        db.session.expunge_all()
+
+        self.assertTrue(all(len(d['credentials']) == 2 for d in results))
+        # the blobs are not loaded for the listing
+        self.assertTrue(all('cert' not in statement.split('FROM')[0] for statement in statements))
+        return len(statements)
+
+    def test_get_all_statement_count(self):
+        self._add_clients(0, 2)
+        count = self._count_list_statements()
+        self._add_clients(2, 20)
+        self.assertEqual(count, self._count_list_statements())
+
+    def test_search(self):
+        self._add_clients(0, 10)
+        ClientCredential.query.filter_by(client_id=1, is_revoked=False).update({'validity_end': datetime.utcnow()})
+        db.session.add(Client(user_id=100, name='no_credential', email='x_y@example.com'))
+        db.session.commit()
+
+        # keyset pagination visits every client once
+        names = []
+        after_id = None
+        while True:
+            clients, total, after_id = ClientService.search(sort='name', descending=True, after_id=after_id, limit=3)
+            self.assertEqual(11, total)
+            names.extend(client.name for client in clients)
+            if after_id is None:
+                break
+        self.assertEqual(sorted(names, reverse=True), names)
+        self.assertEqual(11, len(set(names)))
+
+        clients, total, after_id = ClientService.search('CLIENT1', with_total=False)
+        self.assertEqual((['client1'], None, None), ([client.name for client in clients], total, after_id))
+        clients, _, _ = ClientService.search('x_y')  # wildcards are escaped
+        self.assertEqual(['no_credential'], [client.name for client in clients])
+        clients, _, _ = ClientService.search('5')
+        self.assertEqual(['client5'], [client.name for client in clients])
+
+        clients, total, _ = ClientService.search(has_active_credential=False)
+        self.assertEqual((['no_credential'], 1), ([client.name for client in clients], total))
+        clients, total, _ = ClientService.search(expiring_within_days=0)
+        self.assertEqual((['client0'], 1), ([client.name for client in clients], total))
+
+    def test_search_default_page(self):
+        # the admin listing is paginated by default instead of returning all the clients
+        self._add_clients(0, 55)
+        clients, total, after_id = ClientService.search()
+        self.assertEqual((50, 55), (len(clients), total))
+        self.assertEqual(clients[-1].id, after_id)
+        clients, total, after_id = ClientService.search(after_id=after_id)
+        self.assertEqual(['client%d' % i for i in range(50, 55)], [client.name for client in clients])
+        self.assertIsNone(after_id)
+
+        # the search args are applied without any pagination arg
+        clients, total, after_id = ClientService.search('client1')
+        self.assertEqual(11, total)
+        self.assertTrue(all(client.name.startswith('client1') for client in clients))
+
+    def test_identity_cache(self):
+        ClientService._identity_cache.clear()
+        self._add_clients(0, 3)
+        self.assertEqual('client0', ClientService.lookup_by_user_id(0).name)
+        self.assertEqual('client1', ClientService.lookup_by_user_id(1).name)
+        self.assertIsNone(ClientService.lookup_by_user_id(100))
+        client_ids = {client.name: client.id for client in Client.query}
+        self.assertEqual({'client0': client_ids['client0'], 'client1': client_ids['client1']},
+                         ClientService.lookup_ids_by_common_names(['client0', 'client1', 'x']))
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            # all served by the cache
+            self.assertEqual('client1', ClientService.lookup_by_user_id(1).name)
+            self.assertEqual({'client0', 'client1'}, set(ClientService.lookup_ids_by_common_names(['client0',
+                                                                                                  'client1'])))
+            self.assertEqual([], statements)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+        # writes invalidate the entries
+        client = ClientService.get_by_user_id(0)
+        client.email = 'old@example.com'
+        db.session.commit()
+        self.assertIsNone(ClientService.lookup_by_user_id(0).email)
+        ClientService.sync_oauth_user(SimpleNamespace(id=0, name='client0', email='new@example.com'))
+        db.session.commit()
+        self.assertEqual('new@example.com', ClientService.lookup_by_user_id(0).email)
+        self.assertGreater(ClientService.get_identity_cache_stats()['hits'], 0)
+
+    def test_identity_cache_name(self):
+        ClientService._identity_cache.clear()
+        self._add_clients(0, 2)
+        self.assertEqual(0, ClientService.lookup_by_name('client0').user_id)
+        self.assertEqual('client1', ClientService.lookup_by_user_id(1).name)
+        self.assertIsNone(ClientService.lookup_by_name('x'))
+        self.assertRaises(ClientServiceError, ClientService.lookup_by_name, None)
+        self.assertRaises(ClientServiceError, ClientService.lookup_by_name, 1)
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            # a lookup by either key caches both
+            self.assertEqual('client0', ClientService.lookup_by_user_id(0).name)
+            self.assertEqual(1, ClientService.lookup_by_name('client1').user_id)
+            self.assertEqual([], statements)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+        ClientService.sync_oauth_user(SimpleNamespace(id=0, name='client0', email='new@example.com'))
+        db.session.commit()
+        self.assertEqual('new@example.com', ClientService.lookup_by_name('client0').email)
+
+    def test_lookup_dict_by_user_id(self):
+        ClientService._identity_cache.clear()
+        self._add_clients(0, 2)
+        d = ClientService.lookup_dict_by_user_id(0)
+        self.assertEqual('client0', d['name'])
+        self.assertEqual({'0': True, '1': False},
+                         {cred['serial_number']: cred['is_revoked'] for cred in d['credentials']})
+        self.assertTrue(all('cert' not in cred for cred in d['credentials']))
+        self.assertIsNone(ClientService.lookup_dict_by_user_id(100))
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            self.assertIs(d, ClientService.lookup_dict_by_user_id(0))
+            self.assertEqual([], statements)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+        # the credential and the client writes invalidate the dict
+        CredentialService.revoke(ClientCredential.query.filter_by(serial_number='1').first())
+        db.session.commit()
+        self.assertTrue(all(cred['is_revoked'] for cred in ClientService.lookup_dict_by_user_id(0)['credentials']))
+        ClientService.sync_oauth_user(SimpleNamespace(id=0, name='client0', email='new@example.com'))
+        db.session.commit()
+        self.assertEqual('new@example.com', ClientService.lookup_dict_by_user_id(0)['email'])
+        self.assertEqual('client1', ClientService.lookup_dict_by_user_id(1)['name'])
+
+    def test_sync_oauth_user(self):
+        ClientService._synced_users.clear()
+        self._add_clients(0, 1)
+        self.assertTrue(ClientService.sync_oauth_user(SimpleNamespace(id=1, name='client1', email=None)))
+        self.assertTrue(ClientService.sync_oauth_user(SimpleNamespace(id=0, name='client0', email='a@example.com')))
+        db.session.commit()
+        self.assertEqual('a@example.com', ClientService.get_by_user_id(0).email)
+        self.assertEqual('client1', ClientService.get_by_user_id(1).name)
+
+        # unchanged
+        ClientService._synced_users.clear()
+        self.assertFalse(ClientService.sync_oauth_user(SimpleNamespace(id=0, name='client0', email='a@example.com')))
+        self.assertRaises(ClientServiceError, ClientService.sync_oauth_user,
+                          SimpleNamespace(id=0, name='renamed', email='a@example.com'))
+        self.assertRaises(ClientServiceError, ClientService.sync_oauth_user,
+                          SimpleNamespace(id=2, name='client0', email=None))  # name taken by another user
+        db.session.rollback()
+        self.assertEqual(2, Client.query.count())
+
+        # a change is only cached once the caller has committed it, so that a failed commit is retried
+        user = SimpleNamespace(id=0, name='client0', email='b@example.com')
+        self.assertTrue(ClientService.sync_oauth_user(user))
+        self.assertIsNone(ClientService._synced_users.get(user.id))
+        db.session.commit()
+        ClientService.mark_oauth_user_synced(user)
+        self.assertEqual(('client0', 'b@example.com'), ClientService._synced_users.get(user.id))
+        self.assertEqual('b@example.com', ClientService.get_by_user_id(0).email)
+
+    def test_import_many(self):
+        self._add_clients(0, 2)
+        rows = [
+            dict(user_id=2, name='client2', email='a@example.com'),
+            dict(user_id=1, name='new'),  # existing user id
+            dict(user_id=3, name='client0'),  # existing name
+            dict(user_id=2, name='other'),  # duplicate within the rows
+            dict(user_id='4', name='client4'),
+            dict(user_id=5, name='x' * 17),
+            None,
+            dict(user_id=6, name='client6'),
+            dict(user_id=7, name=123),  # skipped instead of failing the whole import
+            dict(user_id=8, name='client8', email=['a@example.com']),
+        ]
+        result = ClientService.import_many(iter(rows), batch_size=1)
+        db.session.commit()
+        self.assertEqual([(2, 'client2', 'a@example.com'), (6, 'client6', None)],
+                         [(identity.user_id, identity.name, identity.email) for identity in result.added])
+        self.assertEqual([2, 3, 4, 5, 6, 7, 9, 10], [skipped['row'] for skipped in result.skipped])
+        self.assertEqual(['name must be a string', 'email must be a string'],
+                         [skipped['msg'] for skipped in result.skipped[-2:]])
+        self.assertEqual({identity.id for identity in result.added},
+                         {client.id for client in Client.query.filter(Client.user_id.in_([2, 6]))})
@@ -0,0 +1,51 @@
+import unittest
+
+from tools.config import ConfigTool
+from tools.config_parser import ConfigParser, ConfigParserError, Directive
+
+
+class TestConfigParser(unittest.TestCase):
+    def test_split_line(self):
+        self.assertEqual(['push', 'route 10.0.0.0 255.0.0.0'],
+                         ConfigParser.split_line('push "route 10.0.0.0 255.0.0.0"'))
+        self.assertEqual(['push', 'dhcp-option DNS 1.1.1.1'], ConfigParser.split_line("push 'dhcp-option DNS 1.1.1.1'"))
+        self.assertEqual(['port', '1194'], ConfigParser.split_line('port 1194  # comment'))
+        self.assertEqual(['auth-user-pass', 'a b', 'c#d'], ConfigParser.split_line('auth-user-pass a\\ b c#d ;comment'))
+        self.assertEqual(['x', 'a"b', 'c\\d'], ConfigParser.split_line('x "a\\"b" \'c\\d\''))
+        self.assertEqual([], ConfigParser.split_line('   ; comment'))
+        self.assertRaises(ConfigParserError, ConfigParser.split_line, 'push "route')
+
+    def test_iter_directives(self):
+        lines = [
+            '# server config\n',
+            'dev tun\n',
+            '<ca>\n',
+            '-----BEGIN CERTIFICATE-----\n',
+            '# not a comment\n',
+            '-----END CERTIFICATE-----\n',
+            '</ca>\n',
+            '--client-config-dir /etc/openvpn/ccd\n',
+            'push "route 10.0.0.0 255.0.0.0"\n',
+        ]
+        directives = list(ConfigParser.iter_directives(lines))
+        self.assertEqual([
+            Directive('dev', ['tun'], 2),
+            Directive('ca', [], 3, '-----BEGIN CERTIFICATE-----\n# not a comment\n-----END CERTIFICATE-----\n'),
+            Directive('client-config-dir', ['/etc/openvpn/ccd'], 8),
+            Directive('push', ['route 10.0.0.0 255.0.0.0'], 9),
+        ], directives)
+        self.assertEqual(Directive('route', ['10.0.0.0', '255.0.0.0'], 9), directives[-1].get_pushed())
+        self.assertIsNone(directives[0].get_pushed())
+
+        self.assertRaises(ConfigParserError, list, ConfigParser.iter_directives(['<key>\n', 'data\n']))
+
+    def test_extract_server_routes(self):
+        lines = [
+            'route 192.168.0.0 255.255.0.0\n',  # server side route, not pushed
+            'push "route 10.0.0.0 255.0.0.0 vpn_gateway 10"\n',
+            'push "route 10.1.1.1"\n',
+            'push "route-ipv6 2001:db8::/32"\n',
+            'push "dhcp-option DNS 10.0.0.1"\n',
+        ]
+        self.assertEqual([('10.0.0.0', '255.0.0.0'), ('10.1.1.1', '255.255.255.255'), ('2001:db8::', '32')],
+                         list(ConfigTool.extract_server_routes(ConfigTool.parse_server_config(lines))))
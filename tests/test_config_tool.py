@@ -1,7 +1,9 @@
 import os
+import tempfile
 import unittest
+from datetime import datetime, timedelta
 
-from tools.cert import CertTool
+from tools.cert import CertTool, BuildPKeyParams, BuildCertParams
 from tools.config import ConfigTool
 
 data_folder = '/home/kelvin/openvpn-certs'
@@ -32,3 +34,33 @@ class TestConfigTool(unittest.TestCase):
                 '# Test adding more lines'
             ])
         print(cfg)
+
+    def test_client_config_template(self):
+        now = datetime.utcnow()
+        ca_pkey, ca_cert = CertTool.build_ca(BuildPKeyParams(2048), BuildCertParams(
+            1, now, now + timedelta(days=1), dict(commonName='test-ca')))
+        pkey, cert = CertTool.build_client(BuildPKeyParams(2048), BuildCertParams(
+            2, now, now + timedelta(days=1), dict(commonName='test-client')), ca_cert, ca_pkey)
+
+        with tempfile.TemporaryDirectory() as folder:
+            base_path = os.path.join(folder, 'base.conf')
+            ca_path = os.path.join(folder, 'ca.crt')
+            tls_path = os.path.join(folder, 'ta.key')
+            with open(base_path, 'w') as f:
+                f.write('client\ndev tun\n')
+            with open(ca_path, 'wb') as f:
+                f.write(ca_cert.dump())
+            with open(tls_path, 'w') as f:
+                f.write('tls auth key\n')
+
+            template = ConfigTool.get_client_config_template(base_path, ca_path, tls_path)
+            self.assertEqual(ConfigTool.build_client_config(base_path, ca_cert, cert, pkey, tls_path),
+                             template.render(cert.dump(), pkey.dump()))
+            self.assertIs(template, ConfigTool.get_client_config_template(base_path, ca_path, tls_path))
+
+            # modified sources invalidate the cached template
+            with open(base_path, 'w') as f:
+                f.write('client\ndev tap\n')
+            os.utime(base_path, ns=(0, 0))
+            template = ConfigTool.get_client_config_template(base_path, ca_path, tls_path)
+            self.assertIn('dev tap', template.render(cert.dump(), pkey.dump()))
@@ -0,0 +1,276 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from models import db, Client, ClientCredential
+from services.client import ClientService
+from services.credential import CredentialService, CredentialServiceError
+from tests.db_base import DbTestCase
+from tools.cert import CertTool, BuildPKeyParams, BuildCertParams
+
+
+class TestCredentialService(DbTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = tempfile.TemporaryDirectory()
+        now = datetime.utcnow()
+        ca_pkey, ca_cert = CertTool.build_ca(BuildPKeyParams(2048), BuildCertParams(
+            1, now, now + timedelta(days=1), dict(commonName='test-ca')))
+        ca_cert_path = os.path.join(self.folder.name, 'ca.crt')
+        ca_pkey_path = os.path.join(self.folder.name, 'ca.key')
+        with open(ca_cert_path, 'wb') as f:
+            f.write(ca_cert.dump())
+        with open(ca_pkey_path, 'wb') as f:
+            f.write(ca_pkey.dump())
+        CredentialService.init(dict(ca_cert_path=ca_cert_path, ca_pkey_path=ca_pkey_path,
+                                    crl_path=os.path.join(self.folder.name, 'crl.pem')))
+        CredentialService._crl_state = None
+
+    def tearDown(self):
+        super().tearDown()
+        self.folder.cleanup()
+
+    def test_single_active_credential(self):
+        client = Client(user_id=1, name='client1')
+        db.session.add(client)
+        cred = CredentialService.generate_for_client(client)
+        db.session.commit()
+        self.assertTrue(CredentialService.has_active_credential(client.id))
+        self.assertRaises(CredentialServiceError, CredentialService.generate_for_client, client)
+
+        # a concurrent request passing the check is rejected by the database, and only its changes are rolled back
+        has_active_credential = CredentialService.has_active_credential
+        CredentialService.has_active_credential = staticmethod(lambda client_id: False)
+        try:
+            self.assertRaises(CredentialServiceError, CredentialService.generate_for_client, client)
+        finally:
+            CredentialService.has_active_credential = has_active_credential
+        db.session.commit()
+        self.assertEqual([cred.id], [c.id for c in ClientCredential.query.filter_by(client_id=client.id)])
+
+        CredentialService.revoke(cred)
+        new_cred = CredentialService.generate_for_client(client)
+        db.session.commit()
+        self.assertRaises(CredentialServiceError, CredentialService.unrevoke, cred)
+        self.assertTrue(cred.is_revoked)
+        self.assertFalse(new_cred.is_revoked)
+
+    def test_lookups(self):
+        client1 = Client(user_id=1, name='client1')
+        client2 = Client(user_id=2, name='client2')
+        db.session.add_all([client1, client2])
+        cred = CredentialService.generate_for_client(client1)
+        # e.g. imported, with a common name different from the client name
+        now = datetime.utcnow()
+        db.session.add(ClientCredential(client=client2, is_revoked=False, serial_number='a0', common_name='legacy',
+                                        validity_start=now, validity_end=now))
+        db.session.commit()
+
+        self.assertEqual(cred.id, CredentialService.get_by_serial_number(cred.serial_number.upper()).id)
+        self.assertEqual(client2.id, CredentialService.get_by_serial_number('0x00:A0').client_id)
+        self.assertIsNone(CredentialService.get_by_serial_number('a1'))
+        self.assertRaises(CredentialServiceError, CredentialService.get_by_serial_number, 'xyz')
+
+        ClientService._identity_cache.clear()
+        self.assertEqual({'client1': client1.id, 'legacy': client2.id},
+                         ClientService.lookup_ids_by_common_names(['client1', 'legacy', 'client2']))
+
+        # the active credential wins, and the credential writes invalidate the cached owners
+        client3 = Client(user_id=3, name='client3')
+        db.session.add(client3)
+        db.session.add(ClientCredential(client=client3, is_revoked=True, revoked_at=now, serial_number='b0',
+                                        common_name='legacy', validity_start=now, validity_end=now))
+        db.session.commit()
+        self.assertEqual({'legacy': client2.id}, ClientService.lookup_ids_by_common_names(['legacy']))
+        CredentialService.revoke(ClientCredential.query.filter_by(serial_number='a0').first())
+        db.session.commit()
+        self.assertEqual({'legacy': client3.id}, ClientService.lookup_ids_by_common_names(['legacy']))
+
+    def test_backfill_metadata(self):
+        clients = [Client(user_id=i, name='client%d' % i) for i in range(3)]
+        db.session.add_all(clients)
+        creds = [CredentialService.generate_for_client(client) for client in clients]
+        db.session.commit()
+        expected = {cred.id: cred.to_dict(with_cert=False, with_pkey=False) for cred in creds}
+
+        # rows created before the metadata columns were added by migrate-db
+        columns = ('serial_number', 'common_name', 'validity_start', 'validity_end', 'key_type', 'key_bits')
+        ClientCredential.query.filter(ClientCredential.id != creds[0].id).update(dict.fromkeys(columns))
+        db.session.commit()
+        db.session.expunge_all()
+        self.assertEqual(2, ClientCredential.query.filter(ClientCredential.serial_number.is_(None)).count())
+
+        self.assertEqual(2, CredentialService.backfill_metadata(batch_size=1))
+        for cred in ClientCredential.query:
+            d = cred.to_dict(with_cert=False, with_pkey=False)
+            self.assertEqual({key: expected[cred.id][key] for key in columns}, {key: d[key] for key in columns})
+        self.assertEqual(0, CredentialService.backfill_metadata())
+
+    def test_update_crl(self):
+        clients = [Client(user_id=i, name='client%d' % i) for i in range(2)]
+        db.session.add_all(clients)
+        creds = [CredentialService.generate_for_client(client) for client in clients]
+        CredentialService.revoke(creds[0])
+        db.session.commit()
+        crl_path = CredentialService._crl_path
+
+        self.assertTrue(CredentialService.update_crl())
+        self.assertEqual({int(creds[0].serial_number, 16)}, CertTool.load_crl_file(crl_path).revoked_serial_numbers)
+
+        # unchanged revoked set, the file is not rebuilt
+        mtime = os.stat(crl_path).st_mtime_ns
+        self.assertFalse(CredentialService.update_crl())
+        self.assertEqual(mtime, os.stat(crl_path).st_mtime_ns)
+
+        # rebuilt after a revoke
+        CredentialService.revoke(creds[1])
+        db.session.commit()
+        self.assertTrue(CredentialService.update_crl())
+        self.assertEqual({int(cred.serial_number, 16) for cred in creds},
+                         CertTool.load_crl_file(crl_path).revoked_serial_numbers)
+        self.assertFalse(CredentialService.update_crl())
+
+        # refreshed at half of the validity period, before the nextUpdate of the CRL
+        fingerprint, last_update = CredentialService._crl_state
+        half_life = timedelta(days=CredentialService._crl_valid_days) / 2
+        CredentialService._crl_state = (fingerprint, last_update - half_life + timedelta(minutes=1))
+        self.assertFalse(CredentialService.update_crl())
+        CredentialService._crl_state = (fingerprint, last_update - half_life)
+        self.assertTrue(CredentialService.update_crl())
+
+        # rebuilt if the file is missing, or when forced
+        os.remove(crl_path)
+        self.assertTrue(CredentialService.update_crl())
+        self.assertTrue(os.path.exists(crl_path))
+        self.assertTrue(CredentialService.update_crl(force=True))
+
+    def _add_client_with_credentials(self, user_id: int, revoked_count: int, has_active: bool = True) -> Client:
+        client = Client(user_id=user_id, name='client%d' % user_id)
+        db.session.add(client)
+        now = datetime.utcnow()
+        for i in range(revoked_count + int(has_active)):
+            is_revoked = i < revoked_count
+            db.session.add(ClientCredential(client=client, is_revoked=is_revoked,
+                                            revoked_at=now if is_revoked else None,
+                                            serial_number='%x' % (user_id * 16 + i), common_name=client.name,
+                                            validity_start=now, validity_end=now + timedelta(days=i)))
+        db.session.commit()
+        return client
+
+    def test_revoke_many(self):
+        client1 = self._add_client_with_credentials(1, 1)
+        client2 = self._add_client_with_credentials(2, 0)
+        self.assertRaises(CredentialServiceError, CredentialService.find)
+
+        creds = CredentialService.find(client_ids=[client1.id, client2.id])
+        self.assertEqual(3, len(creds))
+        revoked = CredentialService.revoke_many(creds)
+        db.session.commit()
+        # the already revoked credential is skipped, the others share the revocation time
+        self.assertEqual(2, len(revoked))
+        self.assertEqual(1, len({cred.revoked_at for cred in revoked}))
+        self.assertEqual([], CredentialService.find(client_ids=[client1.id, client2.id], is_revoked=False))
+        self.assertEqual(2, len(CredentialService.find(client_names=['client1'])))
+        self.assertEqual([], CredentialService.revoke_many(creds))
+
+    def test_find_malformed_criteria(self):
+        self._add_client_with_credentials(1, 1)
+        for client_names in ('client1', 'c', ['client1', 1]):  # a string would select the clients named by its chars
+            self.assertRaises(CredentialServiceError, CredentialService.find, client_names=client_names)
+        for ids in (5, '1', [1, '2'], [1.0], [True]):
+            self.assertRaises(CredentialServiceError, CredentialService.find, credential_ids=ids)
+            self.assertRaises(CredentialServiceError, CredentialService.find, client_ids=ids)
+        self.assertEqual(2, len(CredentialService.find(client_names=('client1', 'client1'))))
+
+    def test_unrevoke_many(self):
+        client1 = self._add_client_with_credentials(1, 2, has_active=False)
+        client2 = self._add_client_with_credentials(2, 1, has_active=False)
+        client3 = self._add_client_with_credentials(3, 1)
+
+        # only one credential per client can be unrevoked
+        self.assertRaises(CredentialServiceError, CredentialService.unrevoke_many,
+                          CredentialService.find(client_ids=[client1.id]))
+        # nothing is changed if any client already has an active credential
+        self.assertRaises(CredentialServiceError, CredentialService.unrevoke_many,
+                          CredentialService.find(client_ids=[client2.id, client3.id], is_revoked=True))
+        db.session.rollback()
+        self.assertEqual(0, len(CredentialService.find(client_ids=[client2.id], is_revoked=False)))
+
+        creds = CredentialService.find(client_ids=[client1.id], expires_before=datetime.utcnow() + timedelta(hours=1))
+        creds += CredentialService.find(client_ids=[client2.id])
+        self.assertEqual(2, len(CredentialService.unrevoke_many(creds)))
+        db.session.commit()
+        active = CredentialService.find(client_ids=[client1.id, client2.id, client3.id], is_revoked=False)
+        self.assertEqual({client1.id, client2.id, client3.id}, {cred.client_id for cred in active})
+        self.assertTrue(all(cred.revoked_at is None for cred in creds))
+
+    def test_get_expiring(self):
+        client1 = self._add_client_with_credentials(1, 1)  # active expiring in 1 day
+        client2 = self._add_client_with_credentials(2, 0)  # active expiring now
+        self._add_client_with_credentials(3, 3, has_active=False)
+        self.assertRaises(CredentialServiceError, CredentialService.get_expiring, -1)
+        self.assertRaises(CredentialServiceError, CredentialService.get_expiring, 1, limit=0)
+
+        creds, total = CredentialService.get_expiring(2, with_client=True)
+        self.assertEqual(2, total)
+        self.assertEqual([client2.id, client1.id], [cred.client_id for cred in creds])
+        self.assertEqual('client2', creds[0].client.name)
+        creds, total = CredentialService.get_expiring(2, offset=1, limit=1)
+        self.assertEqual((2, [client1.id]), (total, [cred.client_id for cred in creds]))
+        creds, total = CredentialService.get_expiring(0)
+        self.assertEqual((1, [client2.id]), (total, [cred.client_id for cred in creds]))
+
+    def test_renew(self):
+        client = Client(user_id=1, name='client1', email='client1@example.com')
+        db.session.add(client)
+        cred = CredentialService.generate_for_client(client)
+        db.session.commit()
+
+        (old, new), = CredentialService.renew([cred])
+        db.session.commit()
+        self.assertIs(cred, old)
+        self.assertTrue(old.is_revoked)
+        self.assertIsNotNone(old.revoked_at)
+        self.assertFalse(new.is_revoked)
+        self.assertEqual(client.id, new.client_id)
+        self.assertEqual('client1', new.common_name)
+        self.assertNotEqual(old.serial_number, new.serial_number)
+        self.assertRaises(CredentialServiceError, CredentialService.renew, [old])
+
+    def test_renew_identity_cache(self):
+        ClientService._identity_cache.clear()
+        clients = [Client(user_id=i, name='client%d' % i) for i in range(2)]
+        db.session.add_all(clients)
+        cred = CredentialService.generate_for_client(clients[0])
+        db.session.commit()
+
+        results = CredentialService.renew([cred])
+        # a concurrent lookup before the commit caches the owner of the old credential
+        ClientService._identity_cache.put(('common_name', 'client0'), clients[1].id)
+        db.session.commit()
+        ClientService.invalidate_common_names(old.common_name for old, _ in results)
+        self.assertEqual({'client0': clients[0].id}, ClientService.lookup_ids_by_common_names(['client0']))
+
+    def test_iter_client_configs(self):
+        base_config_path = os.path.join(self.folder.name, 'client_base.conf')
+        tls_auth_key_path = os.path.join(self.folder.name, 'ta.key')
+        with open(base_config_path, 'w') as f:
+            f.write('client\n')
+        with open(tls_auth_key_path, 'w') as f:
+            f.write('tls auth key\n')
+        CredentialService.init(dict(ca_cert_path=CredentialService._ca_cert_path,
+                                    ca_pkey_path=CredentialService._ca_pkey_path,
+                                    client_base_config_path=base_config_path, tls_auth_key_path=tls_auth_key_path))
+        clients = [Client(user_id=i, name='client%d' % i) for i in range(3)]
+        db.session.add_all(clients)
+        for client in clients:
+            CredentialService.generate_for_client(client)
+        db.session.commit()
+
+        self.assertEqual(['client0.ovpn', 'client1.ovpn', 'client2.ovpn'],
+                         [name for name, _ in CredentialService.iter_client_configs()])
+        self.assertEqual(['client1.ovpn'], [name for name, _ in CredentialService.iter_client_configs([clients[1].id])])
+        self.assertEqual([], list(CredentialService.iter_client_configs([])))
+        # malformed selections are rejected instead of selecting other clients
+        for client_ids in (5, 'abc', [str(clients[1].id)], [True]):
+            self.assertRaises(CredentialServiceError, next, CredentialService.iter_client_configs(client_ids))
@@ -0,0 +1,27 @@
+import time
+import unittest
+
+from tools.debounce import Debouncer
+
+
+class TestDebouncer(unittest.TestCase):
+    def test_coalesce(self):
+        calls = []
+        debouncer = Debouncer(lambda: calls.append(1), 0.1)
+        for _ in range(10):
+            debouncer.trigger()
+        self.assertTrue(debouncer.is_pending)
+        time.sleep(0.3)
+        self.assertEqual(1, len(calls))
+        self.assertFalse(debouncer.is_pending)
+
+    def test_flush(self):
+        calls = []
+        debouncer = Debouncer(lambda: calls.append(1), 10)
+        debouncer.trigger()
+        debouncer.flush()
+        self.assertEqual(1, len(calls))
+        self.assertFalse(debouncer.is_pending)
+
+        debouncer.flush()  # nothing pending
+        self.assertEqual(1, len(calls))
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from tools.cert import CertTool, BuildPKeyParams, BuildCertParams
+from tools.easyrsa import EasyRsaTool, EasyRsaError, IndexEntry, PkiItem
+
+
+class TestEasyRsaTool(unittest.TestCase):
+    def test_parse_index(self):
+        lines = [
+            'V\t300101000000Z\t\t0A\tunknown\t/CN=client1\n',
+            'R\t300101000000Z\t20240102030405Z,keyCompromise\t0b\tunknown\t/CN=client2\n',
+            '\n',
+        ]
+        self.assertEqual({
+            10: IndexEntry('V', datetime(2030, 1, 1), None, 10, '/CN=client1'),
+            11: IndexEntry('R', datetime(2030, 1, 1), datetime(2024, 1, 2, 3, 4, 5), 11, '/CN=client2'),
+        }, EasyRsaTool.parse_index(lines))
+        self.assertRaises(EasyRsaError, EasyRsaTool.parse_index, ['X\t300101000000Z\t\t0A\tunknown\t/CN=a\n'])
+        self.assertRaises(EasyRsaError, EasyRsaTool.parse_index, ['V\t300101000000Z\t\tzz\tunknown\t/CN=a\n'])
+
+    def test_iter_items(self):
+        with tempfile.TemporaryDirectory() as pki_dir:
+            for path in ('issued/client1.crt', 'issued/client1.req', 'revoked/certs_by_serial/0B.crt'):
+                os.makedirs(os.path.dirname(os.path.join(pki_dir, path)), exist_ok=True)
+                open(os.path.join(pki_dir, path), 'w').close()
+            self.assertEqual([
+                PkiItem(os.path.join(pki_dir, 'issued', 'client1.crt'),
+                        os.path.join(pki_dir, 'private', 'client1.key')),
+                PkiItem(os.path.join(pki_dir, 'revoked', 'certs_by_serial', '0B.crt'),
+                        os.path.join(pki_dir, 'revoked', 'private_by_serial', '0B.key')),
+            ], list(EasyRsaTool.iter_items(pki_dir)))
+
+    def test_verify(self):
+        now = datetime.utcnow()
+        ca_pkey, ca_cert = CertTool.build_ca(BuildPKeyParams(2048), BuildCertParams(
+            1, now - timedelta(days=30), now + timedelta(days=30), dict(commonName='test-ca')))
+        other_ca_pkey, other_ca_cert = CertTool.build_ca(BuildPKeyParams(2048), BuildCertParams(
+            1, now - timedelta(days=30), now + timedelta(days=30), dict(commonName='test-ca')))
+
+        with tempfile.TemporaryDirectory() as pki_dir:
+            items = []
+            for name, days, signer in (('valid', 1, (ca_cert, ca_pkey)), ('expired', -1, (ca_cert, ca_pkey)),
+                                       ('other', 1, (other_ca_cert, other_ca_pkey))):
+                pkey, cert = CertTool.build_client(BuildPKeyParams(2048), BuildCertParams(
+                    len(items) + 2, now - timedelta(days=10), now + timedelta(days=days), dict(commonName=name)),
+                    *signer)
+                item = PkiItem(os.path.join(pki_dir, name + '.crt'), os.path.join(pki_dir, name + '.key'))
+                with open(item.cert_path, 'wb') as f:
+                    f.write(cert.dump())
+                with open(item.pkey_path, 'wb') as f:
+                    f.write(pkey.dump())
+                items.append(item)
+            items.append(PkiItem(items[0].cert_path, os.path.join(pki_dir, 'missing.key')))
+
+            results = list(EasyRsaTool.verify(items, ca_cert.dump(), workers=1))
+        self.assertEqual(['valid', 'expired', None, None], [result.common_name for result in results])
+        self.assertEqual([None, None, 'CA does not match', 'pkey file does not exist'],
+                         [result.error and result.error['msg'] for result in results])
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from models import db, Client, ClientCredential, MigrateDbError, migrate_db
+from tests.db_base import DbTestCase
+
+
+class TestMigrateDb(DbTestCase):
+    def _get_index_names(self) -> set:
+        return {index['name'] for index in inspect(db.engine).get_indexes('client_credential')}
+
+    def test_unique_index_duplicates(self):
+        # an old database without the unique index on the active credential of a client
+        db.session.execute(text('DROP INDEX uq_client_credential_active_client_id'))
+        db.session.execute(text('DROP INDEX ix_client_credential_common_name'))
+        now = datetime.utcnow()
+        clients = [Client(user_id=i, name='client%d' % i) for i in range(3)]
+        db.session.add_all(clients)
+        for client, active_count in zip(clients, (2, 1, 0)):
+            for i in range(active_count + 1):
+                db.session.add(ClientCredential(client=client, is_revoked=i == active_count,
+                                                validity_start=now, validity_end=now))
+        db.session.commit()
+
+        with self.assertRaises(MigrateDbError) as cm:
+            migrate_db()
+        self.assertEqual(dict(index='uq_client_credential_active_client_id', columns=['client_id'],
+                              values=[clients[0].id]), cm.exception.detail)
+        self.assertFalse({'uq_client_credential_active_client_id', 'ix_client_credential_common_name'} &
+                         self._get_index_names())
+
+        ClientCredential.query.filter_by(client_id=clients[0].id, is_revoked=False).first().is_revoked = True
+        db.session.commit()
+        migrate_db()
+        self.assertTrue({'uq_client_credential_active_client_id', 'ix_client_credential_common_name'} <=
+                        self._get_index_names())
@@ -0,0 +1,26 @@
+import unittest
+
+from tools.route import RouteTool, RouteToolError
+
+
+class TestRouteTool(unittest.TestCase):
+    def test_optimize(self):
+        routes = [
+            ('10.0.0.0', '255.255.255.0'),
+            ('10.0.1.0', '255.255.255.0'),  # adjacent to the above
+            ('10.0.0.128', '255.255.255.128'),  # contained in the first one
+            ('192.168.1.0', '255.255.255.0'),
+            ('192.168.1.0', '255.255.255.0'),  # duplicate
+        ]
+        self.assertEqual([('10.0.0.0', '255.255.254.0'), ('192.168.1.0', '255.255.255.0')],
+                         RouteTool.optimize(routes))
+
+    def test_invalid(self):
+        self.assertRaises(RouteToolError, RouteTool.to_network, '10.0.0.0', '255.0.255.0')
+
+    def test_ipv6(self):
+        network = RouteTool.to_network('2001:db8::1', '32')
+        self.assertEqual(('2001:db8::', '32'), RouteTool.from_network(network))
+        self.assertEqual([('10.0.0.0', '255.0.0.0'), ('2001:db8::', '31')],
+                         RouteTool.optimize([('2001:db8::', '32'), ('10.0.0.0', '255.0.0.0'), ('2001:db9::', '32')]))
+
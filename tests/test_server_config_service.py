@@ -0,0 +1,165 @@
+import os
+import tempfile
+import time
+
+from sqlalchemy import event
+
+from models import db, Route
+from services.server_config import ServerConfigService, ServerConfigServiceError
+from services.server_config_writer import ServerConfigWriter
+from tests.db_base import DbTestCase
+from tools.route import RouteTool
+
+
+class TestServerConfigService(DbTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = tempfile.TemporaryDirectory()
+        self.config_path = os.path.join(self.folder.name, 'server.conf')
+        base_config_path = os.path.join(self.folder.name, 'server_base.conf')
+        with open(base_config_path, 'w') as f:
+            f.write('dev tun\n')
+        ServerConfigService.init(dict(server_config_path=self.config_path, server_base_config_path=base_config_path))
+
+    def tearDown(self):
+        super().tearDown()
+        self.folder.cleanup()
+
+    def _add_routes(self, routes):
+        for ip, mask in routes:
+            ServerConfigService.add_route(ip, mask)
+            db.session.flush()  # the duplicates are checked against the flushed routes
+        db.session.commit()
+
+    def test_get_route_overlaps(self):
+        self._add_routes([
+            ('10.0.0.0', '255.0.0.0'),
+            ('10.1.0.0', '255.255.0.0'),
+            ('10.1.2.0', '255.255.255.0'),
+            ('10.1.2.128', '25'),
+            ('10.2.0.0', '255.255.0.0'),
+            ('172.16.0.0', '255.240.0.0'),
+            ('2001:db8::', '32'),
+            ('2001:db8:1::', '48'),
+        ])
+        self.assertRaises(ServerConfigServiceError, ServerConfigService.add_route, '10.1.0.1', '16')
+
+        routes = ServerConfigService.get_routes()
+        for ip, mask in [('10.1.0.0', '255.255.0.0'), ('10.0.0.0', '255.0.0.0'), ('10.1.2.128', '255.255.255.128'),
+                         ('192.168.0.0', '255.255.0.0'), ('0.0.0.0', '0.0.0.0'), ('2001:db8::', '33'),
+                         ('2001:db8:1:2::', '64')]:
+            network = RouteTool.to_network(ip, mask)
+            expected = []
+            for route in routes:
+                other = RouteTool.to_network(route.ip, route.mask)
+                if other.version != network.version or not other.overlaps(network):
+                    continue
+                if other == network:
+                    relation = 'duplicate'
+                elif other.subnet_of(network):
+                    relation = 'contains'
+                else:
+                    relation = 'contained'
+                expected.append((route.id, relation))
+            overlaps = ServerConfigService.get_route_overlaps(Route(ip=ip, mask=mask))
+            self.assertEqual(sorted(expected), sorted((route.id, relation) for route, relation in overlaps), (ip, mask))
+
+        # the route itself is excluded, and the others are sorted by network
+        route = Route.query.filter_by(ip='10.1.0.0').first()
+        self.assertEqual([('10.0.0.0', 'contained'), ('10.1.2.0', 'contains'), ('10.1.2.128', 'contains')],
+                         [(r.ip, relation) for r, relation in ServerConfigService.get_route_overlaps(route)])
+
+    def test_get_route_overlaps_statements(self):
+        self._add_routes([('10.%d.0.0' % i, '255.255.0.0') for i in range(20)])
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            overlaps = ServerConfigService.get_route_overlaps(Route(ip='10.0.0.0', mask='255.0.0.0'))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(20, len(overlaps))
+        self.assertEqual(1, len(statements))  # one query on the network columns, no index built in memory
+
+    def test_update_config(self):
+        self._add_routes([('10.0.0.0', '255.0.0.0')])
+        self.assertTrue(ServerConfigService.update_config())
+        with open(self.config_path) as f:
+            self.assertIn('route 10.0.0.0 255.0.0.0', f.read())
+
+        # an unchanged render leaves the file untouched
+        os.utime(self.config_path, (0, 0))
+        self.assertFalse(ServerConfigService.update_config())
+        self.assertEqual(0, os.stat(self.config_path).st_mtime)
+        self.assertTrue(ServerConfigService.update_config(force=True))
+        self.assertNotEqual(0, os.stat(self.config_path).st_mtime)
+
+        self._add_routes([('192.168.0.0', '255.255.0.0')])
+        self.assertTrue(ServerConfigService.update_config())
+        with open(self.config_path) as f:
+            self.assertIn('route 192.168.0.0 255.255.0.0', f.read())
+
+    def test_writer_coalesce(self):
+        ServerConfigWriter.init(self.app, dict(update_delay=0.1))
+        with self.assertLogs('services.server_config_writer', 'INFO') as logs:
+            for i in range(5):
+                self._add_routes([('10.%d.0.0' % (i * 2), '255.255.0.0')])  # not collapsed
+                ServerConfigWriter.request_update()
+            self.assertFalse(os.path.exists(self.config_path))
+            time.sleep(0.5)
+        self.assertEqual(1, len(logs.records))  # a single render for the whole burst
+        with open(self.config_path) as f:
+            self.assertEqual(5, f.read().count('route 10.'))
+
+        # a request with nothing changed renders again but does not rewrite the file
+        with self.assertNoLogs('services.server_config_writer', 'INFO'):
+            ServerConfigWriter.request_update()
+            ServerConfigWriter.flush()
+
+    def test_diff_routes(self):
+        self._add_routes([('10.0.0.0', '255.0.0.0'), ('192.168.0.0', '255.255.0.0'), ('2001:db8::', '32')])
+        diff = ServerConfigService.diff_routes([
+            ('10.0.0.0', '8'),  # same network with a prefix length
+            ('172.16.0.0', '12'),
+            ('172.16.0.0', '255.240.0.0'),  # duplicate of the previous one
+            ('2001:db8::', '32'),
+        ])
+        self.assertEqual([('172.16.0.0', '255.240.0.0')], diff.added)
+        self.assertEqual([], diff.removed)
+        self.assertEqual(['10.0.0.0', '2001:db8::'], [route.ip for route in diff.unchanged])
+
+        diff = ServerConfigService.diff_routes([('10.0.0.0', '255.0.0.0')], clear=True)
+        self.assertEqual([], diff.added)
+        self.assertEqual(['192.168.0.0', '2001:db8::'], [route.ip for route in diff.removed])
+        self.assertEqual(['10.0.0.0'], [route.ip for route in diff.unchanged])
+
+        # all the invalid routes are reported at once
+        with self.assertRaises(ServerConfigServiceError) as cm:
+            ServerConfigService.diff_routes([('10.0.0.0', '255.0.255.0'), ('172.16.0.0', '12'), ('abc', '8')])
+        self.assertEqual(['10.0.0.0', 'abc'], [error['ip'] for error in cm.exception.detail])
+
+    def test_import_routes_dry_run(self):
+        self._add_routes([('10.0.0.0', '255.0.0.0'), ('192.168.0.0', '255.255.0.0')])
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            diff = ServerConfigService.import_routes([('172.16.0.0', '12')], 'test', clear=True, dry_run=True)
+            db.session.flush()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        self.assertEqual(([('172.16.0.0', '255.240.0.0')], 2), (diff.added, len(diff.removed)))
+        self.assertEqual([], [statement for statement in statements if not statement.lstrip().startswith('SELECT')])
+        self.assertEqual(['10.0.0.0', '192.168.0.0'], [route.ip for route in ServerConfigService.get_routes()])
+        self.assertFalse(os.path.exists(self.config_path))
+
+        ServerConfigService.import_routes([('172.16.0.0', '12')], 'test', clear=True)
+        db.session.commit()
+        self.assertEqual([('172.16.0.0', '255.240.0.0', 'test')],
+                         [(route.ip, route.mask, route.description) for route in ServerConfigService.get_routes()])
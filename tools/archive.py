@@ -0,0 +1,54 @@
+import io
+import zipfile
+from typing import Iterable, Iterator, Tuple, Union
+
+
+class _StreamBuffer(io.RawIOBase):
+    """A write-only, unseekable file object that keeps the written data until it is popped."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def pop(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ArchiveTool:
+    @staticmethod
+    def iter_zip(entries: Iterable[Tuple[str, Union[str, bytes]]],
+                 compression: int = zipfile.ZIP_DEFLATED) -> Iterator[bytes]:
+        """
+        Generate a zip archive incrementally from (file name, content) pairs. Each entry is yielded as soon as it is
+        compressed, so the memory usage does not grow with the number of entries (except for the central directory,
+        which keeps a small record for each entry).
+        """
+        buffer = _StreamBuffer()
+        # zipfile writes data descriptors instead of seeking back when the output is not seekable
+        with zipfile.ZipFile(buffer, 'w', compression=compression) as zf:
+            for name, content in entries:
+                zf.writestr(name, content)
+                data = buffer.pop()
+                if data:
+                    yield data
+        data = buffer.pop()  # the central directory
+        if data:
+            yield data
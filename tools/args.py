@@ -0,0 +1,39 @@
+from typing import List, Optional
+
+from werkzeug.datastructures import MultiDict
+
+from error import BasicError
+
+
+class ArgsToolError(BasicError):
+    pass
+
+
+class ArgsTool:
+    """
+    Strict parsing of the query string args. Malformed values are rejected instead of being dropped or replaced by the
+    default as MultiDict.get(type=...) does, as an ignored filter may widen the selection of the request.
+    """
+
+    @staticmethod
+    def get_int(args: MultiDict, name: str, default: Optional[int] = None) -> Optional[int]:
+        value = args.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ArgsToolError('%s must be an integer' % name, value)
+
+    @staticmethod
+    def get_int_list(args: MultiDict, name: str) -> Optional[List[int]]:
+        """Get the values of a repeated arg, or None if the arg is not given at all."""
+        if name not in args:
+            return None
+        values = []
+        for value in args.getlist(name):
+            try:
+                values.append(int(value))
+            except ValueError:
+                raise ArgsToolError('%s must be integers' % name, value)
+        return values
@@ -0,0 +1,107 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, Optional
+
+from error import BasicError
+
+
+class CacheError(BasicError):
+    pass
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 256, ttl: Optional[float] = None):
+        """Entries expire ttl seconds after they are put if ttl is given, for data that may be changed elsewhere."""
+        if type(max_size) is not int or max_size <= 0:
+            raise CacheError('max size must be a positive integer')
+        if ttl is not None and (not isinstance(ttl, (int, float)) or ttl <= 0):
+            raise CacheError('ttl must be a positive number')
+
+        self._max_size = max_size
+        self._ttl = ttl
+        self._data = OrderedDict()  # key => (value, expiry time or None)
+        self._hits = 0
+        self._misses = 0
+        # the cache may be shared by the worker threads of the server
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    def resize(self, max_size: int):
+        if type(max_size) is not int or max_size <= 0:
+            raise CacheError('max size must be a positive integer')
+
+        with self._lock:
+            self._max_size = max_size
+            self._evict()
+
+    @property
+    def ttl(self) -> Optional[float]:
+        return self._ttl
+
+    def set_ttl(self, ttl: Optional[float]):
+        """Only applies to the entries put afterwards."""
+        if ttl is not None and (not isinstance(ttl, (int, float)) or ttl <= 0):
+            raise CacheError('ttl must be a positive number')
+        self._ttl = ttl
+
+    def get(self, key: Hashable, default=None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or time.monotonic() < expires_at:
+                    self._data.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._data[key]
+            self._misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self._ttl if self._ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            # call the factory outside of the lock as it might be slow, e.g. parsing a cert
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._hits = 0
+            self._misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'size': len(self._data),
+                'max_size': self._max_size,
+                'ttl': self._ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / total if total else None
+            }
+
+    def _evict(self):
+        while len(self._data) > self._max_size:
+            self._data.popitem(last=False)
@@ -5,14 +5,17 @@
 # - https://www.digitalocean.com/community/tutorials/how-to-set-up-an-openvpn-server-on-ubuntu-16-04
 # - https://tools.ietf.org/html/rfc5280#section-6.3.2
 
+import hashlib
+import importlib
 import os
 import uuid
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, Iterable
+from typing import Optional, Tuple, Iterable, Set, Type
 
 from OpenSSL import crypto
 
 from error import BasicError
+from tools.cache import LRUCache
 
 _timestamp_format = '%Y%m%d%H%M%SZ'
 
@@ -75,6 +78,14 @@ class Cert:
     def serial_number(self) -> int:
         return self._x509.get_serial_number()
 
+    @property
+    def public_key_type(self) -> str:
+        return _key_type_to_str[self._x509.get_pubkey().type()]
+
+    @property
+    def public_key_bits(self) -> int:
+        return self._x509.get_pubkey().bits()
+
     def dump(self) -> bytes:
         return crypto.dump_certificate(crypto.FILETYPE_PEM, self._x509)
 
@@ -83,7 +94,6 @@ class Cert:
 
     def to_dict(self) -> dict:
         cert = self._x509
-        public_key = cert.get_pubkey()
 
         ext_list = []
         for i in range(cert.get_extension_count()):
@@ -101,8 +111,8 @@ class Cert:
             'signature_algorithm': self.signature_algorithm,
             'extensions': ext_list,
             'public_key': {
-                'type': _key_type_to_str[public_key.type()],
-                'bits': public_key.bits()
+                'type': self.public_key_type,
+                'bits': self.public_key_bits
             }
         }
 
@@ -140,6 +150,10 @@ class CRL:
     def crl(self) -> crypto.CRL:
         return self._crl
 
+    @property
+    def revoked_serial_numbers(self) -> Set[int]:
+        return {int(revoked.get_serial(), 16) for revoked in self._crl.get_revoked() or ()}
+
     def dump(self) -> bytes:
         return crypto.dump_crl(crypto.FILETYPE_PEM, self._crl)
 
@@ -174,8 +188,68 @@ class BuildPKeyParams:
 
 
 class CertTool:
+    """The pyOpenSSL backend. See get_backend() for the other backends."""
     default_digest = 'sha256'
 
+    # backend name => 'module:class'
+    _backends = {
+        'pyopenssl': 'tools.cert:CertTool',
+        'cryptography': 'tools.cert_cryptography:CryptographyCertTool'
+    }
+
+    @classmethod
+    def get_backend(cls, name: str) -> Type['CertTool']:
+        if name not in cls._backends:
+            raise CertToolError('unknown cert backend', name)
+        module_name, class_name = cls._backends[name].split(':')
+        return getattr(importlib.import_module(module_name), class_name)
+
+    # Parsed objects (and their dict output) keyed by the backend and the digest of the PEM data. The PEM data of stored
+    # credentials never changes, so the entries do not need any invalidation other than the LRU eviction.
+    _parsed_cache = LRUCache(1024)
+
+    @classmethod
+    def set_parsed_cache_size(cls, max_size: int):
+        cls._parsed_cache.resize(max_size)
+
+    @classmethod
+    def get_parsed_cache_stats(cls) -> dict:
+        return cls._parsed_cache.stats()
+
+    @staticmethod
+    def _data_digest(data: bytes) -> bytes:
+        return hashlib.sha256(data).digest()
+
+    @classmethod
+    def load_cert_cached(cls, cert_data: bytes) -> Cert:
+        if not cert_data:
+            raise CertToolError('cert data must not be empty')
+        return cls._parsed_cache.get_or_create(('cert', cls.__name__, cls._data_digest(cert_data)),
+                                               lambda: cls.load_cert(cert_data))
+
+    @classmethod
+    def load_pkey_cached(cls, pkey_data: bytes) -> PKey:
+        if not pkey_data:
+            raise CertToolError('pkey data must not be empty')
+        return cls._parsed_cache.get_or_create(('pkey', cls.__name__, cls._data_digest(pkey_data)),
+                                               lambda: cls.load_pkey(pkey_data))
+
+    @classmethod
+    def cert_to_dict_cached(cls, cert_data: bytes) -> dict:
+        """The returned dict is shared by all the callers and must not be modified."""
+        if not cert_data:
+            raise CertToolError('cert data must not be empty')
+        return cls._parsed_cache.get_or_create(('cert_dict', cls.__name__, cls._data_digest(cert_data)),
+                                               lambda: cls.load_cert_cached(cert_data).to_dict())
+
+    @classmethod
+    def pkey_to_dict_cached(cls, pkey_data: bytes) -> dict:
+        """The returned dict is shared by all the callers and must not be modified."""
+        if not pkey_data:
+            raise CertToolError('pkey data must not be empty')
+        return cls._parsed_cache.get_or_create(('pkey_dict', cls.__name__, cls._data_digest(pkey_data)),
+                                               lambda: cls.load_pkey_cached(pkey_data).to_dict())
+
     @staticmethod
     def load_cert(cert_data: bytes) -> Cert:
         if not cert_data:
@@ -245,26 +319,33 @@ class CertTool:
         return cls.load_crl(buffer)
 
     @staticmethod
-    def verify_cert_ca(cert: Cert, ca_cert: Cert):
+    def build_store(ca_cert: Cert, crl: CRL = None, verify_time: datetime = None) -> crypto.X509Store:
+        """Build a store once for verifying many certs. CRL check is enabled if the CRL is given. The certs are
+        verified as of verify_time if given (e.g. to check the chain of an expired cert), otherwise as of now."""
         store = crypto.X509Store()
         store.add_cert(ca_cert.x509)
-        store_ctx = crypto.X509StoreContext(store, cert.x509)
-        try:
-            store_ctx.verify_certificate()
-        except crypto.X509StoreContextError as e:
-            raise CertToolError('CA does not match', e.args[0])
+        if verify_time is not None:
+            store.set_time(verify_time)
+        if crl is not None:
+            store.add_crl(crl.crl)
+            store.set_flags(crypto.X509StoreFlags.CRL_CHECK)
+        return store
 
     @staticmethod
-    def verify_cert_crl(cert: Cert, ca_cert: Cert, crl: CRL):
-        store = crypto.X509Store()
-        store.add_cert(ca_cert.x509)
-        store.add_crl(crl.crl)
-        store.set_flags(crypto.X509StoreFlags.CRL_CHECK)
+    def verify_cert_store(cert: Cert, store: crypto.X509Store, error_msg: str = 'cert verification failed'):
         store_ctx = crypto.X509StoreContext(store, cert.x509)
         try:
             store_ctx.verify_certificate()
         except crypto.X509StoreContextError as e:
-            raise CertToolError('CRL check failed', e.args[0])
+            raise CertToolError(error_msg, e.args[0])
+
+    @classmethod
+    def verify_cert_ca(cls, cert: Cert, ca_cert: Cert):
+        cls.verify_cert_store(cert, cls.build_store(ca_cert), 'CA does not match')
+
+    @classmethod
+    def verify_cert_crl(cls, cert: Cert, ca_cert: Cert, crl: CRL):
+        cls.verify_cert_store(cert, cls.build_store(ca_cert, crl), 'CRL check failed')
 
     @classmethod
     def verify_cert_pkey(cls, cert: Cert, pkey: PKey):
@@ -282,6 +363,17 @@ class CertTool:
         except crypto.Error as e:
             raise CertToolError('pkey does not match', e.args[0])
 
+    @staticmethod
+    def match_cert_pkey(cert: Cert, pkey: PKey) -> bool:
+        """A cheaper alternative to verify_cert_pkey() that compares the public keys without signing anything."""
+        if cert is None:
+            raise CertToolError('cert is required')
+        if pkey is None:
+            raise CertToolError('pkey is required')
+
+        return crypto.dump_publickey(crypto.FILETYPE_ASN1, cert.x509.get_pubkey()) == \
+            crypto.dump_publickey(crypto.FILETYPE_ASN1, pkey.pkey)
+
     @staticmethod
     def _build_pkey(params: BuildPKeyParams) -> crypto.PKey:
         key = crypto.PKey()
@@ -366,9 +458,13 @@ class CertTool:
     @classmethod
     def build_client(cls, pkey_params: BuildPKeyParams, cert_params: BuildCertParams,
                      ca_cert: Cert, ca_pkey: PKey) -> Tuple[PKey, Cert]:
-        key = cls._build_pkey(pkey_params)
+        pkey = PKey(cls._build_pkey(pkey_params))
+        return pkey, cls.build_client_cert(pkey, cert_params, ca_cert, ca_pkey)
+
+    @classmethod
+    def build_client_cert(cls, pkey: PKey, cert_params: BuildCertParams, ca_cert: Cert, ca_pkey: PKey) -> Cert:
         cert = cls._build_cert(cert_params)
-        cert.set_pubkey(key)  # key is a key pair
+        cert.set_pubkey(pkey.pkey)  # key is a key pair
 
         # use CA as issuer
         cert.set_issuer(ca_cert.x509.get_subject())
@@ -394,11 +490,17 @@ class CertTool:
         # sign() function has wrong type annotation for 'digest'
         # use CA key to sign
         cert.sign(ca_pkey.pkey, cls.default_digest)
-        return PKey(key), Cert(cert)
+        return Cert(cert)
 
     @classmethod
     def build_crl(cls, cert_revoke_list: Iterable[Tuple[Cert, datetime]], ca_cert: Cert, ca_pkey: PKey,
                   validity_days: int):
+        return cls.build_crl_from_serials(((cert.serial_number, revoke_time) for cert, revoke_time in cert_revoke_list),
+                                          ca_cert, ca_pkey, validity_days)
+
+    @classmethod
+    def build_crl_from_serials(cls, serial_revoke_list: Iterable[Tuple[int, datetime]], ca_cert: Cert, ca_pkey: PKey,
+                               validity_days: int):
         crl = crypto.CRL()
         crl.set_version(0x0)
 
@@ -409,9 +511,9 @@ class CertTool:
         # crl.set_lastUpdate(_format_timestamp(validity_start).encode())
         # crl.set_nextUpdate(_format_timestamp(validity_end).encode())
 
-        for cert, revoke_time in cert_revoke_list:
+        for serial_number, revoke_time in serial_revoke_list:
             revoked = crypto.Revoked()
-            revoked.set_serial(hex(cert.serial_number)[2:].encode())
+            revoked.set_serial(hex(serial_number)[2:].encode())
             revoked.set_reason(None)  # can be one of revoked.all_reasons()
             revoked.set_rev_date(_format_timestamp(revoke_time).encode())
             crl.add_revoked(revoked)
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, NamedTuple, Optional, List, Type
+
+from error import BasicError
+from tools.cert import CertTool, CertToolError
+from tools.pool import PoolTool
+
+# Per-process state of the pool workers. The CA cert, the verification store and the revoked serial numbers are built
+# once in each worker by the initializer instead of once per credential.
+_worker_state = {}
+
+
+class CertAuditError(BasicError):
+    pass
+
+
+class AuditItem(NamedTuple):
+    id: int
+    cert: Optional[bytes]
+    pkey: Optional[bytes]
+    is_revoked: bool
+    serial_number: Optional[str]
+
+
+def _init_worker(cert_tool: Type[CertTool], ca_cert_data: bytes, crl_data: Optional[bytes],
+                 expiry_warning_days: int):
+    _worker_state['cert_tool'] = cert_tool
+    ca_cert = cert_tool.load_cert(ca_cert_data)
+    _worker_state['store'] = cert_tool.build_store(ca_cert)
+    if crl_data:
+        _worker_state['revoked_serial_numbers'] = cert_tool.load_crl(crl_data).revoked_serial_numbers
+    else:
+        _worker_state['revoked_serial_numbers'] = None
+    now = datetime.utcnow()
+    _worker_state['now'] = now
+    _worker_state['expiry_warning_time'] = now + timedelta(days=expiry_warning_days)
+
+
+def _audit_item(item: AuditItem) -> dict:
+    cert_tool = _worker_state['cert_tool']
+    issues = []
+    result = dict(id=item.id, issues=issues)
+
+    if not item.cert:
+        issues.append(dict(check='cert', msg='cert is missing'))
+        return result
+    try:
+        cert = cert_tool.load_cert(item.cert)
+    except CertToolError as e:
+        issues.append(dict(check='cert', msg=e.msg, detail=e.detail))
+        return result
+
+    serial_number = hex(cert.serial_number)[2:]
+    result['serial_number'] = serial_number
+    result['validity_end'] = cert.validity_end.isoformat()
+    if item.serial_number is not None and item.serial_number != serial_number:
+        issues.append(dict(check='metadata', msg='stored serial number does not match cert'))
+
+    # chain
+    try:
+        cert_tool.verify_cert_store(cert, _worker_state['store'], 'CA does not match')
+    except CertToolError as e:
+        issues.append(dict(check='chain', msg=e.msg, detail=e.detail))
+
+    # key match
+    if not item.pkey:
+        issues.append(dict(check='pkey', msg='pkey is missing'))
+    else:
+        try:
+            if not cert_tool.match_cert_pkey(cert, cert_tool.load_pkey(item.pkey)):
+                issues.append(dict(check='pkey', msg='pkey does not match'))
+        except CertToolError as e:
+            issues.append(dict(check='pkey', msg=e.msg, detail=e.detail))
+
+    # revocation consistency between the db and the CRL file
+    revoked_serial_numbers = _worker_state['revoked_serial_numbers']
+    if revoked_serial_numbers is not None:
+        in_crl = cert.serial_number in revoked_serial_numbers
+        if item.is_revoked and not in_crl:
+            issues.append(dict(check='revocation', msg='revoked credential is missing in CRL'))
+        elif not item.is_revoked and in_crl:
+            issues.append(dict(check='revocation', msg='active credential is listed in CRL'))
+
+    # expiry (only matters for active credentials)
+    if not item.is_revoked:
+        if cert.validity_end <= _worker_state['now']:
+            issues.append(dict(check='expiry', msg='cert has expired'))
+        elif cert.validity_end <= _worker_state['expiry_warning_time']:
+            issues.append(dict(check='expiry', msg='cert is expiring soon', level='warning'))
+    return result
+
+
+def _audit_chunk(chunk: List[AuditItem]) -> List[dict]:
+    return [_audit_item(item) for item in chunk]
+
+
+class CertAuditTool:
+    @staticmethod
+    def audit(items: Iterable[AuditItem], ca_cert_data: bytes, crl_data: Optional[bytes] = None,
+              expiry_warning_days: int = 30, workers: int = None, chunk_size: int = 64,
+              cert_tool: Type[CertTool] = CertTool) -> Iterator[dict]:
+        """
+        Audit the credentials in a process pool and yield one result for each of them, in the same order as the input.
+        The input is consumed lazily, so that it can be a stream from the database.
+        """
+        if not ca_cert_data:
+            raise CertAuditError('CA cert data is required')
+        if type(chunk_size) is not int or chunk_size <= 0:
+            raise CertAuditError('chunk size must be a positive integer')
+
+        return PoolTool.map_chunks(_audit_chunk, items, chunk_size, workers, initializer=_init_worker,
+                                   initargs=(cert_tool, ca_cert_data, crl_data, expiry_warning_days))
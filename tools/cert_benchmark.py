@@ -0,0 +1,68 @@
+"""
+Side-by-side benchmark of the CertTool backends.
+
+Usage: python -m tools.cert_benchmark [--keygen N] [--sign N] [--crl-entries N] [--parse N]
+"""
+import argparse
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Type
+
+from tools.cert import CertTool, BuildPKeyParams, BuildCertParams
+
+
+def _measure(func: Callable[[], None], repeat: int) -> float:
+    """Returns the average time of each call in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def _cert_params(common_name: str) -> BuildCertParams:
+    now = datetime.utcnow()
+    return BuildCertParams(uuid.uuid4().int, now, now + timedelta(days=365), {'commonName': common_name})
+
+
+def run(tool: Type[CertTool], keygen: int, sign: int, crl_entries: int, parse: int) -> dict:
+    ca_pkey, ca_cert = tool.build_ca(BuildPKeyParams(2048), _cert_params('benchmark-ca'))
+    pkey, cert = tool.build_client(BuildPKeyParams(2048), _cert_params('benchmark-client'), ca_cert, ca_pkey)
+    cert_data, pkey_data = cert.dump(), pkey.dump()
+
+    now = datetime.utcnow()
+    revoke_list = [(uuid.uuid4().int, now) for _ in range(crl_entries)]
+    crl_data = tool.build_crl_from_serials(revoke_list, ca_cert, ca_pkey, 30).dump()
+
+    return {
+        # noinspection PyProtectedMember
+        'keygen (RSA 2048)': _measure(lambda: tool._build_pkey(BuildPKeyParams(2048)), keygen),
+        'sign client cert': _measure(lambda: tool.build_client_cert(pkey, _cert_params('c'), ca_cert, ca_pkey), sign),
+        'build CRL (%d entries)' % crl_entries: _measure(
+            lambda: tool.build_crl_from_serials(revoke_list, ca_cert, ca_pkey, 30), 1),
+        'parse CRL (%d entries)' % crl_entries: _measure(lambda: tool.load_crl(crl_data).revoked_serial_numbers, 1),
+        'parse cert PEM': _measure(lambda: tool.load_cert(cert_data), parse),
+        'parse pkey PEM': _measure(lambda: tool.load_pkey(pkey_data), parse),
+        'cert to_dict': _measure(lambda: tool.load_cert(cert_data).to_dict(), parse),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the CertTool backends')
+    parser.add_argument('--keygen', type=int, default=10, help='number of key generations')
+    parser.add_argument('--sign', type=int, default=200, help='number of cert signings')
+    parser.add_argument('--crl-entries', type=int, default=10000, help='number of revoked entries in the CRL')
+    parser.add_argument('--parse', type=int, default=2000, help='number of PEM parsings')
+    args = parser.parse_args()
+
+    backends = ['pyopenssl', 'cryptography']
+    results = {name: run(CertTool.get_backend(name), args.keygen, args.sign, args.crl_entries, args.parse)
+               for name in backends}
+
+    print('%-28s %14s %14s' % ('operation (ms/op)', *backends))
+    for op in results[backends[0]]:
+        print('%-28s %14.3f %14.3f' % (op, *(results[name][op] for name in backends)))
+
+
+if __name__ == '__main__':
+    main()
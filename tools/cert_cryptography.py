@@ -0,0 +1,473 @@
+# References:
+# - https://cryptography.io/en/latest/x509/reference/
+# - https://cryptography.io/en/latest/x509/tutorial/
+#
+# A CertTool backend built on the x509 builders of the 'cryptography' package. It exposes the same Cert/PKey/CRL
+# interface as the pyOpenSSL backend in tools/cert.py, without using the deprecated X509Extension, CRL and Revoked APIs
+# of pyOpenSSL. Select it with the 'cert_backend' setting of the credential service.
+
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, Iterable, Set
+
+from OpenSSL import crypto
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, dsa, ec, dh
+from cryptography.x509.oid import NameOID, ObjectIdentifier, ExtendedKeyUsageOID, ExtensionOID
+
+from tools.cert import Cert, PKey, CRL, CertTool, CertToolError, BuildCertParams, BuildPKeyParams
+
+# subject component names used by BuildCertParams (same as the attributes of pyOpenSSL's X509Name) => OID
+_name_to_oid = {
+    'countryName': NameOID.COUNTRY_NAME,
+    'stateOrProvinceName': NameOID.STATE_OR_PROVINCE_NAME,
+    'localityName': NameOID.LOCALITY_NAME,
+    'organizationName': NameOID.ORGANIZATION_NAME,
+    'organizationalUnitName': NameOID.ORGANIZATIONAL_UNIT_NAME,
+    'commonName': NameOID.COMMON_NAME,
+    'emailAddress': NameOID.EMAIL_ADDRESS,
+    'name': ObjectIdentifier('2.5.4.41'),
+    'serialNumber': NameOID.SERIAL_NUMBER,
+    'surname': NameOID.SURNAME,
+    'givenName': NameOID.GIVEN_NAME,
+    'title': NameOID.TITLE
+}
+
+# OID => OpenSSL short name, as used by the dict output of the pyOpenSSL backend
+_oid_to_short_name = {
+    NameOID.COUNTRY_NAME: 'C',
+    NameOID.STATE_OR_PROVINCE_NAME: 'ST',
+    NameOID.LOCALITY_NAME: 'L',
+    NameOID.ORGANIZATION_NAME: 'O',
+    NameOID.ORGANIZATIONAL_UNIT_NAME: 'OU',
+    NameOID.COMMON_NAME: 'CN',
+    NameOID.EMAIL_ADDRESS: 'emailAddress',
+    ObjectIdentifier('2.5.4.41'): 'name',
+    NameOID.SERIAL_NUMBER: 'serialNumber',
+    NameOID.SURNAME: 'SN',
+    NameOID.GIVEN_NAME: 'GN',
+    NameOID.TITLE: 'title'
+}
+
+_oid_ns_cert_type = ObjectIdentifier('2.16.840.1.113730.1.1')
+_oid_ns_comment = ObjectIdentifier('2.16.840.1.113730.1.13')
+
+_ext_oid_to_short_name = {
+    ExtensionOID.BASIC_CONSTRAINTS: 'basicConstraints',
+    ExtensionOID.KEY_USAGE: 'keyUsage',
+    ExtensionOID.EXTENDED_KEY_USAGE: 'extendedKeyUsage',
+    ExtensionOID.SUBJECT_KEY_IDENTIFIER: 'subjectKeyIdentifier',
+    ExtensionOID.AUTHORITY_KEY_IDENTIFIER: 'authorityKeyIdentifier',
+    ExtensionOID.SUBJECT_ALTERNATIVE_NAME: 'subjectAltName',
+    _oid_ns_cert_type: 'nsCertType',
+    _oid_ns_comment: 'nsComment'
+}
+
+
+def _key_type_to_str(key) -> str:
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return 'RSA'
+    if isinstance(key, (dsa.DSAPrivateKey, dsa.DSAPublicKey)):
+        return 'DSA'
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        return 'EC'
+    if isinstance(key, (dh.DHPrivateKey, dh.DHPublicKey)):
+        return 'DH'
+    raise CertToolError('unsupported key type', type(key).__name__)
+
+
+def _name_to_dict(name: x509.Name) -> dict:
+    return {_oid_to_short_name.get(attr.oid, attr.oid.dotted_string): attr.value for attr in name}
+
+
+def _name_to_oneline(name: x509.Name) -> str:
+    return ''.join('/%s=%s' % (k, v) for k, v in _name_to_dict(name).items())
+
+
+def _der_ia5_string(value: str) -> bytes:
+    data = value.encode('ascii')
+    if len(data) >= 0x80:
+        raise CertToolError('string too long for extension')
+    return bytes([0x16, len(data)]) + data
+
+
+def _hex_colon(data: bytes) -> str:
+    return ':'.join('%02X' % b for b in data)
+
+
+def _extension_to_text(ext: x509.Extension) -> str:
+    # an approximation of the text output of OpenSSL for the extensions we issue
+    value = ext.value
+    if isinstance(value, x509.BasicConstraints):
+        return 'CA:TRUE' if value.ca else 'CA:FALSE'
+    if isinstance(value, x509.SubjectKeyIdentifier):
+        return _hex_colon(value.digest)
+    if isinstance(value, x509.AuthorityKeyIdentifier):
+        lines = []
+        if value.key_identifier is not None:
+            lines.append('keyid:%s' % _hex_colon(value.key_identifier))
+        for general_name in value.authority_cert_issuer or ():
+            if isinstance(general_name, x509.DirectoryName):
+                lines.append('DirName:%s' % _name_to_oneline(general_name.value))
+        if value.authority_cert_serial_number is not None:
+            lines.append('serial:%s' % _hex_colon(_int_to_bytes(value.authority_cert_serial_number)))
+        return '\n'.join(lines)
+    if isinstance(value, x509.SubjectAlternativeName):
+        return ', '.join('DNS:%s' % n.value if isinstance(n, x509.DNSName) else str(n.value) for n in value)
+    if isinstance(value, x509.ExtendedKeyUsage):
+        names = {ExtendedKeyUsageOID.SERVER_AUTH: 'TLS Web Server Authentication',
+                 ExtendedKeyUsageOID.CLIENT_AUTH: 'TLS Web Client Authentication'}
+        return ', '.join(names.get(oid, oid.dotted_string) for oid in value)
+    if isinstance(value, x509.KeyUsage):
+        usages = []
+        if value.digital_signature:
+            usages.append('Digital Signature')
+        if value.key_encipherment:
+            usages.append('Key Encipherment')
+        if value.key_cert_sign:
+            usages.append('Certificate Sign')
+        if value.crl_sign:
+            usages.append('CRL Sign')
+        return ', '.join(usages)
+    if isinstance(value, x509.UnrecognizedExtension):
+        if ext.oid == _oid_ns_comment and len(value.value) >= 2 and value.value[0] == 0x16:
+            return value.value[2:].decode('ascii', 'replace')
+        if ext.oid == _oid_ns_cert_type and len(value.value) >= 4:
+            return 'SSL Server' if value.value[3] & 0x40 else 'SSL Client' if value.value[3] & 0x80 else ''
+        return _hex_colon(value.value)
+    return str(value)
+
+
+def _int_to_bytes(n: int) -> bytes:
+    return n.to_bytes((n.bit_length() + 7) // 8 or 1, 'big')
+
+
+def _to_naive_utc(time: datetime) -> datetime:
+    if time.tzinfo is not None:
+        time = (time - time.utcoffset()).replace(tzinfo=None)
+    return time
+
+
+class CryptographyCert(Cert):
+    # noinspection PyMissingConstructor
+    def __init__(self, x509_cert: x509.Certificate):
+        self._x509 = x509_cert
+
+    @property
+    def x509(self) -> x509.Certificate:
+        return self._x509
+
+    @property
+    def version(self) -> int:
+        return self._x509.version.value
+
+    @property
+    def signature_algorithm(self) -> str:
+        # noinspection PyProtectedMember
+        return self._x509.signature_algorithm_oid._name
+
+    @property
+    def validity_start(self) -> datetime:
+        # the *_utc properties are only available in cryptography>=42
+        if hasattr(self._x509, 'not_valid_before_utc'):
+            return _to_naive_utc(self._x509.not_valid_before_utc)
+        return self._x509.not_valid_before
+
+    @property
+    def validity_end(self) -> datetime:
+        if hasattr(self._x509, 'not_valid_after_utc'):
+            return _to_naive_utc(self._x509.not_valid_after_utc)
+        return self._x509.not_valid_after
+
+    @property
+    def common_name(self) -> Optional[str]:
+        attrs = self._x509.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+        return attrs[-1].value if attrs else None
+
+    @property
+    def serial_number(self) -> int:
+        return self._x509.serial_number
+
+    @property
+    def public_key_type(self) -> str:
+        return _key_type_to_str(self._x509.public_key())
+
+    @property
+    def public_key_bits(self) -> int:
+        return self._x509.public_key().key_size
+
+    def dump(self) -> bytes:
+        return self._x509.public_bytes(serialization.Encoding.PEM)
+
+    def dump_text(self) -> str:
+        # cryptography has no text output, borrow it from pyOpenSSL
+        return crypto.dump_certificate(crypto.FILETYPE_TEXT, crypto.X509.from_cryptography(self._x509)).decode()
+
+    def to_dict(self) -> dict:
+        ext_list = [dict(name=_ext_oid_to_short_name.get(ext.oid, ext.oid.dotted_string),
+                         is_critical=ext.critical,
+                         text=_extension_to_text(ext))
+                    for ext in self._x509.extensions]
+        return {
+            'version': self.version,
+            'subject': _name_to_dict(self._x509.subject),
+            'issuer': _name_to_dict(self._x509.issuer),
+            'serial_number': hex(self.serial_number)[2:],
+            'validity_start': self.validity_start,
+            'validity_end': self.validity_end,
+            'signature_algorithm': self.signature_algorithm,
+            'extensions': ext_list,
+            'public_key': {
+                'type': self.public_key_type,
+                'bits': self.public_key_bits
+            }
+        }
+
+
+class CryptographyPKey(PKey):
+    # noinspection PyMissingConstructor
+    def __init__(self, pkey):
+        self._pkey = pkey
+
+    def __repr__(self):
+        return '<PrivateKey (%d bits)>' % self._pkey.key_size
+
+    @property
+    def pkey(self):
+        return self._pkey
+
+    def dump(self) -> bytes:
+        return self._pkey.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                        serialization.NoEncryption())
+
+    def dump_text(self) -> str:
+        return crypto.dump_privatekey(crypto.FILETYPE_TEXT, crypto.PKey.from_cryptography_key(self._pkey)).decode()
+
+    def to_dict(self) -> dict:
+        return {
+            'type': _key_type_to_str(self._pkey),
+            'bits': self._pkey.key_size
+        }
+
+
+class CryptographyCRL(CRL):
+    # noinspection PyMissingConstructor
+    def __init__(self, crl: x509.CertificateRevocationList):
+        self._crl = crl
+
+    @property
+    def crl(self) -> x509.CertificateRevocationList:
+        return self._crl
+
+    @property
+    def revoked_serial_numbers(self) -> Set[int]:
+        return {revoked.serial_number for revoked in self._crl}
+
+    def dump(self) -> bytes:
+        return self._crl.public_bytes(serialization.Encoding.PEM)
+
+    def dump_text(self) -> str:
+        return crypto.dump_crl(crypto.FILETYPE_TEXT, crypto.CRL.from_cryptography(self._crl)).decode()
+
+
+class CryptographyStore:
+    """Replacement of X509Store for a single-level CA, which is what OpenVPN deployments use."""
+
+    def __init__(self, ca_cert: CryptographyCert, crl: CryptographyCRL = None, verify_time: datetime = None):
+        self.ca_cert = ca_cert
+        self.crl = crl
+        self.verify_time = verify_time
+        self.revoked_serial_numbers = crl.revoked_serial_numbers if crl is not None else None
+
+
+class CryptographyCertTool(CertTool):
+    @staticmethod
+    def _hash():
+        return hashes.SHA256()
+
+    @staticmethod
+    def load_cert(cert_data: bytes) -> CryptographyCert:
+        if not cert_data:
+            raise CertToolError('cert data must not be empty')
+        try:
+            return CryptographyCert(x509.load_pem_x509_certificate(cert_data))
+        except ValueError as e:
+            raise CertToolError('cert load failed', str(e))
+
+    @staticmethod
+    def load_pkey(pkey_data: bytes, passphrase=None) -> CryptographyPKey:
+        if not pkey_data:
+            raise CertToolError('pkey data must not be empty')
+        if isinstance(passphrase, str):
+            passphrase = passphrase.encode()
+        try:
+            return CryptographyPKey(serialization.load_pem_private_key(pkey_data, passphrase))
+        except (ValueError, TypeError) as e:
+            raise CertToolError('pkey load failed', str(e))
+
+    @staticmethod
+    def load_crl(crl_data: bytes) -> CryptographyCRL:
+        if not crl_data:
+            raise CertToolError('crl data must not be empty')
+        try:
+            return CryptographyCRL(x509.load_pem_x509_crl(crl_data))
+        except ValueError as e:
+            raise CertToolError('crl load failed', str(e))
+
+    @staticmethod
+    def build_store(ca_cert: CryptographyCert, crl: CryptographyCRL = None,
+                    verify_time: datetime = None) -> CryptographyStore:
+        return CryptographyStore(ca_cert, crl, verify_time)
+
+    @staticmethod
+    def verify_cert_store(cert: CryptographyCert, store: CryptographyStore,
+                          error_msg: str = 'cert verification failed'):
+        ca_cert = store.ca_cert
+        now = store.verify_time or datetime.utcnow()
+        if cert.x509.issuer != ca_cert.x509.subject:
+            raise CertToolError(error_msg, 'unable to get local issuer certificate')
+        try:
+            cert.x509.verify_directly_issued_by(ca_cert.x509)
+        except (ValueError, TypeError, InvalidSignature):
+            raise CertToolError(error_msg, 'certificate signature failure')
+        if now < cert.validity_start:
+            raise CertToolError(error_msg, 'certificate is not yet valid')
+        if now > cert.validity_end:
+            raise CertToolError(error_msg, 'certificate has expired')
+
+        if store.crl is not None:
+            crl = store.crl.crl
+            if crl.issuer != ca_cert.x509.subject or not crl.is_signature_valid(ca_cert.x509.public_key()):
+                raise CertToolError(error_msg, 'CRL signature failure')
+            if crl.next_update is not None and now > _to_naive_utc(crl.next_update):
+                raise CertToolError(error_msg, 'CRL has expired')
+            if cert.serial_number in store.revoked_serial_numbers:
+                raise CertToolError(error_msg, 'certificate revoked')
+
+    @classmethod
+    def verify_cert_pkey(cls, cert: CryptographyCert, pkey: CryptographyPKey):
+        if not cls.match_cert_pkey(cert, pkey):
+            raise CertToolError('pkey does not match')
+
+    @staticmethod
+    def match_cert_pkey(cert: CryptographyCert, pkey: CryptographyPKey) -> bool:
+        if cert is None:
+            raise CertToolError('cert is required')
+        if pkey is None:
+            raise CertToolError('pkey is required')
+
+        encoding = serialization.Encoding.DER
+        public_format = serialization.PublicFormat.SubjectPublicKeyInfo
+        return cert.x509.public_key().public_bytes(encoding, public_format) == \
+            pkey.pkey.public_key().public_bytes(encoding, public_format)
+
+    @staticmethod
+    def _build_pkey(params: BuildPKeyParams):
+        return rsa.generate_private_key(public_exponent=65537, key_size=params.key_length)
+
+    @staticmethod
+    def _build_name(components: dict) -> x509.Name:
+        attrs = []
+        for k, v in components.items():
+            oid = _name_to_oid.get(k)
+            if oid is None:
+                raise CertToolError('unsupported subject component', k)
+            attrs.append(x509.NameAttribute(oid, v))
+        return x509.Name(attrs)
+
+    @classmethod
+    def _build_cert(cls, params: BuildCertParams, public_key, issuer: x509.Name) -> x509.CertificateBuilder:
+        return x509.CertificateBuilder() \
+            .serial_number(params.serial_number) \
+            .not_valid_before(params.validity_start) \
+            .not_valid_after(params.validity_end) \
+            .subject_name(cls._build_name(params.subject_components)) \
+            .issuer_name(issuer) \
+            .public_key(public_key)
+
+    @staticmethod
+    def _authority_key_identifier(ca_cert: x509.Certificate = None, ca_public_key=None, ca_subject: x509.Name = None,
+                                  ca_serial_number: int = None) -> x509.AuthorityKeyIdentifier:
+        # equivalent of 'keyid:always,issuer:always'
+        if ca_cert is not None:
+            ca_public_key = ca_cert.public_key()
+            ca_subject = ca_cert.issuer
+            ca_serial_number = ca_cert.serial_number
+        return x509.AuthorityKeyIdentifier(
+            key_identifier=x509.SubjectKeyIdentifier.from_public_key(ca_public_key).digest,
+            authority_cert_issuer=[x509.DirectoryName(ca_subject)],
+            authority_cert_serial_number=ca_serial_number
+        )
+
+    @classmethod
+    def build_ca(cls, pkey_params: BuildPKeyParams, cert_params: BuildCertParams) \
+            -> Tuple[CryptographyPKey, CryptographyCert]:
+        key = cls._build_pkey(pkey_params)
+        subject = cls._build_name(cert_params.subject_components)
+        builder = cls._build_cert(cert_params, key.public_key(), subject) \
+            .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False) \
+            .add_extension(cls._authority_key_identifier(ca_public_key=key.public_key(), ca_subject=subject,
+                                                         ca_serial_number=cert_params.serial_number), critical=False) \
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=False)
+        cert = builder.sign(key, cls._hash())
+        return CryptographyPKey(key), CryptographyCert(cert)
+
+    @classmethod
+    def build_server(cls, pkey_params: BuildPKeyParams, cert_params: BuildCertParams,
+                     ca_cert: CryptographyCert, ca_pkey: CryptographyPKey) -> Tuple[CryptographyPKey, CryptographyCert]:
+        key = cls._build_pkey(pkey_params)
+        builder = cls._build_cert(cert_params, key.public_key(), ca_cert.x509.subject) \
+            .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=False) \
+            .add_extension(x509.UnrecognizedExtension(_oid_ns_cert_type, b'\x03\x02\x06\x40'), critical=False) \
+            .add_extension(x509.UnrecognizedExtension(
+                _oid_ns_comment, _der_ia5_string('Python Generated Server Certificate')), critical=False) \
+            .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False) \
+            .add_extension(cls._authority_key_identifier(ca_cert.x509), critical=False) \
+            .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.SERVER_AUTH]), critical=False) \
+            .add_extension(x509.KeyUsage(digital_signature=True, content_commitment=False, key_encipherment=True,
+                                         data_encipherment=False, key_agreement=False, key_cert_sign=False,
+                                         crl_sign=False, encipher_only=False, decipher_only=False), critical=False) \
+            .add_extension(x509.SubjectAlternativeName(
+                [x509.DNSName(cert_params.subject_components.get('commonName'))]), critical=False)
+        cert = builder.sign(ca_pkey.pkey, cls._hash())
+        return CryptographyPKey(key), CryptographyCert(cert)
+
+    @classmethod
+    def build_client(cls, pkey_params: BuildPKeyParams, cert_params: BuildCertParams,
+                     ca_cert: CryptographyCert, ca_pkey: CryptographyPKey) -> Tuple[CryptographyPKey, CryptographyCert]:
+        pkey = CryptographyPKey(cls._build_pkey(pkey_params))
+        return pkey, cls.build_client_cert(pkey, cert_params, ca_cert, ca_pkey)
+
+    @classmethod
+    def build_client_cert(cls, pkey: CryptographyPKey, cert_params: BuildCertParams,
+                          ca_cert: CryptographyCert, ca_pkey: CryptographyPKey) -> CryptographyCert:
+        public_key = pkey.pkey.public_key()
+        builder = cls._build_cert(cert_params, public_key, ca_cert.x509.subject) \
+            .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=False) \
+            .add_extension(x509.UnrecognizedExtension(
+                _oid_ns_comment, _der_ia5_string('Python Generated Client Certificate')), critical=False) \
+            .add_extension(x509.SubjectKeyIdentifier.from_public_key(public_key), critical=False) \
+            .add_extension(cls._authority_key_identifier(ca_cert.x509), critical=False) \
+            .add_extension(x509.ExtendedKeyUsage([ExtendedKeyUsageOID.CLIENT_AUTH]), critical=False) \
+            .add_extension(x509.KeyUsage(digital_signature=True, content_commitment=False, key_encipherment=False,
+                                         data_encipherment=False, key_agreement=False, key_cert_sign=False,
+                                         crl_sign=False, encipher_only=False, decipher_only=False), critical=False) \
+            .add_extension(x509.SubjectAlternativeName(
+                [x509.DNSName(cert_params.subject_components.get('commonName'))]), critical=False)
+        return CryptographyCert(builder.sign(ca_pkey.pkey, cls._hash()))
+
+    @classmethod
+    def build_crl_from_serials(cls, serial_revoke_list: Iterable[Tuple[int, datetime]],
+                               ca_cert: CryptographyCert, ca_pkey: CryptographyPKey,
+                               validity_days: int) -> CryptographyCRL:
+        # unlike pyOpenSSL, nextUpdate can be set directly
+        now = datetime.utcnow()
+        builder = x509.CertificateRevocationListBuilder() \
+            .issuer_name(ca_cert.x509.subject) \
+            .last_update(now) \
+            .next_update(now + timedelta(days=validity_days))
+        for serial_number, revoke_time in serial_revoke_list:
+            builder = builder.add_revoked_certificate(
+                x509.RevokedCertificateBuilder().serial_number(serial_number).revocation_date(revoke_time).build())
+        return CryptographyCRL(builder.sign(ca_pkey.pkey, cls._hash()))
@@ -0,0 +1,55 @@
+from typing import Any, Iterable, Iterator, NamedTuple, List, Type
+
+from error import BasicError
+from tools.cert import CertTool, BuildPKeyParams, BuildCertParams
+from tools.pool import PoolTool
+
+# Per-process state of the pool workers, the CA cert and pkey are loaded once in each worker by the initializer
+_worker_state = {}
+
+
+class CertIssueError(BasicError):
+    pass
+
+
+class IssueRequest(NamedTuple):
+    key: Any  # passed through to the result, e.g. the client id
+    pkey_params: BuildPKeyParams
+    cert_params: BuildCertParams
+
+
+class IssueResult(NamedTuple):
+    key: Any
+    cert: bytes
+    pkey: bytes
+
+
+def _init_worker(cert_tool: Type[CertTool], ca_cert_data: bytes, ca_pkey_data: bytes):
+    _worker_state['cert_tool'] = cert_tool
+    _worker_state['ca_cert'] = cert_tool.load_cert(ca_cert_data)
+    _worker_state['ca_pkey'] = cert_tool.load_pkey(ca_pkey_data)
+
+
+def _issue_chunk(chunk: List[IssueRequest]) -> List[IssueResult]:
+    cert_tool = _worker_state['cert_tool']
+    results = []
+    for request in chunk:
+        pkey, cert = cert_tool.build_client(request.pkey_params, request.cert_params,
+                                            _worker_state['ca_cert'], _worker_state['ca_pkey'])
+        results.append(IssueResult(request.key, cert.dump(), pkey.dump()))
+    return results
+
+
+class CertIssueTool:
+    @staticmethod
+    def issue(requests: Iterable[IssueRequest], ca_cert_data: bytes, ca_pkey_data: bytes, workers: int = None,
+              chunk_size: int = 16, cert_tool: Type[CertTool] = CertTool) -> Iterator[IssueResult]:
+        """
+        Build the client pkeys and certs in a process pool, as the key generation is CPU bound, and yield one result
+        for each request in the same order as the input.
+        """
+        if not ca_cert_data or not ca_pkey_data:
+            raise CertIssueError('CA cert and pkey data are required')
+
+        return PoolTool.map_chunks(_issue_chunk, requests, chunk_size, workers, initializer=_init_worker,
+                                   initargs=(cert_tool, ca_cert_data, ca_pkey_data))
@@ -1,46 +1,84 @@
 import os
-from typing import List, Tuple
+from threading import Lock
+from typing import Iterable, Iterator, List, Tuple, Type
 
 from error import BasicError
-from tools.cert import PKey, Cert
+from tools.cert import PKey, Cert, CertTool
+from tools.config_parser import ConfigParser, ConfigParserError, Directive
 
 
 class ConfigToolError(BasicError):
     pass
 
 
+class ClientConfigTemplate:
+    """
+    Pre-rendered static parts of a client config: the prefix (base config + <ca> block) and the suffix (<tls-auth>
+    block). Rendering a config only splices in the PEM data of the client cert and pkey.
+    """
+
+    def __init__(self, prefix: str, suffix: str, source_mtimes: tuple):
+        self._prefix = prefix
+        self._suffix = suffix
+        self.source_mtimes = source_mtimes
+
+    def render(self, cert_data: bytes, pkey_data: bytes) -> str:
+        if not cert_data:
+            raise ConfigToolError('client cert data is required')
+        if not pkey_data:
+            raise ConfigToolError('client pkey data is required')
+
+        return ''.join((self._prefix,
+                        '<cert>\n', cert_data.decode(), '</cert>\n',
+                        '<key>\n', pkey_data.decode(), '</key>\n',
+                        self._suffix))
+
+
 class ConfigTool:
+    # (base config path, CA cert path, tls auth key path) => ClientConfigTemplate
+    _client_config_templates = {}
+    _client_config_templates_lock = Lock()
+
     @staticmethod
-    def load_server_config(config_path: str) -> List[str]:
+    def load_server_config(config_path: str) -> Iterator[Directive]:
+        """Parse the server config lazily, the file is read while iterating over the directives."""
         if not config_path:
             raise ConfigToolError('config path is required')
         if not os.path.exists(config_path):
             raise ConfigToolError('config does not exist')
 
-        lines = []
-        with open(config_path) as f:
-            for line in f:
-                line = line.strip()
-                if not line or line[0] == '#' or line[0] == ';':
-                    continue
-                lines.append(line)
-        return lines
+        return ConfigTool._wrap_parser_errors(ConfigParser.iter_file_directives(config_path))
 
     @staticmethod
-    def extract_server_routes_from_configs(configs: List[str]) -> List[Tuple[str, str]]:
-        results = []
-        for config in configs:
-            parts = config.split(None, 1)
-            if len(parts) < 2 or parts[0] != 'push':
-                continue
-            content = parts[1].strip("\'\"").strip().split()
-            if len(content) != 3 or content[0] != 'route':
+    def parse_server_config(lines: Iterable[str]) -> Iterator[Directive]:
+        return ConfigTool._wrap_parser_errors(ConfigParser.iter_directives(lines))
+
+    @staticmethod
+    def _wrap_parser_errors(directives: Iterator[Directive]) -> Iterator[Directive]:
+        try:
+            yield from directives
+        except ConfigParserError as e:
+            raise ConfigToolError('invalid config: %s' % e.msg, e.detail)
+
+    @staticmethod
+    def extract_server_routes(directives: Iterable[Directive]) -> Iterator[Tuple[str, str]]:
+        """Yield (ip, mask) of the pushed routes. The mask of IPv6 routes is the prefix length."""
+        for directive in directives:
+            pushed = directive.get_pushed()
+            if pushed is None or not pushed.args:
                 continue
-            results.append((content[1], content[2]))
-        return results
+            if pushed.name == 'route':
+                # route network [netmask] [gateway] [metric]
+                yield pushed.args[0], pushed.args[1] if len(pushed.args) > 1 else '255.255.255.255'
+            elif pushed.name == 'route-ipv6':
+                # route-ipv6 network/bits [gateway] [metric]
+                ip, _, prefix_length = pushed.args[0].partition('/')
+                yield ip, prefix_length or '128'
 
     @staticmethod
     def server_route_to_config(ip: str, mask: str) -> str:
+        if ':' in ip:  # IPv6 routes are given with a prefix length as the mask
+            return 'push "route-ipv6 %s/%s"' % (ip, mask)
         return 'push "route %s %s"' % (ip, mask)
 
     @staticmethod
@@ -93,3 +131,49 @@ class ConfigTool:
             tls_auth_key
         )
         return full_config
+
+    @staticmethod
+    def _get_mtimes(*paths: str) -> tuple:
+        try:
+            return tuple(os.stat(path).st_mtime_ns for path in paths)
+        except OSError as e:
+            raise ConfigToolError('failed to stat config source', str(e))
+
+    @classmethod
+    def get_client_config_template(cls, base_config_path: str, ca_cert_path: str, tls_auth_key_path: str,
+                                   cert_tool: Type[CertTool] = CertTool) -> ClientConfigTemplate:
+        """
+        Get the cached template for the given sources. The template is rebuilt when any of the source files has been
+        modified since it was built.
+        """
+        if not base_config_path:
+            raise ConfigToolError('base config path is required')
+        if not ca_cert_path:
+            raise ConfigToolError('CA cert path is required')
+        if not tls_auth_key_path:
+            raise ConfigToolError('tls auth key path is required')
+
+        key = (base_config_path, ca_cert_path, tls_auth_key_path)
+        mtimes = cls._get_mtimes(*key)
+        template = cls._client_config_templates.get(key)
+        if template is not None and template.source_mtimes == mtimes:
+            return template
+
+        with cls._client_config_templates_lock:
+            template = cls._client_config_templates.get(key)
+            if template is not None and template.source_mtimes == mtimes:  # built by another thread
+                return template
+
+            with open(base_config_path) as f:
+                base_config = f.read()
+            with open(tls_auth_key_path) as f:
+                tls_auth_key = f.read()
+            # dump the parsed CA cert instead of using the file content, which may contain a text dump before the PEM
+            ca_cert = cert_tool.load_cert_file(ca_cert_path)
+
+            # same layout as build_client_config()
+            prefix = '%s\n<ca>\n%s</ca>\n' % (base_config, ca_cert.dump().decode())
+            suffix = '<tls-auth>\n%s</tls-auth>\n' % tls_auth_key
+            template = ClientConfigTemplate(prefix, suffix, mtimes)
+            cls._client_config_templates[key] = template
+            return template
@@ -0,0 +1,121 @@
+import re
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from error import BasicError
+
+
+class ConfigParserError(BasicError):
+    pass
+
+
+class Directive(NamedTuple):
+    name: str
+    args: List[str]
+    line_number: int  # of the directive, or of the opening tag of an inline block
+    inline: Optional[str] = None  # content of an inline block, e.g. <ca>...</ca>
+
+    def get_pushed(self) -> Optional['Directive']:
+        """Parse the option pushed by a push directive, e.g. push "route 10.0.0.0 255.0.0.0"."""
+        if self.name != 'push' or len(self.args) != 1:
+            return None
+        args = ConfigParser.split_line(self.args[0], self.line_number)
+        if not args:
+            return None
+        return Directive(args[0], args[1:], self.line_number)
+
+
+class ConfigParser:
+    """
+    Streaming parser of the OpenVPN config syntax. Lines are consumed one at a time and directives are yielded as
+    soon as they are complete, so that large generated configs are parsed in linear time and constant memory (apart
+    from inline blocks).
+    """
+    _inline_start_regex = re.compile(r'^<([a-zA-Z0-9_-]+)>$')
+
+    @staticmethod
+    def split_line(line: str, line_number: int = 0) -> List[str]:
+        """
+        Split a line into arguments like OpenVPN does: arguments are separated by whitespace and may be quoted with
+        double or single quotes, a backslash escapes the next char except in single quotes, and a comment starts with
+        '#' or ';' at the beginning of an argument.
+        """
+        if '"' not in line and "'" not in line and '\\' not in line:  # fast path for the most common lines
+            args = line.split()
+            for i, arg in enumerate(args):
+                if arg[0] in '#;':
+                    return args[:i]
+            return args
+
+        args = []
+        current = []
+        in_arg = False
+        quote = None
+        i = 0
+        length = len(line)
+        while i < length:
+            c = line[i]
+            if quote is None:
+                if c.isspace():
+                    if in_arg:
+                        args.append(''.join(current))
+                        current = []
+                        in_arg = False
+                elif c in '#;' and not in_arg:
+                    break
+                elif c in '"\'':
+                    quote = c
+                    in_arg = True
+                elif c == '\\' and i + 1 < length:
+                    i += 1
+                    current.append(line[i])
+                    in_arg = True
+                else:
+                    current.append(c)
+                    in_arg = True
+            elif c == quote:
+                quote = None
+            elif c == '\\' and quote == '"' and i + 1 < length:
+                i += 1
+                current.append(line[i])
+            else:
+                current.append(c)
+            i += 1
+        if quote is not None:
+            raise ConfigParserError('unterminated quote', dict(line_number=line_number))
+        if in_arg:
+            args.append(''.join(current))
+        return args
+
+    @classmethod
+    def iter_directives(cls, lines: Iterable[str]) -> Iterator[Directive]:
+        inline_name = None
+        inline_line_number = 0
+        inline_lines = []
+        for line_number, line in enumerate(lines, 1):
+            if inline_name is not None:
+                if line.strip() == '</%s>' % inline_name:
+                    yield Directive(inline_name, [], inline_line_number, ''.join(inline_lines))
+                    inline_name = None
+                    inline_lines = []
+                else:
+                    inline_lines.append(line if line.endswith('\n') else line + '\n')
+                continue
+
+            stripped = line.strip()
+            match = stripped.startswith('<') and cls._inline_start_regex.match(stripped)
+            if match:
+                inline_name = match.group(1)
+                inline_line_number = line_number
+                continue
+
+            args = cls.split_line(stripped, line_number)
+            if args:
+                # like the command line options, the names may be given with the leading dashes
+                yield Directive(args[0].lstrip('-'), args[1:], line_number)
+        if inline_name is not None:
+            raise ConfigParserError('unterminated inline block', dict(name=inline_name, line_number=inline_line_number))
+
+    @classmethod
+    def iter_file_directives(cls, path: str) -> Iterator[Directive]:
+        with open(path) as f:
+            yield from cls.iter_directives(f)
@@ -0,0 +1,52 @@
+import logging
+from threading import Lock, Timer
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class Debouncer:
+    """
+    Coalesce a burst of triggers into a single call of the callback, which runs in a background thread after `delay`
+    seconds from the first trigger of the burst. Triggers that arrive while the callback is running schedule one more
+    call afterwards, so that no change is missed.
+    """
+
+    def __init__(self, callback: Callable[[], None], delay: float = 1.0):
+        self._callback = callback
+        self._delay = delay
+        self._lock = Lock()
+        self._run_lock = Lock()  # avoid running the callback concurrently, e.g. flush() during a timer call
+        self._timer = None
+
+    @property
+    def is_pending(self) -> bool:
+        with self._lock:
+            return self._timer is not None
+
+    def trigger(self):
+        with self._lock:
+            if self._timer is not None:  # a call has been scheduled, which will cover this trigger
+                return
+            self._timer = Timer(self._delay, self._run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Run the pending call (if any) immediately in the current thread."""
+        with self._lock:
+            if self._timer is None:
+                return
+            self._timer.cancel()
+        self._run()
+
+    def _run(self):
+        with self._run_lock:
+            with self._lock:
+                if self._timer is None:  # already run by flush()
+                    return
+                self._timer = None  # new triggers from now on schedule another call
+            try:
+                self._callback()
+            except Exception as e:
+                logger.error('debounced call failed', exc_info=e)
@@ -0,0 +1,148 @@
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, List, Type
+
+from error import BasicError
+from tools.cert import CertTool, CertToolError
+from tools.pool import PoolTool
+
+# Per-process state of the pool workers, the CA store is built once in each worker by the initializer
+_worker_state = {}
+
+
+class EasyRsaError(BasicError):
+    pass
+
+
+class IndexEntry(NamedTuple):
+    status: str  # 'V' (valid), 'R' (revoked) or 'E' (expired)
+    expires_at: datetime
+    revoked_at: Optional[datetime]
+    serial_number: int
+    subject: str
+
+
+class PkiItem(NamedTuple):
+    cert_path: str
+    pkey_path: str
+
+
+class PkiItemResult(NamedTuple):
+    cert_path: str
+    cert: Optional[bytes]  # dumped again, as stored by the other imports
+    pkey: Optional[bytes]
+    serial_number: Optional[int]
+    common_name: Optional[str]
+    error: Optional[dict]  # dict(msg, detail) if the item cannot be imported
+
+
+def _parse_time(value: str) -> datetime:
+    # UTCTime (YYMMDDHHMMSSZ) or GeneralizedTime (YYYYMMDDHHMMSSZ) as written by OpenSSL
+    return datetime.strptime(value, '%y%m%d%H%M%SZ' if len(value) == 13 else '%Y%m%d%H%M%SZ')
+
+
+def _init_worker(cert_tool: Type[CertTool], ca_cert_data: bytes, passphrase: Optional[bytes]):
+    _worker_state['cert_tool'] = cert_tool
+    ca_cert = cert_tool.load_cert(ca_cert_data)
+    _worker_state['ca_cert'] = ca_cert
+    _worker_state['store'] = cert_tool.build_store(ca_cert)
+    _worker_state['passphrase'] = passphrase
+    _worker_state['now'] = datetime.utcnow()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _verify_item(item: PkiItem) -> PkiItemResult:
+    cert_tool = _worker_state['cert_tool']
+    try:
+        if not os.path.isfile(item.pkey_path):
+            raise CertToolError('pkey file does not exist')
+        cert = cert_tool.load_cert(_read_file(item.cert_path))
+        pkey = cert_tool.load_pkey(_read_file(item.pkey_path), _worker_state['passphrase'])
+        if not cert_tool.match_cert_pkey(cert, pkey):
+            raise CertToolError('pkey does not match')
+        store = _worker_state['store']
+        if cert.validity_end <= _worker_state['now']:
+            # expired certs still have to be imported if revoked, as the CRL lists them, so their chain is verified
+            # as of their issuance (the rare expired certs do not share the store)
+            ca_cert = _worker_state['ca_cert']
+            store = cert_tool.build_store(ca_cert, verify_time=max(cert.validity_start, ca_cert.validity_start))
+        cert_tool.verify_cert_store(cert, store, 'CA does not match')
+    except CertToolError as e:
+        return PkiItemResult(item.cert_path, None, None, None, None, dict(msg=e.msg, detail=e.detail))
+    except OSError as e:
+        return PkiItemResult(item.cert_path, None, None, None, None, dict(msg='file read failed', detail=str(e)))
+    return PkiItemResult(item.cert_path, cert.dump(), pkey.dump(), cert.serial_number, cert.common_name, None)
+
+
+def _verify_chunk(chunk: List[PkiItem]) -> List[PkiItemResult]:
+    return [_verify_item(item) for item in chunk]
+
+
+class EasyRsaTool:
+    """Reading the PKI dir of EasyRSA 3: index.txt, issued/, private/ and revoked/."""
+
+    @staticmethod
+    def parse_index(lines: Iterable[str]) -> Dict[int, IndexEntry]:
+        """Parse the OpenSSL CA database (index.txt) into the entries by serial number."""
+        entries = {}
+        for line_number, line in enumerate(lines, 1):
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            fields = line.split('\t')
+            if len(fields) != 6 or fields[0] not in ('V', 'R', 'E'):
+                raise EasyRsaError('invalid index line', 'line %d' % line_number)
+            status, expires_at, revoked_at, serial_number, _, subject = fields
+            try:
+                # the revocation field may carry the reason after a comma
+                entry = IndexEntry(status, _parse_time(expires_at),
+                                   _parse_time(revoked_at.split(',')[0]) if status == 'R' else None,
+                                   int(serial_number, 16), subject)
+            except ValueError:
+                raise EasyRsaError('invalid index line', 'line %d' % line_number)
+            entries[entry.serial_number] = entry
+        return entries
+
+    @classmethod
+    def load_index(cls, pki_dir: str) -> Dict[int, IndexEntry]:
+        path = os.path.join(pki_dir, 'index.txt')
+        if not os.path.isfile(path):
+            raise EasyRsaError('index.txt does not exist')
+        with open(path) as f:
+            return cls.parse_index(f)
+
+    @staticmethod
+    def iter_items(pki_dir: str) -> Iterator[PkiItem]:
+        """
+        The current certs are issued/<name>.crt with the pkeys private/<name>.key. Revoking moves them to
+        revoked/certs_by_serial/<serial>.crt and revoked/private_by_serial/<serial>.key.
+        """
+        for cert_dir, pkey_dir in (('issued', 'private'),
+                                   (os.path.join('revoked', 'certs_by_serial'),
+                                    os.path.join('revoked', 'private_by_serial'))):
+            cert_dir = os.path.join(pki_dir, cert_dir)
+            if not os.path.isdir(cert_dir):
+                continue
+            for file_name in sorted(os.listdir(cert_dir)):
+                stem, ext = os.path.splitext(file_name)
+                if ext != '.crt':
+                    continue
+                yield PkiItem(os.path.join(cert_dir, file_name), os.path.join(pki_dir, pkey_dir, stem + '.key'))
+
+    @staticmethod
+    def verify(items: Iterable[PkiItem], ca_cert_data: bytes, passphrase: bytes = None, workers: int = None,
+               chunk_size: int = 64, cert_tool: Type[CertTool] = CertTool) -> Iterator[PkiItemResult]:
+        """
+        Load the cert and pkey files of the items and verify the pairs and the chains in a process pool, with one CA
+        store per worker. The expired certs are verified as of their issuance, it is up to the caller to skip them if
+        they are not revoked. Yields one result for each item in the same order as the input.
+        """
+        if not ca_cert_data:
+            raise EasyRsaError('CA cert data is required')
+
+        return PoolTool.map_chunks(_verify_chunk, items, chunk_size, workers, initializer=_init_worker,
+                                   initargs=(cert_tool, ca_cert_data, passphrase))
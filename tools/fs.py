@@ -0,0 +1,41 @@
+import os
+import tempfile
+from typing import Union
+
+from error import BasicError
+
+
+class FileToolError(BasicError):
+    pass
+
+
+class FileTool:
+    @staticmethod
+    def atomic_write(path: str, data: Union[bytes, str]):
+        """
+        Write the data to a temp file in the same folder and then rename it to the target path, so that readers never
+        see a partially written file. The permission bits of the existing file are kept.
+        """
+        if not path:
+            raise FileToolError('path is required')
+        if isinstance(data, str):
+            data = data.encode()
+
+        folder = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.%s.' % os.path.basename(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            else:
+                os.chmod(tmp_path, 0o644)  # mkstemp creates the file with 0600
+            os.replace(tmp_path, path)
+        except OSError as e:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise FileToolError('atomic write failed', str(e))
@@ -2,7 +2,7 @@ import logging
 import re
 import socket
 from threading import Lock
-from typing import List
+from typing import List, Iterable
 
 from error import BasicError
 
@@ -286,6 +286,19 @@ class ManagementSession:
             self._send('client-kill %d' % cid)
             self._recv()
 
+    def client_kill_by_common_names(self, common_names: Iterable[str]) -> List[dict]:
+        """Kill all the connected clients with the given common names. Returns the killed clients."""
+        common_names = set(common_names)
+        killed = []
+        for client in self.status().get('client_list') or []:
+            if client.get('common_name') in common_names:
+                try:
+                    self.client_kill(client['client_id'])
+                    killed.append(client)
+                except ManagementToolError as e:  # client may have disconnected already
+                    logger.warning('kill client %d failed', client['client_id'], exc_info=e)
+        return killed
+
     def signal(self, signal: str):
         with self._cmd_lock:
             if signal not in ManagementTool.signals:
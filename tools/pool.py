@@ -0,0 +1,50 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List
+
+from error import BasicError
+
+
+class PoolToolError(BasicError):
+    pass
+
+
+def _iter_chunks(items: Iterable, chunk_size: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class PoolTool:
+    @staticmethod
+    def map_chunks(func: Callable[[List[Any]], List[Any]], items: Iterable, chunk_size: int, workers: int = None,
+                   initializer: Callable = None, initargs: tuple = ()) -> Iterator[Any]:
+        """
+        Apply the function to the chunks of the items in a process pool, and yield the results of the items in the same
+        order as the input. The function takes a chunk (list) of items and returns the list of their results; both
+        must be picklable. The input is consumed lazily, so that it can be a stream from the database or a file.
+        """
+        if type(chunk_size) is not int or chunk_size <= 0:
+            raise PoolToolError('chunk size must be a positive integer')
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if type(workers) is not int or workers <= 0:
+            raise PoolToolError('workers must be a positive integer')
+
+        # Executor.map() submits the whole input at once, so submit the chunks manually and keep only a limited number
+        # of them in flight to keep the memory usage flat.
+        max_pending = workers * 2
+        with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+            pending = deque()
+            for chunk in _iter_chunks(items, chunk_size):
+                pending.append(executor.submit(func, chunk))
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
@@ -0,0 +1,42 @@
+import ipaddress
+from typing import Iterable, List, Tuple, Union
+
+from error import BasicError
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+class RouteToolError(BasicError):
+    pass
+
+
+class RouteTool:
+    @staticmethod
+    def to_network(ip: str, mask: str) -> Network:
+        """
+        Parse a route given as an address and a mask. The mask is a netmask for IPv4 (e.g. '10.0.0.0', '255.0.0.0')
+        and a prefix length for IPv6 (e.g. '2001:db8::', '32'). Host bits are cleared.
+        """
+        try:
+            return ipaddress.ip_network('%s/%s' % (ip, mask), strict=False)
+        except ValueError as e:
+            raise RouteToolError('invalid route', str(e))
+
+    @staticmethod
+    def from_network(network: Network) -> Tuple[str, str]:
+        if network.version == 4:
+            return str(network.network_address), str(network.netmask)
+        return str(network.network_address), str(network.prefixlen)
+
+    @classmethod
+    def optimize(cls, routes: Iterable[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """
+        Collapse the routes into the smallest equivalent set of networks: duplicates and networks contained in other
+        networks are removed, and adjacent networks are merged. The result is sorted by network.
+        """
+        networks = [cls.to_network(ip, mask) for ip, mask in routes]
+        results = []
+        for version in (4, 6):  # collapse_addresses() does not accept mixed versions
+            same_version = [network for network in networks if network.version == version]
+            results.extend(cls.from_network(network) for network in ipaddress.collapse_addresses(same_version))
+        return results